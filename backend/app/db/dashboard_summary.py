@@ -0,0 +1,146 @@
+"""
+Materialized dashboard data, maintained incrementally at ingest time.
+
+- dashboard_counters: one document with the card totals (references,
+  videos, persons_* output folders), bumped with $inc as uploads and jobs
+  happen.
+- recent_searches: one summary row per reference upload, refreshed when
+  the video job linked to it (see app.db.reference_links) completes.
+
+Both are backfilled from a one-off filesystem scan (counters the first time
+they are read, recent searches at startup), so existing installations need
+no migration step.
+"""
+import re
+from datetime import datetime
+from pathlib import Path
+from pymongo import DESCENDING
+from app.db.mongo import db
+from app.db.reference_links import backfill as backfill_reference_links, get_reference_link, reference_links
+
+dashboard_counters = db.dashboard_counters
+recent_searches = db.recent_searches
+
+COUNTERS_ID = "totals"
+RECENT_BACKFILL_ID = "recent_searches_backfill"  # marker doc: legacy references recorded
+COUNTER_FIELDS = ("total_references", "total_videos", "total_detections")
+REFERENCE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+DATA_DIR = Path("app/data")
+UPLOADS_DIR = DATA_DIR / "uploads"
+OUTPUTS_DIR = DATA_DIR / "outputs"
+VIDEOS_DIR = UPLOADS_DIR / "videos"
+
+_TIME_TAG_RE = re.compile(r"(\d{8}_\d{6})")
+
+
+# ----------------------------------------------------------------
+# Counters
+# ----------------------------------------------------------------
+def _scan_counters():
+    """Count from disk (what /dashboard/stats used to do on every request)."""
+    return {
+        "total_references": len([f for f in UPLOADS_DIR.iterdir()
+                                 if f.is_file() and f.suffix.lower() in REFERENCE_EXTENSIONS])
+        if UPLOADS_DIR.exists() else 0,
+        "total_videos": len(list(VIDEOS_DIR.glob("*/**/*.mp4"))) if VIDEOS_DIR.exists() else 0,
+        "total_detections": len([f for f in OUTPUTS_DIR.iterdir() if f.is_dir() and f.name.startswith("persons_")])
+        if OUTPUTS_DIR.exists() else 0,
+    }
+
+
+def increment_counter(field, amount=1):
+    """Bump one counter. Skipped until the counters doc exists, so the backfill scan does not count twice."""
+    dashboard_counters.update_one(
+        {"_id": COUNTERS_ID},
+        {"$inc": {field: amount}, "$set": {"updated_at": datetime.utcnow()}},
+    )
+
+
+def get_counters():
+    doc = dashboard_counters.find_one({"_id": COUNTERS_ID})
+    if doc is None:
+        counts = _scan_counters()
+        dashboard_counters.update_one(
+            {"_id": COUNTERS_ID},
+            {"$setOnInsert": {**counts, "updated_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        doc = dashboard_counters.find_one({"_id": COUNTERS_ID})
+    return {field: doc.get(field, 0) for field in COUNTER_FIELDS}
+
+
+# ----------------------------------------------------------------
+# Recent searches
+# ----------------------------------------------------------------
+def _job_summary(job_id):
+    """Match fields of a recent-searches row, from the linked job."""
+    job = db.video_jobs.find_one({"job_id": job_id}, {"frames_saved": 1, "persons_saved": 1}) if job_id else None
+    matches = job.get("persons_saved", 0) if job else 0
+    return {
+        "job_id": job_id,
+        "frames_processed": job.get("frames_saved", 0) if job else 0,
+        "match_count": matches,
+        "top_match_score": 0.8 if matches else 0.0,
+    }
+
+
+def record_reference(reference_image, gender=None, age=None, uploaded_at=None):
+    """Upsert the summary row for a reference upload (call after link_reference)."""
+    match = _TIME_TAG_RE.search(reference_image)
+    ref_time = match.group(1) if match else reference_image
+    link = get_reference_link(ref_time) or {}
+    recent_searches.update_one(
+        {"reference_id": ref_time},
+        {"$set": {
+            "reference_id": ref_time,
+            "reference_image": reference_image,
+            "reference_path": f"/uploads/{reference_image}",
+            "gender": gender if gender is not None else "Unknown",
+            "age": age if age is not None else "Unknown",
+            "uploaded_at": uploaded_at or datetime.utcnow(),
+            **_job_summary(link.get("job_id")),
+        }},
+        upsert=True,
+    )
+
+
+def refresh_job_summaries(job_id):
+    """Update the rows of every reference now linked to job_id."""
+    ref_times = [link["ref_time"] for link in reference_links.find({"job_id": job_id}, {"ref_time": 1})]
+    if not ref_times:
+        return 0
+    result = recent_searches.update_many({"reference_id": {"$in": ref_times}}, {"$set": _job_summary(job_id)})
+    return result.modified_count
+
+
+def ensure_recent_searches():
+    """
+    Record every reference uploaded before recent_searches existed (run at
+    startup). Links them to their jobs first; a marker document makes it a
+    one-off, whatever rows new uploads have added since.
+    """
+    if dashboard_counters.find_one({"_id": RECENT_BACKFILL_ID}) is not None:
+        return
+    if UPLOADS_DIR.exists():
+        backfill_reference_links(str(UPLOADS_DIR))
+        recorded = {row["reference_image"] for row in recent_searches.find({}, {"reference_image": 1})}
+        for ref in UPLOADS_DIR.iterdir():
+            if not ref.is_file() or ref.suffix.lower() not in REFERENCE_EXTENSIONS or ref.name in recorded:
+                continue
+            doc = db.reference_images.find_one({"filename": ref.name}, {"gender": 1, "age": 1}) or {}
+            record_reference(ref.name, doc.get("gender"), doc.get("age"),
+                             uploaded_at=datetime.utcfromtimestamp(ref.stat().st_mtime))
+    dashboard_counters.update_one(
+        {"_id": RECENT_BACKFILL_ID},
+        {"$setOnInsert": {"completed_at": datetime.utcnow()}},
+        upsert=True,
+    )
+
+
+def get_recent_searches(skip=0, limit=None):
+    """Summary rows, newest upload first."""
+    cursor = recent_searches.find({}, {"_id": 0, "uploaded_at": 0}).sort("uploaded_at", DESCENDING).skip(skip)
+    if limit:
+        cursor = cursor.limit(limit)
+    return list(cursor)
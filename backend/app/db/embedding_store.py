@@ -0,0 +1,98 @@
+import os
+import re
+import numpy as np
+from bson import Binary, ObjectId
+
+# ----------------------------------------------------------------
+# Embedding document format (db.embeddings)
+# ----------------------------------------------------------------
+# v1: "embedding" is a BSON list of doubles, frame number only in crop_path.
+# v2: "embedding" is raw little-endian float32/float16 bytes (BSON Binary),
+#     with "embedding_dtype", "embedding_dim", "frame_number" and "pts"
+#     (presentation timestamp in seconds) stored explicitly.
+
+SCHEMA_VERSION = 2
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float32")  # float32 | float16
+
+_FRAME_RE = re.compile(r"_frame_(\d+)")
+
+
+def encode_embedding(vector, dtype=EMBEDDING_DTYPE):
+    """Return the v2 fields for a vector: Binary payload, dtype and dim."""
+    arr = np.asarray(vector, dtype=np.dtype(dtype).newbyteorder("<")).reshape(-1)
+    return {
+        "embedding": Binary(arr.tobytes()),
+        "embedding_dtype": dtype,
+        "embedding_dim": int(arr.shape[0]),
+    }
+
+
+def decode_embedding(doc):
+    """Return a doc's embedding as a float32 vector (v1 or v2 format)."""
+    value = doc["embedding"]
+    if isinstance(value, (bytes, bytearray)):
+        dtype = np.dtype(doc.get("embedding_dtype", "float32")).newbyteorder("<")
+        return np.frombuffer(value, dtype=dtype).astype(np.float32)
+    return np.asarray(value, dtype=np.float32).reshape(-1)
+
+
+def decode_embedding_matrix(docs):
+    """Stack the embeddings of many docs into an (n, dim) float32 matrix."""
+    first = docs[0]["embedding"]
+    if isinstance(first, (bytes, bytearray)):
+        dtype = docs[0].get("embedding_dtype", "float32")
+        if all(isinstance(d["embedding"], (bytes, bytearray)) and d.get("embedding_dtype", "float32") == dtype
+               for d in docs):
+            # One buffer, one frombuffer call for the whole chunk
+            flat = np.frombuffer(b"".join(d["embedding"] for d in docs),
+                                 dtype=np.dtype(dtype).newbyteorder("<"))
+            return flat.reshape(len(docs), -1).astype(np.float32)
+    return np.stack([decode_embedding(d) for d in docs])
+
+
+def frame_number_from_path(crop_path):
+    """Parse 'person_1_frame_120.jpg' -> 120 (v1 docs only)."""
+    match = _FRAME_RE.search(os.path.basename(crop_path or ""))
+    return int(match.group(1)) if match else 0
+
+
+def frame_number_of(doc):
+    if doc.get("frame_number") is not None:
+        return int(doc["frame_number"])
+    return frame_number_from_path(doc.get("crop_path", ""))
+
+
+class EmbeddingWriter:
+    """
+    Buffers embedding documents and writes them with insert_many.
+    _ids are assigned client-side, so callers can reference a document
+    (e.g. in the ANN index) before it is flushed.
+    """
+
+    def __init__(self, collection, batch_size=256):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.written = 0
+        self._buffer = []
+
+    def add(self, doc):
+        doc.setdefault("_id", ObjectId())
+        doc.setdefault("schema_version", SCHEMA_VERSION)
+        self._buffer.append(doc)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+        return doc["_id"]
+
+    def flush(self):
+        if not self._buffer:
+            return
+        self.collection.insert_many(self._buffer, ordered=False)
+        self.written += len(self._buffer)
+        self._buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
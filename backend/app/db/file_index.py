@@ -0,0 +1,125 @@
+"""
+Filename -> path index for the images served over HTTP.
+
+The pipeline and reference enrollment register every image they write, so
+the file routes answer with one indexed lookup instead of walking the
+persons_* / frames_* / reference_crops folders. When the same filename
+exists in several folders (frame_0.jpg in every frames_* folder), the most
+recently registered file wins.
+
+Rebuild from disk (from backend/):
+    python -m app.db.file_index
+"""
+import os
+from datetime import datetime
+from pathlib import Path
+from pymongo import UpdateOne
+from app.db.mongo import db
+
+image_files = db.image_files
+
+DATA_DIR = Path("app/data")
+OUTPUTS_DIR = DATA_DIR / "outputs"
+UPLOADS_DIR = DATA_DIR / "uploads"
+REFERENCE_CROPS_DIR = DATA_DIR / "reference_crops"
+
+# Kinds of indexed images (where they live under app/data)
+KIND_PERSONS = "persons"
+KIND_FRAMES = "frames"
+KIND_REFERENCE_CROPS = "reference_crops"
+KIND_UPLOADS = "uploads"
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+
+def _entry(kind, path):
+    path = str(path)
+    filename = os.path.basename(path)
+    return {
+        "kind": kind,
+        "filename": filename,
+        "stem": os.path.splitext(filename)[0],
+        "path": path,
+        "registered_at": datetime.utcnow(),
+    }
+
+
+def register_files(kind, paths):
+    """Record (or repoint) the paths of freshly written files."""
+    ops = [
+        UpdateOne({"kind": kind, "filename": entry["filename"]}, {"$set": entry}, upsert=True)
+        for entry in (_entry(kind, p) for p in paths)
+    ]
+    if ops:
+        image_files.bulk_write(ops, ordered=False)
+
+
+def register_file(kind, path):
+    register_files(kind, [path])
+
+
+def lookup(filename, kinds):
+    """Path of `filename`, searching `kinds` in order; None if not indexed or gone from disk."""
+    docs = {d["kind"]: d for d in image_files.find({"filename": filename, "kind": {"$in": list(kinds)}},
+                                                   {"kind": 1, "path": 1})}
+    for kind in kinds:
+        doc = docs.get(kind)
+        if doc and os.path.exists(doc["path"]):
+            return doc["path"]
+    return None
+
+
+def lookup_stem(stem, kind):
+    """Path of any indexed `kind` file named `stem` + some extension."""
+    for doc in image_files.find({"stem": stem, "kind": kind}, {"path": 1}):
+        if os.path.exists(doc["path"]):
+            return doc["path"]
+    return None
+
+
+def _scan():
+    """Yield (kind, path) for every servable image on disk, oldest folders first."""
+    if OUTPUTS_DIR.exists():
+        for prefix, kind in (("persons_", KIND_PERSONS), ("frames_", KIND_FRAMES)):
+            for folder in sorted(OUTPUTS_DIR.glob(f"{prefix}*")):
+                for f in folder.iterdir():
+                    if f.is_file():
+                        yield kind, f
+    if REFERENCE_CROPS_DIR.exists():
+        for f in REFERENCE_CROPS_DIR.iterdir():
+            if f.is_file():
+                yield KIND_REFERENCE_CROPS, f
+    if UPLOADS_DIR.exists():
+        for f in UPLOADS_DIR.iterdir():
+            if f.is_file() and f.suffix.lower() in IMAGE_EXTENSIONS:
+                yield KIND_UPLOADS, f
+
+
+def rebuild(batch_size=1000):
+    """Re-index everything under app/data. Returns the number of files indexed."""
+    image_files.delete_many({})
+    batch, kind_of_batch, total = [], None, 0
+    for kind, path in _scan():
+        if batch and kind != kind_of_batch:
+            register_files(kind_of_batch, batch)
+            batch = []
+        batch.append(path)
+        kind_of_batch = kind
+        total += 1
+        if len(batch) >= batch_size:
+            register_files(kind, batch)
+            batch = []
+    if batch:
+        register_files(kind_of_batch, batch)
+    print(f"✅ Indexed {total} image file(s)")
+    return total
+
+
+def ensure_file_index():
+    """Build the index on first start (existing installations)."""
+    if image_files.estimated_document_count() == 0:
+        rebuild()
+
+
+if __name__ == "__main__":
+    rebuild()
@@ -0,0 +1,69 @@
+"""
+Migrate db.embeddings documents from the v1 format (embedding as a list of
+doubles, frame number only inside crop_path) to the v2 binary format.
+
+Usage (from backend/):
+    python -m app.db.migrate_embeddings [--dtype float32|float16] [--batch 1000] [--dry-run]
+"""
+import argparse
+from pymongo import UpdateOne
+from app.db.mongo import db
+from app.db.embedding_store import SCHEMA_VERSION, encode_embedding, frame_number_from_path
+
+
+def _fps_for_job(job_id, cache):
+    if job_id not in cache:
+        from app.ml.video_probe import get_video_info
+        try:
+            cache[job_id] = float((get_video_info(job_id) or {}).get("fps", 30.0)) or 30.0
+        except Exception:
+            cache[job_id] = 30.0
+    return cache[job_id]
+
+
+def migrate(dtype="float32", batch_size=1000, dry_run=False):
+    query = {"schema_version": {"$ne": SCHEMA_VERSION}}
+    total = db.embeddings.count_documents(query)
+    print(f"🔄 {total} embedding document(s) to migrate to v{SCHEMA_VERSION} ({dtype})")
+
+    fps_cache = {}
+    ops = []
+    migrated = 0
+
+    cursor = db.embeddings.find(query, {"embedding": 1, "crop_path": 1, "job_id": 1}).batch_size(batch_size)
+    for doc in cursor:
+        if not isinstance(doc.get("embedding"), list):
+            continue
+
+        frame_number = frame_number_from_path(doc.get("crop_path", ""))
+        fps = _fps_for_job(str(doc.get("job_id", "")), fps_cache)
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {
+            **encode_embedding(doc["embedding"], dtype=dtype),
+            "frame_number": frame_number,
+            "pts": round(frame_number / fps, 3),
+            "schema_version": SCHEMA_VERSION,
+        }}))
+
+        if len(ops) >= batch_size:
+            if not dry_run:
+                db.embeddings.bulk_write(ops, ordered=False)
+            migrated += len(ops)
+            ops = []
+            print(f"   {migrated}/{total} migrated")
+
+    if ops:
+        if not dry_run:
+            db.embeddings.bulk_write(ops, ordered=False)
+        migrated += len(ops)
+
+    print(f"✅ Migration {'(dry run) ' if dry_run else ''}complete: {migrated} document(s)")
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate video embeddings to the v2 binary format")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"])
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    migrate(dtype=args.dtype, batch_size=args.batch, dry_run=args.dry_run)
@@ -1,9 +1,70 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from dotenv import load_dotenv
 import os
 
+load_dotenv()
+
 # MongoDB URI (change if using Atlas)
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "missing_person_db")
+REFERENCE_COLLECTION = os.getenv("COLLECTION_NAME", "reference_embeddings")
 
-client = MongoClient(MONGO_URI)
-db = client["missing_person_db"]  # Database name
+# One pooled client per process; pymongo clients are thread-safe, so every
+# route, pipeline and worker thread shares it.
+client = MongoClient(
+    MONGO_URI,
+    maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", 50)),
+    minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", 0)),
+    maxIdleTimeMS=int(os.getenv("MONGO_MAX_IDLE_MS", 60000)),
+    waitQueueTimeoutMS=int(os.getenv("MONGO_WAIT_QUEUE_MS", 10000)),
+)
+db = client[DB_NAME]  # Database name
 references_collection = db["references"]  # Collection for reference images
+reference_embeddings = db[REFERENCE_COLLECTION]  # Reference faces (embedding + metadata)
+
+# ----------------------------------------------------------------
+# Projections for hot paths
+# ----------------------------------------------------------------
+# Fields the scoring engine needs from a video embedding doc
+EMBEDDING_SCORE_FIELDS = {"embedding": 1, "embedding_dtype": 1, "age": 1, "gender": 1, "color": 1}
+# Same, without the vector (approximate / metadata-only scoring)
+EMBEDDING_META_FIELDS = {"age": 1, "gender": 1, "color": 1}
+# Fields needed to display a match
+EMBEDDING_MATCH_FIELDS = {
+    "job_id": 1, "video_name": 1, "crop_path": 1, "frame_number": 1, "pts": 1,
+    "age": 1, "gender": 1, "color": 1,
+    "track_id": 1, "track_first_frame": 1, "track_last_frame": 1, "track_start_pts": 1, "track_end_pts": 1,
+    "track_hits": 1,
+}
+REFERENCE_FIELDS = {
+    "person_id": 1, "embedding": 1, "embedding_dtype": 1, "age": 1, "gender": 1, "color": 1, "crop_path": 1,
+}
+
+
+INDEXES = [
+    (db.embeddings, [("job_id", ASCENDING), ("frame_number", ASCENDING)], {}),
+    (reference_embeddings, [("person_id", ASCENDING)], {}),
+    (db.video_jobs, [("job_id", ASCENDING)], {"unique": True}),
+    (db.video_jobs, [("status", ASCENDING), ("created_at", ASCENDING)], {}),  # job queue claims
+    (db.video_jobs, [("created_at", DESCENDING)], {}),
+    (db.video_jobs, [("status", ASCENDING), ("time_tag", ASCENDING)], {}),  # reference -> job links
+    (db.refine_jobs, [("refine_id", ASCENDING)], {"unique": True}),
+    (db.refine_jobs, [("status", ASCENDING), ("created_at", ASCENDING)], {}),  # refinement claims
+    (db.reference_links, [("ref_time", ASCENDING)], {"unique": True}),
+    (db.reference_links, [("job_id", ASCENDING)], {}),
+    (db.recent_searches, [("reference_id", ASCENDING)], {"unique": True}),
+    (db.recent_searches, [("uploaded_at", DESCENDING)], {}),
+    (db.image_files, [("kind", ASCENDING), ("filename", ASCENDING)], {"unique": True}),
+    (db.image_files, [("stem", ASCENDING), ("kind", ASCENDING)], {}),
+    (db.reference_images, [("filename", ASCENDING)], {}),
+]
+
+
+def ensure_indexes():
+    """Create the indexes the app relies on (idempotent, run at startup)."""
+    for collection, keys, options in INDEXES:
+        try:
+            collection.create_index(keys, **options)
+        except Exception as e:
+            print(f"⚠️ Could not create index {keys} on {collection.name}: {e}")
+    print("✅ MongoDB indexes ensured")
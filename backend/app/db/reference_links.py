@@ -0,0 +1,145 @@
+"""
+Precomputed reference -> video job mapping used by the dashboard.
+
+A reference upload (named "{YYYYmmdd_HHMMSS}_{original name}") is linked to
+the completed video job whose processing time tag is closest to its own
+timestamp. Links are written when a reference is added and refreshed when a
+job completes, so the dashboard answers with indexed lookups only.
+
+Backfill for existing data (from backend/):
+    python -m app.db.reference_links
+"""
+import os
+import re
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING
+from app.db.mongo import db
+
+reference_links = db.reference_links
+
+_TIME_TAG_RE = re.compile(r"(\d{8}_\d{6})")
+
+
+def parse_time_tag(value):
+    """'20250101_120000' (or a name containing one) -> epoch seconds, else None."""
+    match = _TIME_TAG_RE.search(value or "")
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S").timestamp()
+    except ValueError:
+        return None
+
+
+def detection_frames(detections):
+    """One frame number per saved crop, sorted (the pipeline's `detections` layout)."""
+    return sorted(
+        entry["frame"]
+        for entry in detections or []
+        for _ in entry.get("detections", [])
+    )
+
+
+def _nearest_job(ref_ts, ref_time):
+    """Completed job with the closest time tag, using two indexed range queries."""
+    query = {"status": "completed", "time_tag": {"$exists": True}}
+    projection = {"job_id": 1, "time_tag": 1, "persons_folder": 1}
+    after = db.video_jobs.find_one({**query, "time_tag": {"$gte": ref_time}}, projection,
+                                   sort=[("time_tag", ASCENDING)])
+    before = db.video_jobs.find_one({**query, "time_tag": {"$lt": ref_time}}, projection,
+                                    sort=[("time_tag", DESCENDING)])
+    candidates = [j for j in (after, before) if j]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda j: abs(parse_time_tag(j["time_tag"]) - ref_ts))
+
+
+def link_reference(ref_time, reference_image):
+    """Create or refresh the link for one reference upload. Returns the link doc."""
+    ref_ts = parse_time_tag(ref_time)
+    link = {
+        "ref_time": ref_time,
+        "ref_ts": ref_ts,
+        "reference_image": reference_image,
+        "job_id": None,
+        "persons_folder": None,
+        "time_tag": None,
+        "distance": None,
+        "linked_at": datetime.utcnow(),
+    }
+    job = _nearest_job(ref_ts, ref_time) if ref_ts is not None else None
+    if job:
+        link.update({
+            "job_id": job["job_id"],
+            "persons_folder": job.get("persons_folder"),
+            "time_tag": job["time_tag"],
+            "distance": abs(parse_time_tag(job["time_tag"]) - ref_ts),
+        })
+    reference_links.update_one({"ref_time": ref_time}, {"$set": link}, upsert=True)
+    return link
+
+
+def link_job(job_id, time_tag, persons_folder):
+    """
+    Point every reference that is unlinked, or linked to a job further away
+    in time, at a newly completed job.
+    """
+    job_ts = parse_time_tag(time_tag)
+    if job_ts is None:
+        return 0
+    result = reference_links.update_many(
+        {"ref_ts": {"$ne": None}, "$or": [
+            {"job_id": None},
+            {"$expr": {"$gt": ["$distance", {"$abs": {"$subtract": ["$ref_ts", job_ts]}}]}},
+        ]},
+        [{"$set": {
+            "job_id": job_id,
+            "persons_folder": persons_folder,
+            "time_tag": time_tag,
+            "distance": {"$abs": {"$subtract": ["$ref_ts", job_ts]}},
+            "linked_at": datetime.utcnow(),
+        }}],
+    )
+    return result.modified_count
+
+
+def get_reference_link(ref_time):
+    return reference_links.find_one({"ref_time": ref_time}, {"_id": 0})
+
+
+def backfill(uploads_dir="app/data/uploads"):
+    """Derive time tags for completed jobs from their crop paths, then link every reference upload."""
+    jobs = db.video_jobs.find(
+        {"status": "completed", "time_tag": {"$exists": False}},
+        {"job_id": 1, "detections": 1},
+    )
+    for job in jobs:
+        crop_path = next(
+            (d["crop_path"] for entry in job.get("detections", []) for d in entry.get("detections", [])),
+            None,
+        )
+        if not crop_path:
+            continue
+        persons_folder = os.path.dirname(crop_path)
+        time_tag = _TIME_TAG_RE.search(os.path.basename(persons_folder))
+        if not time_tag:
+            continue
+        db.video_jobs.update_one({"job_id": job["job_id"]}, {"$set": {
+            "time_tag": time_tag.group(1),
+            "persons_folder": persons_folder,
+            "detection_frames": detection_frames(job.get("detections")),
+        }})
+        print(f"🔗 Job {job['job_id']} → {os.path.basename(persons_folder)}")
+
+    linked = 0
+    if os.path.isdir(uploads_dir):
+        for name in sorted(os.listdir(uploads_dir)):
+            match = _TIME_TAG_RE.match(name)
+            if match and os.path.isfile(os.path.join(uploads_dir, name)):
+                link_reference(match.group(1), name)
+                linked += 1
+    print(f"✅ Linked {linked} reference upload(s)")
+
+
+if __name__ == "__main__":
+    backfill()
@@ -1,23 +1,40 @@
-import os
 from datetime import datetime
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from bson import ObjectId
-from app.db.mongo import db
-from app.routes.video_serve import get_video_info_sync  # ✅ use only the sync helper
+from app.db.mongo import (
+    db, reference_embeddings,
+    EMBEDDING_SCORE_FIELDS, EMBEDDING_META_FIELDS, EMBEDDING_MATCH_FIELDS, REFERENCE_FIELDS,
+)
+from app.db.embedding_store import decode_embedding, frame_number_of
+from app.ml.scoring import ScoringEngine
+from app.ml.model_registry import get_video_index
+from app.ml.video_probe import get_video_info
+from app.ml.tracker import TRACK_KEEP
 
 
 class VideoComparison:
-    def __init__(self, final_threshold=0.35, emb_weight=0.8, meta_weight=0.2, top_k=20):
+    def __init__(self, final_threshold=0.35, emb_weight=0.8, meta_weight=0.2, top_k=20, chunk_size=4096,
+                 use_index=True, ann_candidates=None, ef_search=None, rerank=True):
         """
         final_threshold: Minimum combined similarity score to count as a match.
         emb_weight/meta_weight: How much to weigh embedding vs metadata similarity.
         top_k: Return only top K matches (default 10)
+        chunk_size: Number of video embeddings scored per matrix operation.
+        use_index: Retrieve candidates from the video ANN index before exact re-scoring.
+        ann_candidates: Number of ANN candidates to re-score (default max(10 * top_k, 200)).
+        ef_search: HNSW search depth; higher = better recall, slower.
+        rerank: Re-score ANN candidates with the full-precision vectors from MongoDB.
+            False uses the index's (possibly quantized) similarities directly.
         """
         self.final_threshold = final_threshold
         self.emb_weight = emb_weight
         self.meta_weight = meta_weight
         self.top_k = top_k
+        self.chunk_size = chunk_size
+        self.use_index = use_index
+        self.ann_candidates = ann_candidates or max(10 * top_k, 200)
+        self.ef_search = ef_search
+        self.rerank = rerank
 
     # -------------------------------------------------------------------------
     # Utility Methods
@@ -40,57 +57,17 @@ class VideoComparison:
             return value.tolist()
         return value
 
-    def _metadata_similarity(self, ref_meta, vid_meta):
-        """Compute metadata similarity score between reference and video person"""
-        if not ref_meta or not vid_meta:
-            return 0.0
-
-        # Gender match (1 if same, 0 otherwise)
-        gender_score = 1.0 if ref_meta.get("gender") == vid_meta.get("gender") else 0.0
-
-        # Age similarity (closeness within 10 years)
-        ref_age, vid_age = ref_meta.get("age"), vid_meta.get("age")
-        if ref_age is not None and vid_age is not None:
-            age_diff = abs(ref_age - vid_age)
-            age_score = max(0, 1 - (age_diff / 10)) if age_diff <= 10 else 0.0
-        else:
-            age_score = 0.0
-
-        # Color similarity (using cosine similarity on RGB)
-        ref_color, vid_color = ref_meta.get("color"), vid_meta.get("color")
-        if ref_color and vid_color and len(ref_color) == 3 and len(vid_color) == 3:
-            ref_vec = np.array(ref_color).reshape(1, -1)
-            vid_vec = np.array(vid_color).reshape(1, -1)
-            color_score = cosine_similarity(ref_vec, vid_vec)[0][0] / 255
-            color_score = np.clip(color_score, 0, 1)
-        else:
-            color_score = 0.0
-
-        # Weighted combination of metadata attributes
-        meta_score = (0.4 * gender_score) + (0.3 * age_score) + (0.3 * color_score)
-        return meta_score
-
-    def _extract_frame_number(self, crop_path):
-        """Extract frame number from crop path like 'person_1_frame_120.jpg' -> 120"""
-        try:
-            filename = os.path.basename(crop_path)
-            frame_part = filename.split('_frame_')[-1]
-            frame_num = int(frame_part.split('.')[0])
-            return frame_num
-        except Exception:
-            return 0
-
-    def _calculate_timestamp(self, frame_number, fps=30.0):
-        """Convert frame number to timestamp"""
-        total_seconds = frame_number / fps
+    def _calculate_timestamp(self, frame_number, fps=30.0, pts=None):
+        """Convert frame number (or a stored presentation timestamp) to mm:ss"""
+        total_seconds = pts if pts is not None else frame_number / fps
         minutes = int(total_seconds // 60)
         seconds = int(total_seconds % 60)
         return f"{minutes:02d}:{seconds:02d}"
 
     def _get_fps_for_video(self, job_id: str):
-        """Fetch real FPS dynamically for each video using the sync helper."""
+        """Real FPS for a video, from the probe cached at upload."""
         try:
-            video_info = get_video_info_sync(job_id)
+            video_info = get_video_info(job_id) or {}
             fps = float(video_info.get("fps", 30.0))
             if fps > 0:
                 print(f"🎬 Using FPS={fps} for job_id={job_id}")
@@ -106,19 +83,17 @@ class VideoComparison:
         """Compare a single reference embedding against ALL video embeddings"""
         print(f"\n🔍 Starting comparison for reference: {reference_id}")
         
-        ref_collection_name = os.getenv("COLLECTION_NAME", "reference_embeddings")
-        
         # Try to find by ObjectId first, then by person_id
         ref_doc = None
         if ObjectId.is_valid(reference_id):
             try:
-                ref_doc = db[ref_collection_name].find_one({"_id": ObjectId(reference_id)})
+                ref_doc = reference_embeddings.find_one({"_id": ObjectId(reference_id)}, REFERENCE_FIELDS)
                 print(f"   Found by ObjectId: {reference_id}")
             except Exception:
                 pass
         
         if not ref_doc:
-            ref_doc = db[ref_collection_name].find_one({"person_id": reference_id})
+            ref_doc = reference_embeddings.find_one({"person_id": reference_id}, REFERENCE_FIELDS)
             if ref_doc:
                 print(f"   Found by person_id: {reference_id}")
 
@@ -126,7 +101,7 @@ class VideoComparison:
             print(f"⚠️ No reference found for id/person_id: {reference_id}")
             return []
 
-        ref_emb = np.array(ref_doc["embedding"]).reshape(1, -1)
+        ref_emb = decode_embedding(ref_doc)
         ref_meta = {
             "person_id": str(ref_doc.get("person_id", "")),
             "age": int(ref_doc.get("age", 0)) if ref_doc.get("age") else None,
@@ -137,78 +112,166 @@ class VideoComparison:
 
         print(f"   Reference metadata: person_id={ref_meta['person_id']}, gender={ref_meta['gender']}, age={ref_meta['age']}")
 
-        # Load video embeddings
+        # Stream video embeddings through the vectorized scorer in chunks
         query = {"job_id": job_id} if job_id else {}
         print(f"   Searching {'job_id ' + job_id if job_id else 'ALL videos in database'}")
-            
-        video_emb_docs = list(db.embeddings.find(query))
-        if not video_emb_docs:
+
+        engine = ScoringEngine(
+            ref_emb,
+            ref_meta,
+            emb_weight=self.emb_weight,
+            meta_weight=self.meta_weight,
+            final_threshold=self.final_threshold,
+            top_k=self.top_k * max(1, TRACK_KEEP),  # room for several observations of one track
+            chunk_size=self.chunk_size,
+        )
+        if self.use_index:
+            self._score_with_index(engine, ref_emb, job_id)
+        else:
+            self._score_query(engine, query)
+
+        if engine.scanned == 0:
             print(f"⚠️ No video embeddings found in database{' for job_id: ' + job_id if job_id else ''}")
             return []
-        
-        print(f"   Found {len(video_emb_docs)} video embeddings to compare")
 
+        print(f"   Scored {engine.scanned} video embeddings, {engine.matched} above threshold")
+
+        top_matches = self._build_matches(self._with_match_fields(engine.results()), ref_doc, ref_meta, job_id)
+
+        print(f"✅ Comparison complete: {len(top_matches)} top matches (from {engine.matched} total) for reference {ref_meta['person_id']}\n")
+        return top_matches
+
+    def _score_query(self, engine, query):
+        """Exact scan: stream every embedding matching `query` through the engine."""
+        cursor = db.embeddings.find(query, EMBEDDING_SCORE_FIELDS).batch_size(self.chunk_size)
+        try:
+            engine.score_cursor(cursor)
+        finally:
+            cursor.close()
+
+    def _score_with_index(self, engine, ref_emb, job_id=None):
+        """
+        Sub-linear retrieval: take the nearest candidates from the ANN shards
+        and re-score them exactly. Jobs without a shard yet (older uploads or
+        jobs still processing) are scanned exactly so nothing is missed.
+        """
+        video_index = get_video_index()
+        if job_id:
+            indexed_jobs = [job_id] if video_index.has_job(job_id) else []
+        else:
+            indexed_jobs = video_index.job_ids()
+
+        if indexed_jobs:
+            candidates = video_index.search(ref_emb, k=self.ann_candidates, job_id=job_id, ef_search=self.ef_search)
+            print(f"   ANN index returned {len(candidates)} candidates from {len(indexed_jobs)} shard(s)")
+            ids = [ObjectId(doc_id) for doc_id, _ in candidates]
+            if ids and self.rerank:
+                # Exact re-rank with the stored full-precision vectors
+                self._score_query(engine, {"_id": {"$in": ids}})
+            elif ids:
+                # Approximate scores straight from the index; skip loading vectors
+                approx = {doc_id: score for doc_id, score in candidates}
+                docs = list(db.embeddings.find({"_id": {"$in": ids}}, EMBEDDING_META_FIELDS))
+                engine.score_chunk(docs, emb_sim=[approx[str(d["_id"])] for d in docs])
+
+        if job_id:
+            if not indexed_jobs:
+                self._score_query(engine, {"job_id": job_id})
+        else:
+            self._score_query(engine, {"job_id": {"$nin": indexed_jobs}} if indexed_jobs else {})
+
+    def _with_match_fields(self, scored):
+        """
+        Scoring only loads the fields it needs; fetch the display fields
+        (job, crop, frame, pts) for the final top-k in one query.
+        """
+        if not scored:
+            return scored
+        ids = [doc["_id"] for doc, _, _, _ in scored]
+        details = {d["_id"]: d for d in db.embeddings.find({"_id": {"$in": ids}}, EMBEDDING_MATCH_FIELDS)}
+        return [(details.get(doc["_id"], doc), emb_sim, meta_sim, score) for doc, emb_sim, meta_sim, score in scored]
+
+    def _sighting(self, v_doc, fps):
+        """First/last appearance of the matched track (a single frame for untracked docs)."""
+        frame_number = frame_number_of(v_doc)
+        first_frame = int(v_doc.get("track_first_frame", frame_number))
+        last_frame = int(v_doc.get("track_last_frame", frame_number))
+        start_pts = v_doc.get("track_start_pts", v_doc.get("pts"))
+        end_pts = v_doc.get("track_end_pts", v_doc.get("pts"))
+        start = float(start_pts) if start_pts is not None else first_frame / fps
+        end = float(end_pts) if end_pts is not None else last_frame / fps
+        return {
+            "track_id": v_doc.get("track_id"),
+            "first_frame": first_frame,
+            "last_frame": last_frame,
+            "start_seconds": round(start, 3),
+            "end_seconds": round(end, 3),
+            "start_timestamp": self._calculate_timestamp(first_frame, pts=start),
+            "end_timestamp": self._calculate_timestamp(last_frame, pts=end),
+            "detections": int(v_doc.get("track_hits", 1)),
+        }
+
+    def _build_matches(self, scored, ref_doc, ref_meta, job_id=None):
+        """
+        Turn the engine's top (doc, scores) tuples into match dicts. Several
+        stored observations of one track are one sighting: only the best
+        scoring one is returned.
+        """
         matches = []
         fps_cache = {}  # avoid redundant lookups
+        seen_tracks = set()
 
-        for idx, v_doc in enumerate(video_emb_docs):
-            try:
-                video_emb = np.array(v_doc["embedding"]).reshape(1, -1)
-                emb_similarity = cosine_similarity(ref_emb, video_emb)[0][0]
+        for v_doc, emb_similarity, meta_similarity, final_score in scored:
+            if len(matches) >= self.top_k:
+                break
+            if v_doc.get("track_id") is not None:
+                track_key = (str(v_doc.get("job_id")), v_doc["track_id"])
+                if track_key in seen_tracks:
+                    continue
+                seen_tracks.add(track_key)
 
-                vid_meta = {
-                    "age": int(v_doc.get("age", 0)) if v_doc.get("age") else None,
-                    "gender": str(v_doc.get("gender", "")),
-                    "color": self._safe_convert(v_doc.get("color")),
-                }
+            vid_meta = {
+                "age": int(v_doc.get("age", 0)) if v_doc.get("age") else None,
+                "gender": str(v_doc.get("gender", "")),
+                "color": self._safe_convert(v_doc.get("color")),
+            }
 
-                meta_similarity = self._metadata_similarity(ref_meta, vid_meta)
-                final_score = (self.emb_weight * emb_similarity) + (self.meta_weight * meta_similarity)
-
-                frame_number = self._extract_frame_number(v_doc.get("crop_path", ""))
-                job_id_for_fps = str(v_doc.get("job_id", job_id or ""))
+            frame_number = frame_number_of(v_doc)
+            job_id_for_fps = str(v_doc.get("job_id", job_id or ""))
+            pts = v_doc.get("pts")
 
+            fps = 30.0
+            if pts is not None:
+                # v2 docs carry the presentation timestamp, no FPS lookup needed
+                timestamp = self._calculate_timestamp(frame_number, pts=float(pts))
+            else:
                 # ✅ Dynamically get fps per video
                 if job_id_for_fps not in fps_cache:
                     fps_cache[job_id_for_fps] = self._get_fps_for_video(job_id_for_fps)
                 fps = fps_cache[job_id_for_fps]
-
                 timestamp = self._calculate_timestamp(frame_number, fps=fps)
 
-                if final_score >= self.final_threshold:
-                    match = {
-                        "reference_id": str(ref_doc["_id"]),
-                        "person_id": ref_meta["person_id"],
-                        "reference_crop": ref_meta["crop_path"],
-                        "ref_age": ref_meta["age"],
-                        "ref_gender": ref_meta["gender"],
-                        "ref_color": ref_meta["color"],
-                        "video_name": str(v_doc.get("video_name", "")),
-                        "job_id": job_id_for_fps,
-                        "video_crop": str(v_doc.get("crop_path", "")),
-                        "frame_number": int(frame_number),
-                        "timestamp": str(timestamp),
-                        "vid_age": vid_meta["age"],
-                        "vid_gender": vid_meta["gender"],
-                        "vid_color": vid_meta["color"],
-                        "face_similarity": float(emb_similarity),
-                        "meta_similarity": float(meta_similarity),
-                        "final_score": float(final_score),
-                        "detected_at": str(datetime.utcnow())
-                    }
-                    matches.append(self._safe_convert(match))
-
-                    if idx % 100 == 0 and idx > 0:
-                        print(f"   Processed {idx} embeddings, {len(matches)} matches so far...")
-
-            except Exception as e:
-                print(f"⚠️ Error processing video embedding {idx}: {str(e)}")
-                import traceback
-                traceback.print_exc()
-                continue
-
-        matches.sort(key=lambda x: x["final_score"], reverse=True)
-        top_matches = matches[:self.top_k]
-
-        print(f"✅ Comparison complete: {len(top_matches)} top matches (from {len(matches)} total) for reference {ref_meta['person_id']}\n")
-        return top_matches
+            match = {
+                "reference_id": str(ref_doc["_id"]),
+                "person_id": ref_meta["person_id"],
+                "reference_crop": ref_meta["crop_path"],
+                "ref_age": ref_meta["age"],
+                "ref_gender": ref_meta["gender"],
+                "ref_color": ref_meta["color"],
+                "video_name": str(v_doc.get("video_name", "")),
+                "job_id": job_id_for_fps,
+                "video_crop": str(v_doc.get("crop_path", "")),
+                "frame_number": int(frame_number),
+                "timestamp": str(timestamp),
+                "sighting": self._sighting(v_doc, fps),
+                "vid_age": vid_meta["age"],
+                "vid_gender": vid_meta["gender"],
+                "vid_color": vid_meta["color"],
+                "face_similarity": float(emb_similarity),
+                "meta_similarity": float(meta_similarity),
+                "final_score": float(final_score),
+                "detected_at": str(datetime.utcnow())
+            }
+            matches.append(self._safe_convert(match))
+
+        return matches
@@ -29,6 +29,18 @@ class PersonDetector:
         results = self.model(frame)
         return self._parse_results(results, frame)
 
+    def detect_persons_batch(self, frames):
+        """
+        Detects persons in a list of cv2 frames with a single YOLO call.
+        Returns one detections list per frame (same format as
+        detect_persons_from_frame).
+        """
+        if not frames:
+            return []
+
+        results = self.model(list(frames), verbose=False)
+        return [self._parse_results([result], frame) for result, frame in zip(results, frames)]
+
     def _parse_results(self, results, img):
         """
         Parses YOLO results to extract person bounding boxes and confidence.
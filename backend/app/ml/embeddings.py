@@ -1,4 +1,7 @@
 from insightface.app import FaceAnalysis
+from insightface.app.common import Face
+from insightface.utils import face_align
+import os
 import numpy as np
 import cv2
 
@@ -35,3 +38,119 @@ class EmbeddingModel:
             return None
 
         return faces[0].embedding.astype("float32")
+
+
+# ----------------------------------------------------------------
+# Frame-level face analysis
+# ----------------------------------------------------------------
+# FACE_MODE=crop  : FaceAnalysis.get() on the top-35% crop of every person box
+#                   (full buffalo_l pack, one pass per person)
+# FACE_MODE=frame : one face detection per frame at FACE_DET_SIZE, faces
+#                   assigned to person boxes, then recognition and gender/age
+#                   batched over the aligned faces only (no landmark models)
+FACE_MODE = os.getenv("FACE_MODE", "crop")
+FACE_DET_SIZE = int(os.getenv("FACE_DET_SIZE", 640))
+FACE_BATCH_SIZE = 64
+
+
+class FaceFrameAnalyzer:
+    def __init__(self, det_size=FACE_DET_SIZE, det_thresh=0.5):
+        print("🧠 Loading InsightFace detection/recognition/genderage models...")
+        self.app = FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'],
+                                allowed_modules=['detection', 'recognition', 'genderage'])
+        self.app.prepare(ctx_id=-1, det_thresh=det_thresh, det_size=(det_size, det_size))
+        self.det_model = self.app.det_model
+        self.rec_model = self.app.models['recognition']
+        self.ga_model = self.app.models.get('genderage')
+        print("✅ InsightFace frame analyzer loaded successfully.")
+
+    def detect(self, frame):
+        """All faces in a frame: list of Face(bbox, kps, det_score)."""
+        bboxes, kpss = self.det_model.detect(frame, max_num=0, metric='default')
+        return [
+            Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+            for i in range(bboxes.shape[0])
+        ]
+
+    @staticmethod
+    def assign(faces, person_boxes, upper=0.5):
+        """
+        Match faces to person boxes: a face belongs to a person if its center
+        lies inside the upper part of the box. Greedy by detection score, each
+        face and each person used at most once. Returns {person_idx: face_idx}.
+        """
+        pairs = []
+        for fi, face in enumerate(faces):
+            cx = (face.bbox[0] + face.bbox[2]) / 2
+            cy = (face.bbox[1] + face.bbox[3]) / 2
+            for pi, (x1, y1, x2, y2) in enumerate(person_boxes):
+                if x1 <= cx <= x2 and y1 <= cy <= y1 + (y2 - y1) * upper:
+                    pairs.append((float(face.det_score), pi, fi))
+
+        assignment, used_faces = {}, set()
+        for _, pi, fi in sorted(pairs, reverse=True):
+            if pi not in assignment and fi not in used_faces:
+                assignment[pi] = fi
+                used_faces.add(fi)
+        return assignment
+
+    def embed(self, items):
+        """Recognition embeddings for [(frame, face), ...], batched: (n, 512) float32."""
+        size = self.rec_model.input_size[0]
+        aligned = [face_align.norm_crop(frame, landmark=face.kps, image_size=size) for frame, face in items]
+        feats = [self.rec_model.get_feat(aligned[i:i + FACE_BATCH_SIZE])
+                 for i in range(0, len(aligned), FACE_BATCH_SIZE)]
+        return np.vstack(feats).astype("float32")
+
+    def gender_age(self, items):
+        """[(gender, age), ...] for [(frame, face), ...]; gender 1 = male, as in Face.gender."""
+        if self.ga_model is None:
+            return [(None, None)] * len(items)
+        m = self.ga_model
+        size = m.input_size[0]
+        aligned = []
+        for frame, face in items:
+            x1, y1, x2, y2 = face.bbox
+            center = ((x1 + x2) / 2, (y1 + y2) / 2)
+            aimg, _ = face_align.transform(frame, center, size, size / (max(x2 - x1, y2 - y1) * 1.5), 0)
+            aligned.append(aimg)
+
+        results = []
+        for i in range(0, len(aligned), FACE_BATCH_SIZE):
+            blob = cv2.dnn.blobFromImages(aligned[i:i + FACE_BATCH_SIZE], 1.0 / m.input_std, (size, size),
+                                          (m.input_mean, m.input_mean, m.input_mean), swapRB=True)
+            preds = m.session.run(m.output_names, {m.input_name: blob})[0]
+            results.extend((int(np.argmax(p[:2])), int(np.round(p[2] * 100))) for p in preds)
+        return results
+
+    def analyze(self, frames, person_boxes):
+        """
+        frames: list of BGR frames; person_boxes: per frame, list of [x1, y1, x2, y2].
+        Returns per frame, per person box: {"embedding", "age", "gender", "face_box"}
+        or None when no face was assigned to that person.
+        """
+        output, items, slots = [], [], []
+        for f, (frame, boxes) in enumerate(zip(frames, person_boxes)):
+            output.append([None] * len(boxes))
+            if not boxes:
+                continue
+            faces = self.detect(frame)
+            for pi, fi in self.assign(faces, boxes).items():
+                if faces[fi].kps is None:
+                    continue
+                items.append((frame, faces[fi]))
+                slots.append((f, pi))
+
+        if not items:
+            return output
+
+        embeddings = self.embed(items)
+        attributes = self.gender_age(items)
+        for (f, pi), (_, face), emb, (gender, age) in zip(slots, items, embeddings, attributes):
+            output[f][pi] = {
+                "embedding": emb,
+                "age": age,
+                "gender": None if gender is None else ("Male" if gender == 1 else "Female"),
+                "face_box": [int(v) for v in face.bbox],
+            }
+        return output
@@ -2,36 +2,335 @@ import faiss
 import numpy as np
 import os
 import pickle
+import struct
+import threading
+from app.db.embedding_store import decode_embedding
+from app.ml.quantization import new_sq8_flat
+
+REFERENCE_INDEX_QUANTIZATION = os.getenv("REFERENCE_INDEX_QUANTIZATION", "none")  # none | sq8
+
+# WAL record: op (1 byte) + payload length (4 bytes) + pickled payload
+_WAL_HEADER = struct.Struct("<BI")
+_OP_ADD = 1
+_OP_REMOVE = 2
+
 
 class FaissIndex:
-    def __init__(self, dim=512, index_path="backend/data/faiss/faiss.index"):
+    """
+    Reference embedding index with crash-safe, batched persistence.
+
+    - Every add/remove is appended (and fsynced) to a small write-ahead log
+      instead of rewriting the whole index.
+    - Every `snapshot_every` operations the index and id map are written
+      together to one snapshot file, atomically (tmp file + rename), and the
+      WAL is truncated. Records carry a sequence number, so replaying a WAL
+      over a newer snapshot is harmless.
+    - If no usable snapshot exists, the index is rebuilt from the
+      reference_embeddings collection.
+    - Vectors live in an IndexIDMap2, so references can be removed or
+      replaced without rebuilding.
+    - quantization="sq8" stores 8-bit codes instead of float32 vectors;
+      search() then re-ranks its shortlist with the full-precision vectors
+      from the reference collection.
+    """
+
+    def __init__(self, dim=512, index_path="backend/data/faiss/faiss.index", snapshot_every=256, collection=None,
+                 quantization=REFERENCE_INDEX_QUANTIZATION):
+        if quantization not in ("none", "sq8"):
+            raise ValueError(f"Unsupported reference index quantization: {quantization}")
         self.dim = dim
+        self.quantization = quantization
         self.index_path = index_path
+        self.snapshot_path = index_path + ".snap"
+        self.wal_path = index_path + ".wal"
+        self.snapshot_every = snapshot_every
+        self.collection = collection
+        self._lock = threading.Lock()
         os.makedirs(os.path.dirname(index_path), exist_ok=True)
-        if os.path.exists(index_path):
-            self.index = faiss.read_index(index_path)
-            self.id_map = pickle.load(open(index_path + ".pkl", "rb"))
-        else:
-            self.index = faiss.IndexFlatIP(dim)  # inner product = cosine similarity (after normalization)
-            self.id_map = {}  # map from FAISS index -> person_id
-            self.next_id = 0
 
+        self._wal = None
+        self._reset()
+        needs_snapshot = self._load()
+        self._wal = open(self.wal_path, "ab")
+        if needs_snapshot:
+            self._snapshot_locked()
+
+    # -------------------------------------------------------------------------
+    # State
+    # -------------------------------------------------------------------------
+    def _reset(self):
+        base = new_sq8_flat(self.dim) if self.quantization == "sq8" else faiss.IndexFlatIP(self.dim)
+        self.index = faiss.IndexIDMap2(base)  # inner product = cosine similarity (after normalization)
+        self.id_map = {}        # FAISS id -> person_id
+        self.person_to_id = {}  # person_id -> FAISS id
+        self.next_id = 0
+        self.seq = 0            # last applied WAL sequence number
+        self.pending = 0        # operations since the last snapshot
+
+    def _normalize(self, embedding):
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else embedding
+
+    def _apply_add(self, vectors, person_ids):
+        ids = []
+        for person_id in person_ids:
+            # Re-adding a person_id replaces its previous vector
+            if person_id in self.person_to_id:
+                self._apply_remove([person_id])
+            faiss_id = self.next_id
+            self.next_id += 1
+            self.id_map[faiss_id] = person_id
+            self.person_to_id[person_id] = faiss_id
+            ids.append(faiss_id)
+        self.index.add_with_ids(np.asarray(vectors, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+
+    def _apply_remove(self, person_ids):
+        ids = [self.person_to_id.pop(pid) for pid in person_ids if pid in self.person_to_id]
+        for faiss_id in ids:
+            self.id_map.pop(faiss_id, None)
+        if ids:
+            self.index.remove_ids(np.asarray(ids, dtype=np.int64))
+        return len(ids)
+
+    # -------------------------------------------------------------------------
+    # Persistence
+    # -------------------------------------------------------------------------
+    def _load(self):
+        """Load snapshot + WAL. Returns True if the state was migrated or rebuilt and should be snapshotted."""
+        loaded = False
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, "rb") as f:
+                    data = pickle.load(f)
+                if data.get("quantization", "none") != self.quantization:
+                    raise ValueError(f"snapshot uses {data.get('quantization', 'none')}, configured {self.quantization}")
+                self.index = faiss.deserialize_index(data["index"])
+                self.id_map = data["id_map"]
+                self.person_to_id = {pid: fid for fid, pid in self.id_map.items()}
+                self.next_id = data["next_id"]
+                self.seq = data["seq"]
+                loaded = True
+            except Exception as e:
+                print(f"⚠️ FAISS snapshot unreadable ({e}), rebuilding")
+                self._reset()
+        elif os.path.exists(self.index_path) and os.path.exists(self.index_path + ".pkl"):
+            if self._load_legacy():
+                return True
+
+        if loaded:
+            self._replay_wal()
+            return False
+        if self.rebuild_from_collection():
+            return True
+        # Nothing to rebuild from: keep whatever the WAL recorded
+        self._replay_wal()
+        return False
+
+    def _load_legacy(self):
+        """Convert the old index file + pickled position map into the ID-mapped index."""
+        try:
+            legacy = faiss.read_index(self.index_path)
+            with open(self.index_path + ".pkl", "rb") as f:
+                legacy_map = pickle.load(f)
+            vectors = np.vstack([legacy.reconstruct(i) for i in range(legacy.ntotal)]) if legacy.ntotal else None
+            if vectors is not None:
+                self._apply_add(vectors, [legacy_map[i] for i in range(legacy.ntotal)])
+            print(f"✅ Migrated legacy FAISS index ({legacy.ntotal} vectors)")
+            return True
+        except Exception as e:
+            print(f"⚠️ Legacy FAISS index unreadable ({e}), rebuilding")
+            self._reset()
+            return False
+
+    def _replay_wal(self):
+        if not os.path.exists(self.wal_path):
+            return
+        replayed = 0
+        good_end = 0  # offset just past the last intact record
+        with open(self.wal_path, "rb") as f:
+            while True:
+                header = f.read(_WAL_HEADER.size)
+                if len(header) < _WAL_HEADER.size:
+                    break
+                op, length = _WAL_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    break  # torn write from a crash: ignore the partial tail
+                try:
+                    seq, args = pickle.loads(payload)
+                except Exception:
+                    break
+                good_end = f.tell()
+                if seq <= self.seq:
+                    continue
+                if op == _OP_ADD:
+                    self._apply_add(*args)
+                elif op == _OP_REMOVE:
+                    self._apply_remove(*args)
+                self.seq = seq
+                self.pending += 1
+                replayed += 1
+        if replayed:
+            print(f"🔁 Replayed {replayed} FAISS WAL record(s)")
+
+        # Cut a torn / corrupt tail off, or every later append would land
+        # behind it and never be replayed
+        if os.path.getsize(self.wal_path) > good_end:
+            print(f"⚠️ Truncating FAISS WAL to {good_end} bytes (torn tail)")
+            with open(self.wal_path, "r+b") as f:
+                f.truncate(good_end)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _log(self, op, args):
+        self.seq += 1
+        payload = pickle.dumps((self.seq, args), protocol=pickle.HIGHEST_PROTOCOL)
+        self._wal.write(_WAL_HEADER.pack(op, len(payload)) + payload)
+        self._wal.flush()
+        os.fsync(self._wal.fileno())
+        self.pending += 1
+
+    def _snapshot_locked(self):
+        tmp_path = f"{self.snapshot_path}.tmp.{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({
+                "index": faiss.serialize_index(self.index),
+                "id_map": self.id_map,
+                "next_id": self.next_id,
+                "seq": self.seq,
+                "quantization": self.quantization,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        # Everything up to self.seq is in the snapshot now
+        if self._wal is not None:
+            self._wal.close()
+        self._wal = open(self.wal_path, "wb")
+        self.pending = 0
+
+    def snapshot(self):
+        """Write an atomic snapshot and truncate the WAL."""
+        with self._lock:
+            self._snapshot_locked()
+
+    def _maybe_snapshot(self):
+        if self.pending >= self.snapshot_every:
+            self._snapshot_locked()
+
+    def rebuild_from_collection(self, collection=None, batch_size=4096):
+        """Rebuild the whole index from the reference_embeddings collection."""
+        collection = collection if collection is not None else self._reference_collection()
+        if collection is None:
+            return False
+
+        try:
+            self._reset()
+            vectors, person_ids = [], []
+            cursor = collection.find({}, {"person_id": 1, "embedding": 1, "embedding_dtype": 1}).batch_size(batch_size)
+            for doc in cursor:
+                if doc.get("embedding") is None or doc.get("person_id") is None:
+                    continue
+                vectors.append(self._normalize(decode_embedding(doc)))
+                person_ids.append(doc["person_id"])
+                if len(vectors) >= batch_size:
+                    self._apply_add(np.vstack(vectors), person_ids)
+                    vectors, person_ids = [], []
+            if vectors:
+                self._apply_add(np.vstack(vectors), person_ids)
+        except Exception as e:
+            print(f"⚠️ FAISS rebuild from MongoDB failed: {e}")
+            self._reset()
+            return False
+
+        print(f"✅ Rebuilt FAISS index from MongoDB ({self.index.ntotal} vectors)")
+        if self._wal is not None:
+            self._snapshot_locked()
+        return True
+
+    def _reference_collection(self):
+        if self.collection is None:
+            try:
+                from app.db.mongo import reference_embeddings
+                self.collection = reference_embeddings
+            except Exception as e:
+                print(f"⚠️ Cannot reach reference collection: {e}")
+        return self.collection
+
+    def _rerank(self, embedding, candidates, top_k):
+        """Exact inner products for a shortlist, using the stored full-precision vectors."""
+        collection = self._reference_collection()
+        if collection is None:
+            return candidates[:top_k]
+        try:
+            docs = collection.find(
+                {"person_id": {"$in": [c["person_id"] for c in candidates]}},
+                {"person_id": 1, "embedding": 1, "embedding_dtype": 1},
+            )
+            exact = {doc["person_id"]: float(self._normalize(decode_embedding(doc)) @ embedding) for doc in docs}
+        except Exception as e:
+            print(f"⚠️ Re-rank skipped, using approximate scores: {e}")
+            return candidates[:top_k]
+
+        for c in candidates:
+            c["similarity"] = exact.get(c["person_id"], c["similarity"])
+        candidates.sort(key=lambda c: c["similarity"], reverse=True)
+        return candidates[:top_k]
+
+    # -------------------------------------------------------------------------
+    # Public API
+    # -------------------------------------------------------------------------
     def add_embedding(self, embedding, person_id):
-        embedding = embedding / np.linalg.norm(embedding)
-        self.index.add(np.expand_dims(embedding, axis=0))
-        self.id_map[self.index.ntotal - 1] = person_id
-        # Save index
-        faiss.write_index(self.index, self.index_path)
-        pickle.dump(self.id_map, open(self.index_path + ".pkl", "wb"))
-
-    def search(self, embedding, top_k=5):
+        self.add_embeddings([embedding], [person_id])
+
+    def add_embeddings(self, embeddings, person_ids):
+        """Add (or replace) several references with a single WAL record."""
+        if len(person_ids) == 0:
+            return
+        vectors = np.vstack([self._normalize(e) for e in embeddings])
+        person_ids = list(person_ids)
+        with self._lock:
+            self._apply_add(vectors, person_ids)
+            self._log(_OP_ADD, (vectors, person_ids))
+            self._maybe_snapshot()
+
+    def update_embedding(self, embedding, person_id):
+        self.add_embeddings([embedding], [person_id])
+
+    def remove(self, person_ids):
+        """Retire references by person_id. Returns the number removed."""
+        if isinstance(person_ids, str):
+            person_ids = [person_ids]
+        with self._lock:
+            removed = self._apply_remove(person_ids)
+            if removed:
+                self._log(_OP_REMOVE, (list(person_ids),))
+                self._maybe_snapshot()
+        return removed
+
+    def search(self, embedding, top_k=5, rerank=None, shortlist=None):
+        """
+        Nearest references. With a quantized index, the codes are searched for
+        a shortlist (default 4 * top_k) that is re-ranked exactly unless
+        rerank=False.
+        """
         if self.index.ntotal == 0:
             return []
-        embedding = embedding / np.linalg.norm(embedding)
-        D, I = self.index.search(np.expand_dims(embedding, axis=0), top_k)
+        embedding = self._normalize(embedding)
+        if rerank is None:
+            rerank = self.quantization != "none"
+        k = max(shortlist or 4 * top_k, top_k) if rerank else top_k
+
+        with self._lock:
+            D, I = self.index.search(np.expand_dims(embedding, axis=0), k)
         results = []
         for dist, idx in zip(D[0], I[0]):
-            if idx == -1:
+            if idx == -1 or idx not in self.id_map:
                 continue
             results.append({"person_id": self.id_map[idx], "similarity": float(dist)})
+
+        if rerank and results:
+            return self._rerank(embedding, results, top_k)
         return results
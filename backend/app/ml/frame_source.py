@@ -0,0 +1,108 @@
+import os
+import cv2
+from collections import namedtuple
+
+# A decoded frame together with its position in the video
+SampledFrame = namedtuple("SampledFrame", ["index", "timestamp", "image"])
+
+# Gaps (in frames) larger than this are crossed with a seek instead of grab().
+# 0 disables seeking; only worth enabling when the stride is longer than the
+# GOP, because a seek lands on the previous keyframe and decodes forward.
+SEEK_THRESHOLD = int(os.getenv("FRAME_SEEK_THRESHOLD", 0))
+
+
+class FrameSource:
+    """
+    Reads a video and decodes only the frames that are actually used.
+
+    Frames between two samples are skipped with cap.grab(), which demuxes and
+    decodes the packet but skips the BGR conversion and copy done by
+    retrieve(). Optionally, long gaps are crossed with a keyframe seek.
+    """
+
+    def __init__(self, video_path, seek_threshold=None):
+        self.video_path = video_path
+        self.cap = cv2.VideoCapture(video_path)
+        if not self.cap.isOpened():
+            raise Exception(f"Cannot open video: {video_path}")
+
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 0.0
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.seek_threshold = SEEK_THRESHOLD if seek_threshold is None else seek_threshold
+
+        self._pos = 0  # index of the next frame grab() will return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def _timestamp(self, index):
+        """Presentation timestamp (seconds) of the frame just grabbed."""
+        msec = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        if msec > 0 or index == 0:
+            return msec / 1000.0
+        return index / self.fps if self.fps > 0 else 0.0
+
+    def _advance_to(self, index):
+        """Position the capture so the next grab() returns frame `index`."""
+        gap = index - self._pos
+        if gap <= 0:
+            return True
+
+        if self.seek_threshold and gap > self.seek_threshold:
+            if self.cap.set(cv2.CAP_PROP_POS_FRAMES, index):
+                self._pos = index
+                return True
+
+        for _ in range(gap):
+            if not self.cap.grab():
+                return False
+            self._pos += 1
+        return True
+
+    def seek(self, index):
+        """
+        Jump so the next grab() returns frame `index` (used once per segment
+        when a video is split across processes). The ffmpeg backend seeks to
+        the previous keyframe and decodes forward to the exact frame; if the
+        backend cannot seek, the frames are grabbed instead.
+        """
+        if index <= self._pos:
+            return index == self._pos
+        if self.cap.set(cv2.CAP_PROP_POS_FRAMES, index) and int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)) == index:
+            self._pos = index
+            return True
+        # Backend cannot seek: reopen and walk forward
+        self.cap.release()
+        self.cap = cv2.VideoCapture(self.video_path)
+        self._pos = 0
+        return self._advance_to(index)
+
+    def sample(self, interval, start=0, end=None):
+        """
+        Yields SampledFrame(index, timestamp, image) for every `interval`-th
+        frame in [start, end). Only the yielded frames are retrieved.
+        """
+        interval = max(1, int(interval))
+        index = start
+        while end is None or index < end:
+            if not self._advance_to(index):
+                return
+            if not self.cap.grab():
+                return
+            self._pos += 1
+
+            ok, image = self.cap.retrieve()
+            if not ok:
+                return
+            yield SampledFrame(index, self._timestamp(index), image)
+            index += interval
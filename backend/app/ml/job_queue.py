@@ -0,0 +1,425 @@
+import os
+import re
+import time
+import shutil
+import threading
+import socket
+import traceback
+import multiprocessing as mp
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from app.db.mongo import db
+from app.db.reference_links import detection_frames, link_job
+from app.db.dashboard_summary import refresh_job_summaries
+from app.ml.keyframes import build_keyframe_index, save_keyframe_index
+
+# ----------------------------------------------------------------
+# Durable video job queue (backed by the `video_jobs` collection)
+# ----------------------------------------------------------------
+# A job document moves through: queued -> processing -> completed | failed.
+# Workers claim jobs atomically and keep a heartbeat while they run, so a job
+# whose worker died (crash, restart, deploy) is picked up again once its lease
+# expires.
+#
+# Refinements (dense re-scans around /compare hits) queue the same way in
+# `refine_jobs`, so the models only ever run inside the worker processes.
+
+STATUS_QUEUED = "queued"
+STATUS_PROCESSING = "processing"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+
+LEASE_SECONDS = int(os.getenv("VIDEO_JOB_LEASE_SECONDS", 120))
+MAX_ATTEMPTS = int(os.getenv("VIDEO_JOB_MAX_ATTEMPTS", 3))
+POLL_INTERVAL = float(os.getenv("VIDEO_JOB_POLL_SECONDS", 2.0))
+PROGRESS_INTERVAL = 2.0  # seconds between progress writes
+HEARTBEAT_INTERVAL = max(1.0, LEASE_SECONDS / 4)  # lease renewal period while a job runs
+SUPERVISE_INTERVAL = 5.0  # seconds between checks for dead worker processes
+
+
+def enqueue_video_job(job_id, video_name, video_path, metadata=None, video_info=None):
+    """Persist a new job in `video_jobs` so a worker can pick it up."""
+    now = datetime.utcnow()
+    job_doc = {
+        "job_id": job_id,
+        "video_name": video_name,
+        "video_path": video_path,
+        "metadata": metadata or {},
+        "video_info": video_info,
+        "status": STATUS_QUEUED,
+        "attempts": 0,
+        "progress": {"frames_processed": 0, "total_frames": 0, "percent": 0.0},
+        "frames_saved": 0,
+        "persons_saved": 0,
+        "detections": [],
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    db.video_jobs.insert_one(job_doc)
+    return job_doc
+
+
+def get_job(job_id, projection=None):
+    return db.video_jobs.find_one({"job_id": job_id}, projection)
+
+
+def _claim_next(collection, worker_id):
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=LEASE_SECONDS)
+    return collection.find_one_and_update(
+        {
+            "attempts": {"$lt": MAX_ATTEMPTS},
+            "$or": [
+                {"status": STATUS_QUEUED},
+                {"status": STATUS_PROCESSING, "heartbeat_at": {"$lt": stale_before}},
+            ],
+        },
+        {
+            "$set": {
+                "status": STATUS_PROCESSING,
+                "worker_id": worker_id,
+                "started_at": now,
+                "heartbeat_at": now,
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def claim_next_job(worker_id):
+    """
+    Atomically claim the oldest queued job, or a processing job whose
+    worker stopped sending heartbeats (lease expired).
+    """
+    return _claim_next(db.video_jobs, worker_id)
+
+
+def update_progress(job_id, frames_processed, total_frames):
+    percent = round(100.0 * frames_processed / total_frames, 2) if total_frames > 0 else 0.0
+    now = datetime.utcnow()
+    db.video_jobs.update_one(
+        {"job_id": job_id},
+        {"$set": {
+            "progress": {
+                "frames_processed": int(frames_processed),
+                "total_frames": int(total_frames),
+                "percent": min(percent, 100.0),
+            },
+            "heartbeat_at": now,
+            "updated_at": now,
+        }},
+    )
+
+
+def heartbeat(job_id):
+    now = datetime.utcnow()
+    db.video_jobs.update_one({"job_id": job_id}, {"$set": {"heartbeat_at": now, "updated_at": now}})
+
+
+def refinement_heartbeat(refine_id):
+    now = datetime.utcnow()
+    db.refine_jobs.update_one({"refine_id": refine_id}, {"$set": {"heartbeat_at": now, "updated_at": now}})
+
+
+def record_outputs(job_id, frames_folder, persons_folder):
+    """Remember an attempt's output folders, so a retry can remove them."""
+    db.video_jobs.update_one(
+        {"job_id": job_id},
+        {"$set": {"output_folders": [frames_folder, persons_folder], "updated_at": datetime.utcnow()}},
+    )
+
+
+def discard_attempt_outputs(job):
+    """
+    Undo what an interrupted attempt stored: embeddings, the ANN shard,
+    output images (and their file-index entries) and frame thumbnails.
+    """
+    # Imported here: index / thumbnail modules are only needed in workers
+    from app.ml.model_registry import get_video_index
+    from app.ml.thumbnails import THUMBNAIL_DIR
+
+    job_id = job["job_id"]
+    db.embeddings.delete_many({"job_id": job_id})
+    get_video_index().drop_job(job_id)
+    for folder in job.get("output_folders") or []:
+        shutil.rmtree(folder, ignore_errors=True)
+        db.image_files.delete_many({"path": {"$regex": f"^{re.escape(os.path.join(folder, ''))}"}})
+    shutil.rmtree(os.path.join(THUMBNAIL_DIR, job_id), ignore_errors=True)
+
+
+def _keep_alive(job_id, stop, beat=heartbeat):
+    """Renew the job's lease until `stop` is set, whatever the pipeline is doing."""
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        try:
+            beat(job_id)
+        except Exception as e:
+            print(f"⚠️ Heartbeat for job {job_id} failed: {e}")
+
+
+def complete_job(job_id, result):
+    now = datetime.utcnow()
+    db.video_jobs.update_one(
+        {"job_id": job_id},
+        {"$set": {
+            "status": STATUS_COMPLETED,
+            "frames_saved": result["frames_saved"],
+            "persons_saved": result["persons_saved"],
+            "detections": result.get("detections", []),
+            "time_tag": result.get("time_tag"),
+            "persons_folder": result.get("persons_folder"),
+            "detection_frames": detection_frames(result.get("detections")),
+            "sampling": result.get("sampling"),
+            "tracking": result.get("tracking"),
+            "face_quality": result.get("face_quality"),
+            "progress.percent": 100.0,
+            "error": None,
+            "finished_at": now,
+            "updated_at": now,
+        }},
+    )
+
+
+def fail_job(job_id, error):
+    now = datetime.utcnow()
+    db.video_jobs.update_one(
+        {"job_id": job_id},
+        {"$set": {
+            "status": STATUS_FAILED,
+            "error": str(error),
+            "finished_at": now,
+            "updated_at": now,
+        }},
+    )
+
+
+def fail_exhausted_jobs():
+    """Mark jobs (and refinements) that crashed their worker MAX_ATTEMPTS times as failed."""
+    stale_before = datetime.utcnow() - timedelta(seconds=LEASE_SECONDS)
+    for collection in (db.video_jobs, db.refine_jobs):
+        collection.update_many(
+            {
+                "attempts": {"$gte": MAX_ATTEMPTS},
+                "$or": [
+                    {"status": STATUS_QUEUED},
+                    {"status": STATUS_PROCESSING, "heartbeat_at": {"$lt": stale_before}},
+                ],
+            },
+            {"$set": {
+                "status": STATUS_FAILED,
+                "error": f"Gave up after {MAX_ATTEMPTS} attempts",
+                "updated_at": datetime.utcnow(),
+            }},
+        )
+
+
+# ----------------------------------------------------------------
+# Refinement jobs
+# ----------------------------------------------------------------
+def enqueue_refinement(refine_id, request, matches):
+    """
+    Queue a dense re-scan around `matches` (best first). `request` holds the
+    comparison and refinement parameters, so the result can be re-scored.
+    """
+    now = datetime.utcnow()
+    doc = {
+        "refine_id": refine_id,
+        "request": request,
+        "matches": [{"job_id": m["job_id"], "frame_number": int(m["frame_number"])} for m in matches],
+        "status": STATUS_QUEUED,
+        "attempts": 0,
+        "windows": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    db.refine_jobs.insert_one(doc)
+    return doc
+
+
+def get_refinement(refine_id, projection=None):
+    return db.refine_jobs.find_one({"refine_id": refine_id}, projection)
+
+
+def claim_next_refinement(worker_id):
+    return _claim_next(db.refine_jobs, worker_id)
+
+
+def _finish_refinement(refine_id, status, windows=None, error=None):
+    now = datetime.utcnow()
+    db.refine_jobs.update_one(
+        {"refine_id": refine_id},
+        {"$set": {"status": status, "windows": windows, "error": error, "finished_at": now, "updated_at": now}},
+    )
+
+
+# ----------------------------------------------------------------
+# Worker processes
+# ----------------------------------------------------------------
+def run_job(pipeline, job):
+    """Run the pipeline for one claimed job and record the outcome; never raises."""
+    job_id = job["job_id"]
+    print(f"👷 Worker picked up job {job_id} (attempt {job.get('attempts', 1)})")
+
+    retry = job.get("attempts", 1) > 1
+    last_write = [0.0]
+
+    def on_progress(frames_processed, total_frames):
+        now = time.monotonic()
+        if now - last_write[0] >= PROGRESS_INTERVAL:
+            last_write[0] = now
+            update_progress(job_id, frames_processed, total_frames)
+
+    # The lease is renewed by its own thread, not only by progress callbacks
+    stop_heartbeat = threading.Event()
+    keep_alive = threading.Thread(target=_keep_alive, args=(job_id, stop_heartbeat), daemon=True)
+    keep_alive.start()
+    try:
+        # A retried job starts over: drop what the interrupted attempt stored
+        if retry:
+            discard_attempt_outputs(job)
+
+        # Keyframe/byte-offset index for /videos/stream and /videos/clip; built
+        # here because the ffprobe fallback can take minutes
+        if "keyframes" not in job:
+            save_keyframe_index(job_id, build_keyframe_index(job["video_path"]))
+
+        result = pipeline.process_video(
+            job["video_path"],
+            metadata=job.get("metadata") or {},
+            job_id=job_id,
+            progress_callback=on_progress,
+            outputs_callback=lambda frames_folder, persons_folder: record_outputs(job_id, frames_folder, persons_folder),
+            count_run=not retry,
+        )
+
+        complete_job(job_id, result)
+        linked = link_job(job_id, result.get("time_tag"), result.get("persons_folder"))
+        refresh_job_summaries(job_id)
+    except Exception as e:
+        traceback.print_exc()
+        try:
+            fail_job(job_id, f"Job failed: {e}")
+        except Exception as fail_error:
+            # Left in `processing`; the expired lease hands it to the next worker
+            print(f"⚠️ Could not mark job {job_id} failed: {fail_error}")
+        print(f"❌ Job {job_id} failed: {e}")
+        return
+    finally:
+        stop_heartbeat.set()
+        keep_alive.join()
+
+    print(f"✅ Job {job_id} completed ({linked} reference(s) linked)")
+
+
+def run_refinement(pipeline, job):
+    """Run one claimed refinement with this worker's models; never raises."""
+    from app.ml.refinement import refine_matches
+
+    refine_id = job["refine_id"]
+    request = job.get("request") or {}
+    print(f"👷 Worker picked up refinement {refine_id} (attempt {job.get('attempts', 1)})")
+
+    stop_heartbeat = threading.Event()
+    keep_alive = threading.Thread(target=_keep_alive, args=(refine_id, stop_heartbeat, refinement_heartbeat),
+                                  daemon=True)
+    keep_alive.start()
+    try:
+        windows = refine_matches(
+            pipeline, job["matches"], request.get("refine_window_seconds"), request.get("refine_interval"),
+        )
+        _finish_refinement(refine_id, STATUS_COMPLETED, windows=windows)
+    except Exception as e:
+        traceback.print_exc()
+        try:
+            _finish_refinement(refine_id, STATUS_FAILED, error=f"Refinement failed: {e}")
+        except Exception as fail_error:
+            print(f"⚠️ Could not mark refinement {refine_id} failed: {fail_error}")
+        print(f"❌ Refinement {refine_id} failed: {e}")
+        return
+    finally:
+        stop_heartbeat.set()
+        keep_alive.join()
+
+    print(f"✅ Refinement {refine_id} completed ({len(windows)} window(s))")
+
+
+def _worker_main(worker_id, stop_event):
+    # Imported here so the (heavy) models are only loaded inside worker processes
+    from app.ml.pipeline import VideoProcessingPipeline
+
+    pipeline = VideoProcessingPipeline()
+    print(f"👷 Video worker {worker_id} ready")
+
+    while not stop_event.is_set():
+        job, run = None, None
+        try:
+            fail_exhausted_jobs()
+            # Refinements first: a /compare caller is waiting on them
+            job, run = claim_next_refinement(worker_id), run_refinement
+            if job is None:
+                job, run = claim_next_job(worker_id), run_job
+        except Exception as e:
+            print(f"⚠️ Worker {worker_id} could not poll queue: {e}")
+            job = None
+
+        if job is None:
+            stop_event.wait(POLL_INTERVAL)
+            continue
+
+        try:
+            run(pipeline, job)
+        except Exception as e:
+            # run_job / run_refinement record their own failures; this only keeps the loop alive
+            print(f"⚠️ Worker {worker_id} error on {job.get('job_id') or job.get('refine_id')}: {e}")
+
+    print(f"👋 Video worker {worker_id} stopped")
+
+
+class VideoJobWorkers:
+    """Starts and stops the pool of video worker processes, restarting any that die."""
+
+    def __init__(self, num_workers=None):
+        self.num_workers = num_workers or int(os.getenv("VIDEO_WORKERS", 1))
+        self._ctx = mp.get_context("spawn")
+        self._stop_event = self._ctx.Event()
+        self._processes = []
+        self._supervisor = None
+
+    def _spawn(self, i):
+        worker_id = f"{socket.gethostname()}-{os.getpid()}-{i}"
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, self._stop_event),
+            name=f"video-worker-{i}",
+        )
+        proc.start()
+        return proc
+
+    def _supervise(self):
+        while not self._stop_event.wait(SUPERVISE_INTERVAL):
+            for i, proc in enumerate(self._processes):
+                if proc.is_alive() or self._stop_event.is_set():
+                    continue
+                print(f"⚠️ Video worker {proc.name} exited with code {proc.exitcode}; restarting it")
+                self._processes[i] = self._spawn(i)
+
+    def start(self):
+        self._processes = [self._spawn(i) for i in range(self.num_workers)]
+        self._supervisor = threading.Thread(target=self._supervise, name="video-worker-supervisor", daemon=True)
+        self._supervisor.start()
+        print(f"🚀 Started {self.num_workers} video worker process(es)")
+
+    def stop(self, timeout=10):
+        self._stop_event.set()
+        if self._supervisor is not None:
+            self._supervisor.join()
+            self._supervisor = None
+        for proc in self._processes:
+            proc.join(timeout)
+            if proc.is_alive():
+                proc.terminate()
+        self._processes = []
@@ -0,0 +1,196 @@
+import os
+import bisect
+import shutil
+import struct
+import subprocess
+import numpy as np
+from app.db.mongo import db
+
+# ----------------------------------------------------------------
+# Keyframe index: [(time_seconds, byte_offset), ...] per video
+# ----------------------------------------------------------------
+# Built once by the job's worker from the MP4 sample tables (stss/stts/stsc/stsz/stco),
+# or with ffprobe for other containers when it is installed, and stored on the
+# video_jobs document. Used to snap a requested start time to the keyframe a
+# player (or a stream copy) can actually start decoding from.
+
+_CONTAINERS = {"moov", "trak", "mdia", "minf", "stbl"}
+
+
+def _boxes(f, start, end):
+    """Yield (type, payload_start, box_end) for the boxes in [start, end)."""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, box_type = struct.unpack(">I4s", f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield box_type.decode("latin-1"), pos + header, pos + size
+        pos += size
+
+
+# Sample tables read as plain integer arrays: box -> (columns, dtype)
+_TABLES = {"stts": (2, ">u4"), "stss": (1, ">u4"), "stsc": (3, ">u4"), "stco": (1, ">u4"), "co64": (1, ">u8")}
+
+
+def _read_table(f, start, columns, dtype):
+    """Full box: version/flags, entry count, then `columns` integers per entry."""
+    f.seek(start + 4)
+    (count,) = struct.unpack(">I", f.read(4))
+    data = f.read(count * columns * np.dtype(dtype).itemsize)
+    return np.frombuffer(data, dtype=dtype).astype(np.int64).reshape(count, columns)
+
+
+def _parse_track(f, trak_start, trak_end):
+    tables, handler, timescale = {}, None, None
+
+    def walk(start, end):
+        nonlocal handler, timescale
+        for box_type, payload, box_end in _boxes(f, start, end):
+            if box_type in _CONTAINERS:
+                walk(payload, box_end)
+            elif box_type == "hdlr":
+                f.seek(payload + 8)
+                handler = f.read(4).decode("latin-1")
+            elif box_type == "mdhd":
+                f.seek(payload)
+                version = f.read(1)[0]
+                f.seek(payload + (20 if version == 1 else 12))
+                (timescale,) = struct.unpack(">I", f.read(4))
+            elif box_type in _TABLES:
+                tables[box_type] = _read_table(f, payload, *_TABLES[box_type])
+            elif box_type == "stsz":
+                f.seek(payload + 4)
+                uniform, count = struct.unpack(">II", f.read(8))
+                tables["stsz"] = (np.full(count, uniform, dtype=np.int64) if uniform
+                                  else np.frombuffer(f.read(count * 4), dtype=">u4").astype(np.int64))
+
+    walk(trak_start, trak_end)
+    if handler != "vide" or not timescale:
+        return None
+
+    # Decode time of every sample
+    stts = tables["stts"]
+    deltas = np.repeat(stts[:, 1], stts[:, 0])
+    times = np.concatenate([[0], np.cumsum(deltas)[:-1]]) / float(timescale)
+
+    # Byte offset of every sample: chunk offset + sizes of earlier samples in the chunk
+    sizes = tables["stsz"]
+    chunk_offsets = (tables["co64"] if "co64" in tables else tables["stco"]).reshape(-1)
+    stsc = tables["stsc"]
+    first_chunks = stsc[:, 0] - 1
+    run_ends = np.append(first_chunks[1:], len(chunk_offsets))
+    samples_per_chunk = np.repeat(stsc[:, 1], run_ends - first_chunks)
+    chunk_of_sample = np.repeat(np.arange(len(samples_per_chunk)), samples_per_chunk)[:len(sizes)]
+    chunk_first_sample = np.concatenate([[0], np.cumsum(samples_per_chunk)[:-1]])
+    size_before = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    offsets = chunk_offsets[chunk_of_sample] + size_before - size_before[chunk_first_sample[chunk_of_sample]]
+
+    # Sync samples (1-based); no stss means every sample is a keyframe
+    sync = tables["stss"].reshape(-1) - 1 if "stss" in tables else np.arange(len(sizes))
+    sync = sync[sync < min(len(times), len(offsets))]
+    return [(round(float(times[i]), 3), int(offsets[i])) for i in sync]
+
+
+def _mp4_keyframes(video_path):
+    with open(video_path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        for box_type, payload, box_end in _boxes(f, 0, file_size):
+            if box_type != "moov":
+                continue
+            for child, child_payload, child_end in _boxes(f, payload, box_end):
+                if child == "trak":
+                    keyframes = _parse_track(f, child_payload, child_end)
+                    if keyframes:
+                        return keyframes
+    return None
+
+
+def _ffprobe_keyframes(video_path):
+    if shutil.which("ffprobe") is None:
+        return None
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0", "-skip_frame", "nokey",
+         "-show_entries", "frame=pts_time,pkt_pos", "-of", "csv=p=0", str(video_path)],
+        capture_output=True, text=True, timeout=300, check=True,
+    ).stdout
+    keyframes = []
+    for line in out.splitlines():
+        parts = line.strip().split(",")
+        try:
+            keyframes.append((round(float(parts[0]), 3), int(parts[1])))
+        except (ValueError, IndexError):
+            continue
+    return keyframes or None
+
+
+def build_keyframe_index(video_path):
+    """Keyframe (time, byte offset) list for a video, or None if it cannot be determined."""
+    try:
+        keyframes = _mp4_keyframes(video_path)
+    except Exception as e:
+        print(f"⚠️ MP4 keyframe parse failed for {video_path}: {e}")
+        keyframes = None
+    if keyframes is None:
+        try:
+            keyframes = _ffprobe_keyframes(video_path)
+        except Exception as e:
+            print(f"⚠️ ffprobe keyframe scan failed for {video_path}: {e}")
+    return keyframes
+
+
+def save_keyframe_index(job_id, keyframes):
+    db.video_jobs.update_one({"job_id": job_id}, {"$set": {"keyframes": keyframes}})
+
+
+def get_keyframe_index(job_id, video_path):
+    """
+    Stored keyframe index for a job, or None while its worker has not built
+    it yet. Built and stored on first use for uploads that predate it.
+    """
+    doc = db.video_jobs.find_one({"job_id": job_id}, {"keyframes": 1, "status": 1})
+    if doc and "keyframes" in doc:
+        return doc["keyframes"]
+    if doc and doc.get("status") in ("queued", "processing"):
+        return None
+    keyframes = build_keyframe_index(video_path)
+    if doc:
+        save_keyframe_index(job_id, keyframes)
+    return keyframes
+
+
+def keyframe_at(keyframes, seconds):
+    """Last keyframe at or before `seconds` as (time, offset); the first one if none precede it."""
+    if not keyframes:
+        return None
+    i = bisect.bisect_right([k[0] for k in keyframes], seconds) - 1
+    return tuple(keyframes[max(i, 0)])
+
+
+# ----------------------------------------------------------------
+# Clips (stream copy, no re-encode)
+# ----------------------------------------------------------------
+def ffmpeg_available():
+    return shutil.which("ffmpeg") is not None
+
+
+def extract_clip(video_path, start, duration, out_path):
+    """
+    Copy `duration` seconds starting at keyframe time `start` into out_path.
+    Streams are copied, so the cut is only as precise as the keyframes.
+    """
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp_path = f"{out_path}.tmp.{os.getpid()}.mp4"
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-ss", f"{start:.3f}", "-i", str(video_path), "-t", f"{duration:.3f}",
+         "-map", "0", "-c", "copy", "-avoid_negative_ts", "make_zero", "-movflags", "+faststart", tmp_path],
+        capture_output=True, timeout=120, check=True,
+    )
+    os.replace(tmp_path, out_path)
+    return out_path
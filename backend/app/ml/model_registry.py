@@ -0,0 +1,128 @@
+import os
+import time
+import threading
+from datetime import datetime
+
+try:
+    import psutil
+except ImportError:  # optional, only used for memory stats
+    psutil = None
+
+
+def _process_rss_bytes():
+    """Current resident memory of this process, or None if unavailable."""
+    if psutil is not None:
+        return psutil.Process(os.getpid()).memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _to_mb(num_bytes):
+    return round(num_bytes / (1024 * 1024), 2) if num_bytes is not None else None
+
+
+class ModelRegistry:
+    """
+    Process-wide, lazily initialized holder for the heavy ML models.
+    Every route and pipeline gets its models from here, so each model is
+    loaded at most once per process, on first use.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._models = {}
+        self._stats = {}
+
+    def _get(self, name, factory):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        # One lock per model: concurrent callers wait for a single load,
+        # while different models can still load in parallel
+        with self._lock:
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        with load_lock:
+            model = self._models.get(name)
+            if model is not None:
+                return model
+
+            rss_before = _process_rss_bytes()
+            start = time.perf_counter()
+            model = factory()
+            load_seconds = time.perf_counter() - start
+            rss_after = _process_rss_bytes()
+
+            self._stats[name] = {
+                "load_seconds": round(load_seconds, 3),
+                "memory_delta_mb": _to_mb(rss_after - rss_before) if rss_before is not None and rss_after is not None else None,
+                "loaded_at": str(datetime.utcnow()),
+            }
+            self._models[name] = model
+            print(f"📦 Model '{name}' loaded in {load_seconds:.2f}s")
+            return model
+
+    # -------------------------------------------------------------------------
+    # Model accessors
+    # -------------------------------------------------------------------------
+    def get_detector(self, model_path="yolov8n.pt"):
+        from app.ml.detector import PersonDetector
+        return self._get(f"yolo:{model_path}", lambda: PersonDetector(model_path))
+
+    def get_embedding_model(self):
+        from app.ml.embeddings import EmbeddingModel
+        return self._get("insightface:buffalo_l", EmbeddingModel)
+
+    def get_face_analyzer(self):
+        from app.ml.embeddings import FaceFrameAnalyzer
+        return self._get("insightface:buffalo_l:frame", FaceFrameAnalyzer)
+
+    def get_faiss_index(self):
+        from app.ml.faiss_store import FaissIndex
+        return self._get("faiss:reference", FaissIndex)
+
+    def get_video_index(self):
+        from app.ml.video_index import VideoEmbeddingIndex
+        return self._get("faiss:video", VideoEmbeddingIndex)
+
+    # -------------------------------------------------------------------------
+    # Introspection
+    # -------------------------------------------------------------------------
+    def loaded_models(self):
+        return list(self._models.keys())
+
+    def stats(self):
+        return {
+            "pid": os.getpid(),
+            "process_rss_mb": _to_mb(_process_rss_bytes()),
+            "models": dict(self._stats),
+        }
+
+
+# Shared instance for this process
+registry = ModelRegistry()
+
+
+def get_detector(model_path="yolov8n.pt"):
+    return registry.get_detector(model_path)
+
+
+def get_embedding_model():
+    return registry.get_embedding_model()
+
+
+def get_face_analyzer():
+    return registry.get_face_analyzer()
+
+
+def get_faiss_index():
+    return registry.get_faiss_index()
+
+
+def get_video_index():
+    return registry.get_video_index()
@@ -0,0 +1,81 @@
+import os
+import cv2
+import numpy as np
+
+# ----------------------------------------------------------------
+# Motion-gated frame sampling
+# ----------------------------------------------------------------
+# With SAMPLING_MODE=motion, process_video looks at every
+# MOTION_MIN_INTERVAL-th frame but only sends it to the detector when a
+# downscaled grayscale copy differs enough from the last frame that was
+# sent (motion, a scene cut, lighting change), or when MOTION_MAX_INTERVAL
+# frames have passed without one. Static footage is then checked at the
+# cost of a tiny resize + absdiff instead of a YOLO call.
+
+SAMPLING_MODE = os.getenv("SAMPLING_MODE", "fixed")                 # fixed | motion
+MOTION_MIN_INTERVAL = int(os.getenv("MOTION_MIN_INTERVAL", 10))    # frames between checks
+MOTION_MAX_INTERVAL = int(os.getenv("MOTION_MAX_INTERVAL", 200))   # longest gap between detector frames
+MOTION_THRESHOLD = float(os.getenv("MOTION_THRESHOLD", 0.01))      # fraction of changed pixels
+MOTION_PIXEL_DELTA = int(os.getenv("MOTION_PIXEL_DELTA", 25))      # gray-level change counted as "changed"
+MOTION_WIDTH = 96                                                  # width of the compared copy
+
+
+class MotionSampler:
+    """
+    Filters a stream of SampledFrame down to the frames worth detecting.
+    `stats` counts, for the frames seen so far: checked, sent, skipped, and
+    why frames were sent (first / motion / max_interval).
+    """
+
+    def __init__(self, min_interval=MOTION_MIN_INTERVAL, max_interval=MOTION_MAX_INTERVAL,
+                 threshold=MOTION_THRESHOLD, pixel_delta=MOTION_PIXEL_DELTA, width=MOTION_WIDTH):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.width = width
+        self.stats = {"checked": 0, "sent": 0, "skipped": 0, "first": 0, "motion": 0, "max_interval": 0}
+
+    def _signature(self, image):
+        h, w = image.shape[:2]
+        small = cv2.resize(image, (self.width, max(1, int(h * self.width / w))), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (3, 3), 0)  # ignore sensor noise / compression speckle
+
+    def changed_fraction(self, a, b):
+        return float(np.count_nonzero(cv2.absdiff(a, b) > self.pixel_delta)) / a.size
+
+    def select(self, frames):
+        """Yield the frames (from a min_interval stride) that should go to the detector."""
+        reference, reference_index = None, None  # last frame sent
+        for sampled in frames:
+            self.stats["checked"] += 1
+            signature = self._signature(sampled.image)
+
+            if reference is None:
+                reason = "first"
+            elif sampled.index - reference_index >= self.max_interval:
+                reason = "max_interval"
+            elif self.changed_fraction(signature, reference) >= self.threshold:
+                reason = "motion"
+            else:
+                self.stats["skipped"] += 1
+                continue
+
+            self.stats[reason] += 1
+            self.stats["sent"] += 1
+            reference, reference_index = signature, sampled.index
+            yield sampled
+
+
+_COUNTERS = ("checked", "sent", "skipped", "first", "motion", "max_interval")
+
+
+def merge_sampling_stats(total, stats):
+    """Add one range's sampler stats into a job total (in place); settings are copied."""
+    for key, value in stats.items():
+        if key in _COUNTERS:
+            total[key] = total.get(key, 0) + value
+        else:
+            total.setdefault(key, value)
+    return total
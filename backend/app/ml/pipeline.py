@@ -1,13 +1,24 @@
 import os
 import cv2
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 import numpy as np
 import logging
 import onnxruntime as ort
 from datetime import datetime
-from app.ml.detector import PersonDetector
-from app.ml.embeddings import EmbeddingModel
-from app.ml.faiss_store import FaissIndex
+from app.ml.frame_source import FrameSource
+from app.ml.stages import FrameDecoder, OutputWriter
+from app.ml.motion import SAMPLING_MODE, MOTION_MIN_INTERVAL, MOTION_MAX_INTERVAL, MotionSampler, merge_sampling_stats
+from app.ml.tracker import TRACKING, TRACK_MAX_GAP, FaceTracker, Observation, observation_quality
+from app.ml.face_quality import new_face_gate
+from app.ml.thumbnails import save_detection_thumbnail
+from app.ml.model_registry import get_detector, get_embedding_model, get_face_analyzer, get_video_index
+from app.ml.embeddings import FACE_MODE
+from bson import ObjectId
 from app.db.mongo import db  # MongoDB connection
+from app.db.embedding_store import EmbeddingWriter, encode_embedding
+from app.db.dashboard_summary import increment_counter
+from app.db.file_index import register_files, KIND_PERSONS, KIND_FRAMES
 
 # 🚫 Suppress ONNXRuntime and InsightFace logs
 ort.set_default_logger_severity(3)  # 0=verbose, 1=info, 2=warning, 3=error, 4=fatal
@@ -24,20 +35,37 @@ warnings.filterwarnings("ignore")
 logging.getLogger("ultralytics").setLevel(logging.ERROR)
 
 
+# Worker processes per video for segmented processing (1 = sequential) and the
+# shortest segment worth a process of its own (each worker loads its own models)
+SEGMENT_WORKERS = int(os.getenv("VIDEO_SEGMENT_WORKERS", 1))
+MIN_SEGMENT_FRAMES = int(os.getenv("VIDEO_MIN_SEGMENT_FRAMES", 3000))
+SEGMENT_POLL_SECONDS = 2.0  # progress_callback period while segments run (it doubles as the job heartbeat)
+
+
 class VideoProcessingPipeline:
-    def __init__(self, output_dir="app/data/outputs"):
+    def __init__(self, output_dir="app/data/outputs", batch_size=None, face_mode=None):
         self.output_dir = output_dir
         os.makedirs(self.output_dir, exist_ok=True)
 
-        # Initialize models
-        self.detector = PersonDetector("yolov8n.pt")
-        self.embedding_model = EmbeddingModel()
-        self.faiss_index = FaissIndex()
+        # Shared models (loaded once per process by the registry)
+        self.detector = get_detector("yolov8n.pt")
+        self.face_mode = face_mode or FACE_MODE  # "crop" (per person) | "frame" (per frame, batched)
+        if self.face_mode == "frame":
+            self.face_analyzer = get_face_analyzer()
+        else:
+            self.embedding_model = get_embedding_model()
+        self.video_index = get_video_index()  # ANN shards over video embeddings
 
         # Adjustable thresholds
         self.frame_interval = 40          # process every 40 frames
+        self.batch_size = batch_size or int(os.getenv("YOLO_BATCH_SIZE", 8))  # sampled frames per YOLO call
         self.yolo_conf_threshold = 0.7    # only strong person detections
         self.final_score_threshold = 0.75 # only save embeddings with high similarity
+        self.sampling_mode = SAMPLING_MODE  # "fixed": every frame_interval-th frame; "motion": see app/ml/motion.py
+        self.tracking = TRACKING            # "on": store only the best observations per track (app/ml/tracker.py)
+
+        self._pool = None  # segment worker processes, created on first segmented run
+        self._pool_workers = 0
 
     def _extract_metadata(self, image):
         """
@@ -70,11 +98,22 @@ class VideoProcessingPipeline:
             print(f"⚠️ Metadata extraction failed: {e}")
             return {"age": None, "gender": None, "color": None}
 
-    def process_video(self, video_path, metadata=None, job_id=None):
+    def process_video(self, video_path, metadata=None, job_id=None, progress_callback=None, segment_workers=None,
+                      outputs_callback=None, count_run=True):
+        """
+        Runs detection + embedding over the sampled frames of a video.
+        Sampled frames are sent to YOLO in batches of `self.batch_size`.
+        progress_callback: optional callable(frames_processed, total_frames),
+        invoked after every processed batch (used by the job queue workers).
+        segment_workers: split long videos into frame ranges processed by that
+        many worker processes (default VIDEO_SEGMENT_WORKERS; 1 = sequential).
+        outputs_callback: optional callable(frames_folder, persons_folder),
+        invoked once the output folders exist (so a retry can remove them).
+        count_run: count this run in the dashboard totals (False on retries).
+        """
         print(f"🎥 Starting video processing: {video_path}")
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            raise Exception(f"Cannot open video: {video_path}")
+        source = FrameSource(video_path)
+        total_frames = source.frame_count
 
         # Job ID based on current timestamp
         if job_id is None:
@@ -86,89 +125,438 @@ class VideoProcessingPipeline:
         persons_folder = os.path.join(self.output_dir, f"persons_{time_tag}")
         os.makedirs(frames_folder, exist_ok=True)
         os.makedirs(persons_folder, exist_ok=True)
+        if outputs_callback:
+            outputs_callback(frames_folder, persons_folder)
+        if count_run:
+            increment_counter("total_detections")  # one persons_* folder per run
 
-        frame_count = 0
-        saved_frames = 0
-        saved_crops = 0
-        all_detections = []
+        segments = self._plan_segments(total_frames, segment_workers or SEGMENT_WORKERS)
+        if len(segments) > 1:
+            source.close()
+            job = self._process_segmented(video_path, job_id, frames_folder, persons_folder, segments,
+                                          progress_callback, total_frames)
+        else:
+            # Mutable per-job state shared with _process_batch
+            job = self._new_job_state(job_id, video_path, frames_folder, persons_folder)
+            self._process_range(source, job, 0, None, progress_callback, total_frames)
+            source.close()
+            job["detections"] = self._frame_detections(job)
+            job["tracking"] = self._tracking_stats(job)
+            job["face_quality"] = self._face_quality_stats(job)
+
+        # Persist the job's ANN shard (embeddings are already written)
+        self.video_index.save(job_id)
+
+        print(f"✅ Video processing complete: {job['saved_crops']} valid persons saved, {job['saved_frames']} frames with detections")
+        if job["tracking"]:
+            stats = job["tracking"]
+            print(f"🧭 Tracking: {stats['observations']} detections -> {stats['tracks']} tracks, {stats['stored']} stored")
+        if job["face_quality"]:
+            stats = job["face_quality"]
+            print(f"🔎 Face quality: {stats['rejected']}/{stats['checked']} crops rejected before embedding")
+
+        return {
+            "job_id": job_id,
+            "time_tag": time_tag,
+            "persons_folder": persons_folder,
+            "frames_saved": job["saved_frames"],
+            "persons_saved": job["saved_crops"],
+            "detections": job["detections"],
+            "sampling": job["sampling"],
+            "tracking": job["tracking"],
+            "face_quality": job["face_quality"]
+        }
 
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
+    def _new_job_state(self, job_id, video_path, frames_folder, persons_folder, crop_prefix="person_",
+                       index_buffer=None, track_prefix="", tracking=None):
+        return {
+            "job_id": job_id,
+            "video_name": os.path.basename(video_path),
+            "frames_folder": frames_folder,
+            "persons_folder": persons_folder,
+            "crop_prefix": crop_prefix,   # crop file names: {prefix}{n}_frame_{frame}.jpg
+            "index_buffer": index_buffer, # (vectors, ids) collected for the parent, or None to index directly
+            "saved_frames": 0,
+            "saved_crops": 0,
+            "detections": {},             # frame number -> {"frame", "detections"}
+            "sampling": {},               # sampler stats (frames checked / sent / skipped)
+            "tracker": FaceTracker(track_prefix, max_gap=self._track_max_gap())
+            if (tracking if tracking is not None else self.tracking == "on") else None,
+            "face_gate": new_face_gate(),  # face-quality pre-filter (None = off)
+            "writer": EmbeddingWriter(db.embeddings),  # buffered insert_many (writer-db thread only)
+        }
 
-            # Process every Nth frame
-            if frame_count % self.frame_interval != 0:
-                frame_count += 1
-                continue
+    def _process_range(self, source, job, start, end, progress_callback=None, total_frames=0,
+                       interval=None, skip_frames=None):
+        """
+        Process the sampled frames of [start, end) from an open FrameSource.
+        Decoding runs on its own thread and image / Mongo writes on a writer
+        pool, so inference (this thread) does not wait on either. Everything
+        is written when this returns.
+        interval: fixed stride overriding the sampling mode (refinement);
+        skip_frames: frame numbers not to process again.
+        """
+        # Only every Nth frame is decoded; the rest are grabbed and dropped
+        mode = "fixed" if interval else self.sampling_mode
+        stride = interval or self._sample_stride()
+        frames = source.sample(stride, start=start, end=end)
+        if skip_frames:
+            frames = (sampled for sampled in frames if sampled.index not in skip_frames)
+        if mode == "motion":
+            sampler = MotionSampler()
+            frames = sampler.select(frames)
+            stats = sampler.stats
+        else:
+            stats = {"checked": 0, "sent": 0, "skipped": 0}
+        stats.update(mode=mode, stride=stride)
 
-            # Detect persons
-            detections = self.detector.detect_persons_from_frame(frame)
-            print(f"🧍 Frame {frame_count}: {len(detections)} persons detected by YOLO")
+        decoder = FrameDecoder(frames, self.batch_size)
+        output = OutputWriter()
+        decoder.start()
+        try:
+            for batch in decoder:
+                if mode != "motion":
+                    stats["checked"] += len(batch)
+                    stats["sent"] += len(batch)
+                self._process_batch(batch, job, output)
+                if progress_callback:
+                    progress_callback(batch[-1].index + 1, total_frames)
 
-            frame_detections = []
+            # Tracks still open at the end of the range
+            if job["tracker"] is not None:
+                pending = self._new_pending()
+                for track in job["tracker"].close_all():
+                    self._store_track(track, job, output, pending)
+                self._flush_pending(job, output, pending)
+            output.submit_serial(job["writer"].flush)
+        finally:
+            decoder.stop()
+            output.close()
+            merge_sampling_stats(job["sampling"], stats)
+            if stats["skipped"]:
+                print(f"🎞️ Motion sampling: {stats['sent']}/{stats['checked']} checked frames sent to the detector")
 
-            for det in detections:
-                if det["confidence"] < self.yolo_conf_threshold:
-                    continue
+    def _frame_detections(self, job):
+        """Per-frame detections as the result list, in frame order."""
+        return [job["detections"][frame] for frame in sorted(job["detections"])]
 
-                x1, y1, x2, y2 = det["box"]
-                h_crop = int((y2 - y1) * 0.35)  # approximate face region
-                face_crop = frame[y1:y1+h_crop, x1:x2]
+    def _tracking_stats(self, job):
+        return dict(job["tracker"].stats) if job["tracker"] is not None else None
 
-                # Get embedding
-                emb = self.embedding_model.get_embedding_from_image(face_crop)
-                if emb is None:
-                    continue
-
-                # Save cropped face image with timestamp + frame number
-                crop_filename = f"person_{saved_crops+1}_frame_{frame_count}.jpg"
-                crop_path = os.path.join(persons_folder, crop_filename)
-                cv2.imwrite(crop_path, face_crop)
-                saved_crops += 1
-
-                # ✅ Extract metadata (same structure as reference)
-                metadata_info = self._extract_metadata(face_crop)
-
-                # ✅ Save embedding + metadata in MongoDB
-                db.embeddings.insert_one({
-                    "job_id": job_id,
-                    "video_name": os.path.basename(video_path),
-                    "crop_path": crop_path,
-                    "embedding": emb.tolist(),
-                    "timestamp": str(datetime.now()),
-                    "age": metadata_info["age"],
-                    "gender": metadata_info["gender"],
-                    "color": metadata_info["color"]
-                })
-
-                frame_detections.append({
-                    "crop_path": crop_path,
-                    "confidence": det["confidence"],
-                    "age": metadata_info["age"],
-                    "gender": metadata_info["gender"],
-                    "color": metadata_info["color"]
-                })
-
-            # Save full frame only if valid detections found
-            if frame_detections:
-                frame_filename = f"frame_{frame_count}.jpg"
-                frame_path = os.path.join(frames_folder, frame_filename)
-                cv2.imwrite(frame_path, frame)
-                saved_frames += 1
-                all_detections.append({
-                    "frame": frame_count,
-                    "detections": frame_detections
-                })
-
-            frame_count += 1
-
-        cap.release()
-        print(f"✅ Video processing complete: {saved_crops} valid persons saved, {saved_frames} frames with detections")
+    def _face_quality_stats(self, job):
+        return dict(job["face_gate"].stats) if job["face_gate"] is not None else None
 
+    def _sample_stride(self):
+        """Frames between candidates: every candidate is detected (fixed) or motion-checked (motion)."""
+        return MOTION_MIN_INTERVAL if self.sampling_mode == "motion" else self.frame_interval
+
+    def _track_max_gap(self):
+        """
+        TRACK_MAX_GAP, raised to the longest run without a detector call: with
+        motion sampling a person standing still is only detected every
+        MOTION_MAX_INTERVAL frames (rounded up to the stride), and closing the
+        track in between would store each sighting as a new person.
+        """
+        if self.sampling_mode != "motion":
+            return max(TRACK_MAX_GAP, self.frame_interval)
+        stride = self._sample_stride()
+        return max(TRACK_MAX_GAP, max(MOTION_MAX_INTERVAL, stride) + stride)
+
+    # -------------------------------------------------------------------------
+    # Refinement: dense re-scan of a window of an already processed video
+    # -------------------------------------------------------------------------
+    def refine_window(self, video_path, job_id, persons_folder, start, end, interval, skip_frames=()):
+        """
+        Re-process frames [start, end) every `interval` frames and append the
+        new crops, frames and embeddings to job `job_id`. Frames listed in
+        `skip_frames` (already stored) are not processed again. Tracking is
+        off here: the point of a refinement is every densely sampled face,
+        not TRACK_KEEP per person.
+        """
+        folder, name = os.path.split(persons_folder)
+        frames_folder = os.path.join(folder, name.replace("persons_", "frames_", 1))
+        os.makedirs(frames_folder, exist_ok=True)
+        os.makedirs(persons_folder, exist_ok=True)
+
+        # Unique per run: the same window may be re-scanned later at a finer interval
+        run_tag = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        job = self._new_job_state(job_id, video_path, frames_folder, persons_folder,
+                                  crop_prefix=f"person_r{run_tag}_", track_prefix=f"r{run_tag}_", tracking=False)
+        with FrameSource(video_path) as source:
+            if not source.seek(start):
+                raise Exception(f"Cannot seek to frame {start} in {video_path}")
+            self._process_range(source, job, start, end, interval=interval, skip_frames=set(skip_frames))
+        self.video_index.save(job_id)
+
+        print(f"🔬 Refined frames [{start}, {end}) of job {job_id} every {interval}: {job['saved_crops']} persons added")
         return {
-            "job_id": job_id,
-            "frames_saved": saved_frames,
-            "persons_saved": saved_crops,
-            "detections": all_detections
+            "frames_saved": job["saved_frames"],
+            "persons_saved": job["saved_crops"],
+            "detections": self._frame_detections(job),
+        }
+
+    # -------------------------------------------------------------------------
+    # Segmented (multi-process) processing
+    # -------------------------------------------------------------------------
+    def _plan_segments(self, total_frames, workers):
+        """
+        Split [0, total_frames) into at most `workers` ranges of at least
+        MIN_SEGMENT_FRAMES. Boundaries are multiples of the sampling stride, so
+        the candidate frames are exactly the ones a sequential run would use.
+        """
+        count = min(workers, max(1, total_frames // MIN_SEGMENT_FRAMES))
+        if count <= 1:
+            return [(0, None)]
+        length = -(-total_frames // count)
+        stride = self._sample_stride()
+        length = -(-length // stride) * stride
+        starts = list(range(0, total_frames, length))
+        return [(s, starts[i + 1] if i + 1 < len(starts) else None) for i, s in enumerate(starts)]
+
+    def _segment_pool(self, workers):
+        if self._pool is None or self._pool_workers != workers:
+            if self._pool is not None:
+                self._pool.shutdown()
+            self._pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=mp.get_context("spawn"),
+                initializer=_init_segment_worker,
+                initargs=(self.output_dir, self.batch_size, self.face_mode),
+            )
+            self._pool_workers = workers
+        return self._pool
+
+    def _process_segmented(self, video_path, job_id, frames_folder, persons_folder, segments,
+                           progress_callback, total_frames):
+        """Run each segment in a worker process (own models), then merge into one job."""
+        print(f"🧩 Splitting {total_frames} frames into {len(segments)} segments")
+        pool = self._segment_pool(len(segments))
+        futures = {
+            pool.submit(_run_segment, video_path, job_id, number, start, end, frames_folder, persons_folder): number
+            for number, (start, end) in enumerate(segments)
+        }
+
+        # Poll instead of blocking until a segment finishes: a long segment
+        # must not stall the progress callback that keeps the job's lease alive
+        results, frames_done, running = {}, 0, set(futures)
+        while running:
+            done, running = wait(running, timeout=SEGMENT_POLL_SECONDS, return_when=FIRST_COMPLETED)
+            for future in done:
+                number = futures[future]
+                results[number] = future.result()
+                start, end = segments[number]
+                frames_done += (end if end is not None else total_frames) - start
+            if progress_callback:
+                progress_callback(min(frames_done, total_frames), total_frames)
+
+        # Merge in frame order; the ANN shard is only written by this process
+        job = {"saved_frames": 0, "saved_crops": 0, "detections": [], "sampling": {}, "tracking": None,
+               "face_quality": None}
+        for number in range(len(segments)):
+            part = results[number]
+            job["saved_frames"] += part["saved_frames"]
+            job["saved_crops"] += part["saved_crops"]
+            job["detections"].extend(part["detections"])
+            merge_sampling_stats(job["sampling"], part["sampling"])
+            for key in ("tracking", "face_quality"):
+                if part[key] is not None:
+                    job[key] = job[key] or {}
+                    for name, value in part[key].items():
+                        job[key][name] = job[key].get(name, 0) + value
+            self.video_index.add(job_id, part["index_vectors"], part["index_ids"])
+        return job
+
+    def process_segment(self, video_path, job_id, number, start, end, frames_folder, persons_folder):
+        """Worker side of a segmented run: process [start, end) and return what the parent merges."""
+        job = self._new_job_state(job_id, video_path, frames_folder, persons_folder,
+                                  crop_prefix=f"person_s{number}_", index_buffer=([], []),
+                                  track_prefix=f"s{number}_")
+        with FrameSource(video_path) as source:
+            if not source.seek(start):
+                raise Exception(f"Cannot seek to frame {start} in {video_path}")
+            self._process_range(source, job, start, end)
+        print(f"🧩 Segment {number} [{start}, {end}) done: {job['saved_crops']} persons")
+        return {
+            "saved_frames": job["saved_frames"],
+            "saved_crops": job["saved_crops"],
+            "detections": self._frame_detections(job),
+            "sampling": job["sampling"],
+            "tracking": self._tracking_stats(job),
+            "face_quality": self._face_quality_stats(job),
+            "index_vectors": job["index_buffer"][0],
+            "index_ids": job["index_buffer"][1],
+        }
+
+    def _process_batch(self, batch, job, output):
+        """
+        Runs YOLO once over a batch of sampled frames, then embeds every
+        confident person per frame. Files and embedding documents are handed
+        to `output` (an OutputWriter) rather than written here.
+        """
+        frames = [sampled.image for sampled in batch]
+        batch_detections = self.detector.detect_persons_batch(frames)
+        for sampled, detections in zip(batch, batch_detections):
+            print(f"🧍 Frame {sampled.index}: {len(detections)} persons detected by YOLO")
+        batch_detections = [
+            [det for det in detections if det["confidence"] >= self.yolo_conf_threshold]
+            for detections in batch_detections
+        ]
+
+        # Drop tiny / blurred / badly exposed faces before any face model runs
+        if job["face_gate"] is not None:
+            batch_detections = [
+                [det for det in detections if job["face_gate"].check(self._face_crop(sampled.image, det["box"])) is None]
+                for sampled, detections in zip(batch, batch_detections)
+            ]
+
+        # Frame mode: one face detection per frame, then batched recognition + gender/age
+        batch_faces = None
+        if self.face_mode == "frame":
+            batch_faces = self.face_analyzer.analyze(
+                frames, [[det["box"] for det in detections] for detections in batch_detections]
+            )
+
+        pending = self._new_pending()
+        for f, (sampled, detections) in enumerate(zip(batch, batch_detections)):
+            frame_count, frame = sampled.index, sampled.image
+            observations = []
+
+            for p, det in enumerate(detections):
+                face_crop = self._face_crop(frame, det["box"])
+
+                # Get embedding
+                if batch_faces is not None:
+                    face = batch_faces[f][p]
+                    if face is None:
+                        continue
+                    emb = face["embedding"]
+                else:
+                    face = None
+                    emb = self.embedding_model.get_embedding_from_image(face_crop)
+                    if emb is None:
+                        continue
+
+                observations.append(Observation(
+                    frame=frame_count, pts=float(sampled.timestamp), image=frame, box=det["box"],
+                    confidence=det["confidence"], crop=face_crop, embedding=emb, face=face,
+                    quality=observation_quality(det["confidence"], face_crop),
+                ))
+
+            if job["tracker"] is None:
+                for obs in observations:
+                    self._store_observation(obs, job, output, pending)
+            else:
+                # Only the best observations of a track are stored, once it ends
+                for track in job["tracker"].update(frame_count, observations):
+                    self._store_track(track, job, output, pending)
+
+        self._flush_pending(job, output, pending)
+
+    def _face_crop(self, frame, box):
+        x1, y1, x2, y2 = box
+        h_crop = int((y2 - y1) * 0.35)  # approximate face region
+        return frame[y1:y1+h_crop, x1:x2]
+
+    def _new_pending(self):
+        """Per-batch outputs handed to the writer-db thread / ANN shard together."""
+        return {"docs": [], "writes": [], "crop_paths": [], "frame_paths": [], "index_vectors": [], "index_ids": []}
+
+    def _store_track(self, track, job, output, pending):
+        span = track.span()
+        for obs in track.representatives():
+            self._store_observation(obs, job, output, pending, span)
+
+    def _store_observation(self, obs, job, output, pending, track_span=None):
+        """Write one person: crop, embedding doc, ANN entry and (once per frame) the full frame."""
+        frame_count = obs.frame
+
+        # Save cropped face image with timestamp + frame number
+        crop_filename = f"{job['crop_prefix']}{job['saved_crops']+1}_frame_{frame_count}.jpg"
+        crop_path = os.path.join(job["persons_folder"], crop_filename)
+        pending["writes"].append(output.submit(cv2.imwrite, crop_path, obs.crop))
+        pending["crop_paths"].append(crop_path)
+        job["saved_crops"] += 1
+
+        # ✅ Extract metadata (same structure as reference)
+        metadata_info = self._extract_metadata(obs.crop)
+        if obs.face is not None and obs.face["gender"] is not None:
+            # Frame mode has the real gender/age model output
+            metadata_info.update(age=obs.face["age"], gender=obs.face["gender"])
+
+        # ✅ Save embedding + metadata in MongoDB (v2 binary format, buffered)
+        doc_id = ObjectId()  # assigned here so the ANN index can reference it now
+        pending["docs"].append({
+            "_id": doc_id,
+            "job_id": job["job_id"],
+            "video_name": job["video_name"],
+            "crop_path": crop_path,
+            "frame_number": frame_count,
+            "pts": round(obs.pts, 3),
+            **encode_embedding(obs.embedding),
+            "timestamp": str(datetime.now()),
+            "age": metadata_info["age"],
+            "gender": metadata_info["gender"],
+            "color": metadata_info["color"],
+            **(track_span or {}),
+        })
+        pending["index_vectors"].append(obs.embedding)
+        pending["index_ids"].append(doc_id)
+
+        detection = {
+            "crop_path": crop_path,
+            "confidence": obs.confidence,
+            "age": metadata_info["age"],
+            "gender": metadata_info["gender"],
+            "color": metadata_info["color"]
         }
+        if track_span:
+            detection["track_id"] = track_span["track_id"]
+
+        # Save full frame only if valid detections found
+        if frame_count not in job["detections"]:
+            frame_filename = f"frame_{frame_count}.jpg"
+            frame_path = os.path.join(job["frames_folder"], frame_filename)
+            pending["writes"].append(output.submit(cv2.imwrite, frame_path, obs.image))
+            pending["writes"].append(output.submit(save_detection_thumbnail, job["job_id"], frame_count, obs.image))
+            pending["frame_paths"].append(frame_path)
+            job["saved_frames"] += 1
+            job["detections"][frame_count] = {
+                "frame": frame_count,
+                "detections": []
+            }
+        job["detections"][frame_count]["detections"].append(detection)
+
+    def _flush_pending(self, job, output, pending):
+        # Incrementally extend this job's ANN shard (segment workers hand theirs to the parent)
+        if job["index_buffer"] is not None:
+            job["index_buffer"][0].extend(pending["index_vectors"])
+            job["index_buffer"][1].extend(pending["index_ids"])
+        else:
+            self.video_index.add(job["job_id"], pending["index_vectors"], pending["index_ids"])
+
+        output.submit_serial(self._store_batch, job, pending["docs"], pending["crop_paths"],
+                             pending["frame_paths"], pending["writes"])
+
+    def _store_batch(self, job, docs, crop_paths, frame_paths, writes):
+        """Writer-db thread: buffer the embedding docs and index the batch's images once written."""
+        for doc in docs:
+            job["writer"].add(doc)
+        # Make the new images servable by filename
+        wait(writes)
+        register_files(KIND_PERSONS, crop_paths)
+        register_files(KIND_FRAMES, frame_paths)
+
+
+# ----------------------------------------------------------------
+# Segment worker process entry points
+# ----------------------------------------------------------------
+_segment_pipeline = None
+
+
+def _init_segment_worker(output_dir, batch_size, face_mode):
+    global _segment_pipeline
+    _segment_pipeline = VideoProcessingPipeline(output_dir=output_dir, batch_size=batch_size, face_mode=face_mode)
+
+
+def _run_segment(*args):
+    return _segment_pipeline.process_segment(*args)
@@ -0,0 +1,57 @@
+import os
+import faiss
+import numpy as np
+
+# ----------------------------------------------------------------
+# Compressed vector codes for the FAISS indexes
+# ----------------------------------------------------------------
+# none : full float32 vectors (2 KB per 512-d face)
+# sq8  : 8-bit scalar quantization, 1 byte per dimension (4x smaller)
+# pq   : product quantization, PQ_M bytes per vector (32x smaller at M=64);
+#        needs a codebook trained once on real embeddings
+#
+# Searches over compressed codes are approximate; callers re-rank the
+# shortlist with the full-precision vectors kept in MongoDB.
+
+QUANTIZATION_MODES = ("none", "sq8", "pq")
+
+# Embeddings are L2-normalized, so per-dimension values stay well inside
+# [-SQ8_RANGE, SQ8_RANGE]; a fixed range lets SQ8 work without training data.
+SQ8_RANGE = float(os.getenv("SQ8_RANGE", 0.5))
+PQ_M = int(os.getenv("PQ_M", 64))
+PQ_NBITS = 8
+
+
+def check_mode(mode):
+    mode = (mode or "none").lower()
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {mode} (expected one of {QUANTIZATION_MODES})")
+    return mode
+
+
+def train_fixed_range(index, dim, bound=SQ8_RANGE):
+    """Train a scalar quantizer on the fixed range [-bound, bound] per dimension."""
+    index.train(np.array([[-bound] * dim, [bound] * dim], dtype=np.float32))
+    return index
+
+
+def new_sq8_flat(dim):
+    index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    return train_fixed_range(index, dim)
+
+
+def new_sq8_hnsw(dim, m, ef_construction):
+    index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, m, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = ef_construction
+    return train_fixed_range(index, dim)
+
+
+def train_pq(vectors, dim, m=PQ_M):
+    """Train an empty PQ index on a sample of (normalized) embeddings."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    min_samples = 2 ** PQ_NBITS * 39  # faiss k-means needs ~39 points per centroid
+    if len(vectors) < min_samples:
+        raise ValueError(f"PQ training needs at least {min_samples} vectors, got {len(vectors)}")
+    index = faiss.IndexPQ(dim, m, PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+    index.train(vectors)
+    return index
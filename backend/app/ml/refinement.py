@@ -0,0 +1,113 @@
+import os
+from app.db.mongo import db
+from app.db.dashboard_summary import refresh_job_summaries
+from app.ml.video_probe import get_video_info
+
+# ----------------------------------------------------------------
+# Coarse-to-fine refinement of comparison hits
+# ----------------------------------------------------------------
+# process_video only looks at every 40th frame (or fewer, with motion
+# sampling). When /compare/ finds a hit, a refinement job is queued: a video
+# worker decodes the frames around it again at REFINE_INTERVAL, with its own
+# models, and appends their embeddings to the job, so a second comparison
+# pass sees the person at (near) full frame rate where it matters. Refined
+# windows are recorded on the job and not re-scanned.
+
+REFINE_WINDOW_SECONDS = float(os.getenv("REFINE_WINDOW_SECONDS", 2.0))  # seconds either side of a hit
+REFINE_INTERVAL = int(os.getenv("REFINE_INTERVAL", 4))                  # frames between refined samples
+REFINE_MAX_WINDOWS = int(os.getenv("REFINE_MAX_WINDOWS", 5))            # windows re-scanned per request
+
+def plan_windows(frames, half_width, frame_count=None):
+    """Merge [frame - half_width, frame + half_width + 1) around each hit into disjoint windows."""
+    windows = []
+    for frame in sorted(frames):
+        start = max(0, frame - half_width)
+        end = frame + half_width + 1
+        if frame_count:
+            end = min(end, frame_count)
+        if windows and start <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], end)
+        else:
+            windows.append([start, end])
+    return [tuple(w) for w in windows]
+
+
+def _already_refined(job, start, end, interval):
+    return any(
+        w["start"] <= start and end <= w["end"] and w["interval"] <= interval
+        for w in job.get("refined_windows") or []
+    )
+
+
+def refine_matches(pipeline, matches, window_seconds=None, interval=None, max_windows=None):
+    """
+    Densely re-scan the video around each match (best matches first, at most
+    `max_windows` windows) with `pipeline` and append the new embeddings to
+    their jobs.
+    Returns one summary dict per window scanned.
+    """
+    window_seconds = REFINE_WINDOW_SECONDS if window_seconds is None else window_seconds
+    interval = interval or REFINE_INTERVAL
+    max_windows = max_windows or REFINE_MAX_WINDOWS
+
+    # Hit frames per job, keeping the order of the (best-first) matches
+    hits = {}
+    for match in matches:
+        hits.setdefault(match["job_id"], []).append(int(match["frame_number"]))
+
+    summary = []
+    for job_id, frames in hits.items():
+        if len(summary) >= max_windows:
+            break
+        job = db.video_jobs.find_one(
+            {"job_id": job_id, "status": "completed"},
+            {"video_path": 1, "persons_folder": 1, "refined_windows": 1},
+        )
+        if not job or not job.get("persons_folder") or not os.path.exists(job.get("video_path", "")):
+            print(f"⚠️ Cannot refine job {job_id}: job, output folder or video missing")
+            continue
+
+        video_info = get_video_info(job_id) or {}
+        fps = float(video_info.get("fps") or 30.0)
+        half_width = max(1, int(round(window_seconds * fps)))
+
+        for start, end in plan_windows(frames, half_width, video_info.get("frame_count")):
+            if len(summary) >= max_windows:
+                break
+            if _already_refined(job, start, end, interval):
+                continue
+            summary.append(_refine_window(pipeline, job, job_id, start, end, interval))
+
+    return summary
+
+
+def _refine_window(pipeline, job, job_id, start, end, interval):
+    # Frames that already have stored embeddings are not processed again
+    stored = db.embeddings.distinct("frame_number", {"job_id": job_id, "frame_number": {"$gte": start, "$lt": end}})
+
+    result = pipeline.refine_window(
+        job["video_path"], job_id, job["persons_folder"], start, end, interval, skip_frames=stored,
+    )
+
+    window = {"start": start, "end": end, "interval": interval}
+    new_frames = [entry["frame"] for entry in result["detections"] for _ in entry["detections"]]
+    update = {"$push": {"refined_windows": window}}
+    if result["persons_saved"]:
+        update["$inc"] = {"persons_saved": result["persons_saved"], "frames_saved": result["frames_saved"]}
+        update["$push"].update(
+            detections={"$each": result["detections"], "$sort": {"frame": 1}},
+            detection_frames={"$each": new_frames, "$sort": 1},
+        )
+    db.video_jobs.update_one({"job_id": job_id}, update)
+    if result["persons_saved"]:
+        refresh_job_summaries(job_id)
+    job.setdefault("refined_windows", []).append(window)
+
+    return {
+        "job_id": job_id,
+        "start_frame": start,
+        "end_frame": end,
+        "interval": interval,
+        "frames_saved": result["frames_saved"],
+        "persons_saved": result["persons_saved"],
+    }
@@ -0,0 +1,139 @@
+import heapq
+import itertools
+import numpy as np
+from app.db.embedding_store import decode_embedding_matrix
+
+
+class ScoringEngine:
+    """
+    Vectorized scorer for reference-vs-video comparisons.
+
+    Video embedding documents are fed in chunks; each chunk is turned into
+    NumPy matrices and scored (embedding cosine + metadata similarity) with
+    matrix operations. Only the best `top_k` matches above `final_threshold`
+    are kept, in a bounded min-heap, so memory does not grow with the number
+    of documents scanned.
+    """
+
+    def __init__(self, ref_emb, ref_meta, emb_weight=0.8, meta_weight=0.2,
+                 final_threshold=0.35, top_k=20, chunk_size=4096):
+        ref_emb = np.asarray(ref_emb, dtype=np.float32).reshape(-1)
+        ref_norm = np.linalg.norm(ref_emb)
+        self.ref_unit = ref_emb / ref_norm if ref_norm > 0 else ref_emb
+        self.ref_gender = str(ref_meta.get("gender", ""))
+        self.ref_age = ref_meta.get("age")
+
+        ref_color = ref_meta.get("color")
+        if ref_color and len(ref_color) == 3:
+            ref_color = np.asarray(ref_color, dtype=np.float32)
+            color_norm = np.linalg.norm(ref_color)
+            self.ref_color_unit = ref_color / color_norm if color_norm > 0 else None
+        else:
+            self.ref_color_unit = None
+
+        self.emb_weight = emb_weight
+        self.meta_weight = meta_weight
+        self.final_threshold = final_threshold
+        self.top_k = top_k
+        self.chunk_size = chunk_size
+
+        self.scanned = 0
+        self.matched = 0
+        self._heap = []  # (final_score, seq, doc, emb_sim, meta_sim)
+        self._seq = itertools.count()
+
+    # -------------------------------------------------------------------------
+    # Matrix builders
+    # -------------------------------------------------------------------------
+    def _embedding_scores(self, docs):
+        mat = decode_embedding_matrix(docs)
+        norms = np.linalg.norm(mat, axis=1)
+        norms[norms == 0] = 1.0
+        return (mat @ self.ref_unit) / norms
+
+    def _metadata_scores(self, docs):
+        n = len(docs)
+
+        # Gender match (1 if same, 0 otherwise)
+        genders = np.array([str(d.get("gender", "")) for d in docs])
+        gender_score = (genders == self.ref_gender).astype(np.float32)
+
+        # Age similarity (closeness within 10 years)
+        if self.ref_age is not None:
+            ages = np.array([float(d["age"]) if d.get("age") else np.nan for d in docs], dtype=np.float32)
+            age_diff = np.abs(ages - self.ref_age)
+            age_score = np.where(age_diff <= 10, np.maximum(0.0, 1 - age_diff / 10), 0.0)
+            age_score = np.nan_to_num(age_score, nan=0.0)
+        else:
+            age_score = np.zeros(n, dtype=np.float32)
+
+        # Color similarity (cosine on RGB, scaled as in the original scorer)
+        color_score = np.zeros(n, dtype=np.float32)
+        if self.ref_color_unit is not None:
+            colors = np.zeros((n, 3), dtype=np.float32)
+            valid = np.zeros(n, dtype=bool)
+            for i, d in enumerate(docs):
+                c = d.get("color")
+                if c and len(c) == 3:
+                    colors[i] = c
+                    valid[i] = True
+            norms = np.linalg.norm(colors, axis=1)
+            valid &= norms > 0
+            cos = np.zeros(n, dtype=np.float32)
+            cos[valid] = (colors[valid] @ self.ref_color_unit) / norms[valid]
+            color_score = np.clip(cos / 255, 0, 1)
+
+        # Weighted combination of metadata attributes
+        return (0.4 * gender_score) + (0.3 * age_score) + (0.3 * color_score)
+
+    # -------------------------------------------------------------------------
+    # Scoring
+    # -------------------------------------------------------------------------
+    def score_chunk(self, docs, emb_sim=None):
+        """
+        Score one chunk of video embedding docs and update the top-k heap.
+        emb_sim: optional precomputed embedding similarities (e.g. approximate
+        ANN scores), in which case the docs need no embedding field.
+        """
+        self.scanned += len(docs)
+        if not docs or self.top_k <= 0:
+            return
+
+        if emb_sim is None:
+            emb_sim = self._embedding_scores(docs)
+        else:
+            emb_sim = np.asarray(emb_sim, dtype=np.float32)
+        meta_sim = self._metadata_scores(docs)
+        final = (self.emb_weight * emb_sim) + (self.meta_weight * meta_sim)
+
+        candidates = np.flatnonzero(final >= self.final_threshold)
+        self.matched += len(candidates)
+        if len(candidates) == 0:
+            return
+
+        # Only the chunk's own top-k can enter the global top-k
+        if len(candidates) > self.top_k:
+            best = np.argpartition(-final[candidates], self.top_k - 1)[:self.top_k]
+            candidates = candidates[best]
+
+        for i in candidates:
+            entry = (float(final[i]), next(self._seq), docs[i], float(emb_sim[i]), float(meta_sim[i]))
+            if len(self._heap) < self.top_k:
+                heapq.heappush(self._heap, entry)
+            elif entry[0] > self._heap[0][0]:
+                heapq.heapreplace(self._heap, entry)
+
+    def score_cursor(self, cursor):
+        """Stream a Mongo cursor (or any iterable of docs) through the scorer in chunks."""
+        chunk = []
+        for doc in cursor:
+            chunk.append(doc)
+            if len(chunk) >= self.chunk_size:
+                self.score_chunk(chunk)
+                chunk = []
+        self.score_chunk(chunk)
+
+    def results(self):
+        """Top matches as (doc, emb_similarity, meta_similarity, final_score), best first."""
+        ordered = sorted(self._heap, key=lambda e: (e[0], -e[1]), reverse=True)
+        return [(doc, emb_sim, meta_sim, score) for score, _, doc, emb_sim, meta_sim in ordered]
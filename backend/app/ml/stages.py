@@ -0,0 +1,117 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# ----------------------------------------------------------------
+# Stages of process_video
+# ----------------------------------------------------------------
+# decoder thread  --(bounded queue of frame batches)-->  inference (caller)
+# inference       --(bounded pending writes)-->          writer pool
+#
+# Each bound blocks the faster side when the slower one falls behind, so
+# memory stays flat however long the video is.
+
+DECODE_QUEUE_BATCHES = int(os.getenv("DECODE_QUEUE_BATCHES", 2))  # decoded batches waiting for inference
+WRITER_THREADS = int(os.getenv("WRITER_THREADS", 4))             # JPEG encode / disk writes
+MAX_PENDING_WRITES = int(os.getenv("MAX_PENDING_WRITES", 256))   # queued writes before inference blocks
+
+_STOP = object()  # decoder queue sentinel
+
+
+class FrameDecoder(threading.Thread):
+    """
+    Pulls frames from `frames` (a FrameSource.sample() generator, possibly
+    filtered by a sampler) on its own thread and hands them over in batches.
+    Iterate it to receive the batches; stop() ends it early (e.g. when
+    inference fails) without leaving it blocked on the queue.
+    """
+
+    def __init__(self, frames, batch_size=8, max_batches=DECODE_QUEUE_BATCHES):
+        super().__init__(daemon=True)
+        self.frames = frames
+        self.batch_size = batch_size
+        self.batches = queue.Queue(maxsize=max_batches)
+        self.error = None
+        self._stopped = threading.Event()
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self.batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(self):
+        try:
+            batch = []
+            for sampled in self.frames:
+                batch.append(sampled)
+                if len(batch) >= self.batch_size:
+                    if not self._put(batch):
+                        return
+                    batch = []
+            if batch:
+                self._put(batch)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(_STOP)
+
+    def __iter__(self):
+        while True:
+            batch = self.batches.get()
+            if batch is _STOP:
+                break
+            yield batch
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class OutputWriter:
+    """
+    Runs disk and database writes off the inference thread.
+    submit() goes to a thread pool (independent file writes); submit_serial()
+    goes to a single thread, in order (Mongo writers that are not thread-safe,
+    index registration after the files it names). Both block once
+    `max_pending` writes are queued. The first failure is raised by the next
+    submit() and by close().
+    """
+
+    def __init__(self, threads=WRITER_THREADS, max_pending=MAX_PENDING_WRITES):
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="writer")
+        self._serial = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer-db")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.error = None
+
+    def _done(self, future):
+        if future.exception() is not None and self.error is None:
+            self.error = future.exception()
+        self._slots.release()
+
+    def _submit(self, executor, fn, *args):
+        if self.error is not None:
+            raise self.error
+        self._slots.acquire()
+        future = executor.submit(fn, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    def submit(self, fn, *args):
+        return self._submit(self._pool, fn, *args)
+
+    def submit_serial(self, fn, *args):
+        return self._submit(self._serial, fn, *args)
+
+    def close(self):
+        """Wait for every queued write, then raise the first failure (if any)."""
+        self._pool.shutdown(wait=True)
+        self._serial.shutdown(wait=True)
+        if self.error is not None:
+            raise self.error
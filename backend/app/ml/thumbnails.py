@@ -0,0 +1,193 @@
+import os
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from app.ml.frame_source import FrameSource
+
+# ----------------------------------------------------------------
+# Video frame thumbnails
+# ----------------------------------------------------------------
+# {THUMBNAIL_DIR}/{job_id}/frame_{n}.jpg   written by process_video for every
+#                                          frame with detections (kept)
+# {THUMBNAIL_DIR}/_cache/...               frames / sprites decoded on demand,
+#                                          an LRU bounded to THUMBNAIL_CACHE_MB
+
+THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", "app/data/thumbnails")
+THUMBNAIL_WIDTH = int(os.getenv("THUMBNAIL_WIDTH", 320))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", 80))
+THUMBNAIL_CACHE_MB = float(os.getenv("THUMBNAIL_CACHE_MB", 512))
+
+
+def encode_thumbnail(frame, width=THUMBNAIL_WIDTH):
+    """Downscale a BGR frame to `width` (keeping aspect) and JPEG-encode it."""
+    h, w = frame.shape[:2]
+    if width and w > width:
+        frame = cv2.resize(frame, (width, max(1, int(h * width / w))), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+    if not ok:
+        raise ValueError("Could not encode thumbnail")
+    return buffer.tobytes()
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def detection_thumbnail_path(job_id, frame_number):
+    return os.path.join(THUMBNAIL_DIR, job_id, f"frame_{frame_number}.jpg")
+
+
+def save_detection_thumbnail(job_id, frame_number, frame):
+    """Called by the pipeline for each frame it keeps."""
+    _write_atomic(detection_thumbnail_path(job_id, frame_number), encode_thumbnail(frame))
+
+
+class DiskLRUCache:
+    """
+    Size-bounded on-disk cache of encoded images. Recency is kept in memory
+    (seeded from file mtimes at startup) and the oldest files are deleted
+    once the directory grows past `max_bytes`.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # relative key -> size
+        self._total = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                if ".tmp." in name:
+                    os.remove(path)
+                    continue
+                st = os.stat(path)
+                files.append((st.st_mtime, os.path.relpath(path, self.cache_dir), st.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total += size
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _evict(self):
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key):
+        """Path of a cached entry (marked as recently used), or None."""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            path = self._path(key)
+            if not os.path.exists(path):
+                self._total -= self._entries.pop(key)
+                return None
+            self._entries.move_to_end(key)
+        os.utime(path)  # keep mtime order meaningful across restarts
+        return path
+
+    def _add(self, key, size):
+        with self._lock:
+            self._total -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._total += size
+            self._evict()
+
+    def put(self, key, data):
+        path = self._path(key)
+        _write_atomic(path, data)
+        self._add(key, len(data))
+        return path
+
+    def put_file(self, key, src_path):
+        """Move an already written file (on the same filesystem) into the cache."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(src_path, path)
+        self._add(key, os.path.getsize(path))
+        return path
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self._total, "max_bytes": self.max_bytes}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DiskLRUCache(os.path.join(THUMBNAIL_DIR, "_cache"), int(THUMBNAIL_CACHE_MB * 1024 * 1024))
+        return _cache
+
+
+def frame_thumbnail(job_id, video_path, frame_number):
+    """
+    Path to a JPEG thumbnail of one frame: the pipeline's precomputed file,
+    then the LRU cache, and only then a decode (whose result is cached).
+    Returns None if the frame cannot be read.
+    """
+    path = detection_thumbnail_path(job_id, frame_number)
+    if os.path.exists(path):
+        return path
+
+    cache = get_thumbnail_cache()
+    key = os.path.join(job_id, f"frame_{frame_number}.jpg")
+    path = cache.get(key)
+    if path:
+        return path
+
+    with FrameSource(str(video_path), seek_threshold=1) as source:
+        sampled = next(source.sample(1, start=frame_number, end=frame_number + 1), None)
+    if sampled is None:
+        return None
+    return cache.put(key, encode_thumbnail(sampled.image))
+
+
+def build_sprite(video_path, count=20, columns=5, tile_width=160, start=0, end=None):
+    """
+    Decode `count` evenly spaced frames of [start, end) in one sequential
+    pass and tile them into a single JPEG sheet.
+    Returns (jpeg_bytes, [(frame_number, timestamp), ...], (tile_w, tile_h)).
+    """
+    with FrameSource(str(video_path)) as source:
+        end = min(end, source.frame_count) if end is not None else source.frame_count
+        interval = max(1, (end - start) // max(1, count))
+        aspect = source.height / source.width if source.width else 9 / 16
+        tile_height = max(1, int(tile_width * aspect))
+
+        tiles, frames = [], []
+        for sampled in source.sample(interval, start=start, end=end):
+            tiles.append(cv2.resize(sampled.image, (tile_width, tile_height), interpolation=cv2.INTER_AREA))
+            frames.append((sampled.index, round(float(sampled.timestamp), 3)))
+            if len(tiles) >= count:
+                break
+
+    if not tiles:
+        return None, [], (tile_width, tile_height)
+
+    rows = -(-len(tiles) // columns)
+    sheet = np.zeros((rows * tile_height, columns * tile_width, 3), dtype=np.uint8)
+    for i, tile in enumerate(tiles):
+        r, c = divmod(i, columns)
+        sheet[r * tile_height:(r + 1) * tile_height, c * tile_width:(c + 1) * tile_width] = tile
+    return encode_thumbnail(sheet, width=None), frames, (tile_width, tile_height)
@@ -0,0 +1,162 @@
+import os
+import heapq
+import itertools
+from collections import namedtuple
+import numpy as np
+
+# ----------------------------------------------------------------
+# Track-level deduplication
+# ----------------------------------------------------------------
+# Someone standing in view is detected on every sampled frame. Instead of
+# storing a crop + embedding per detection, process_video links detections
+# across sampled frames into tracks (box overlap and/or face similarity)
+# and, when a track ends, stores only its TRACK_KEEP best observations,
+# each tagged with the track's first/last frame.
+
+TRACKING = os.getenv("TRACKING", "on")                           # on | off
+TRACK_KEEP = int(os.getenv("TRACK_KEEP", 2))                     # observations stored per track
+TRACK_IOU = float(os.getenv("TRACK_IOU", 0.3))                   # box overlap that links detections
+TRACK_SIMILARITY = float(os.getenv("TRACK_SIMILARITY", 0.5))     # face similarity that links detections
+TRACK_MIN_SIMILARITY = float(os.getenv("TRACK_MIN_SIMILARITY", 0.2))  # below this, never the same person
+TRACK_MAX_GAP = int(os.getenv("TRACK_MAX_GAP", 150))             # frames unseen before a track is closed
+
+# One person detection with its face embedding, as produced by the pipeline.
+# `image` is the full frame (kept so a representative's frame can be saved).
+Observation = namedtuple("Observation", [
+    "frame", "pts", "image", "box", "confidence", "crop", "embedding", "face", "quality",
+])
+
+
+def observation_quality(confidence, crop):
+    """Rank observations of one track: confident, large face crops first."""
+    h, w = crop.shape[:2]
+    return float(confidence) * float(np.sqrt(max(h, 0) * max(w, 0)))
+
+
+def box_iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    if inter == 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / float(area_a + area_b - inter)
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class Track:
+    def __init__(self, track_id, observation, keep):
+        self.track_id = track_id
+        self.first_frame = self.last_frame = observation.frame
+        self.first_pts = self.last_pts = observation.pts
+        self.box = observation.box
+        self.hits = 0
+        self._sum = np.zeros_like(_unit(observation.embedding))
+        self._keep = keep
+        self._best = []  # min-heap of (quality, seq, observation)
+        self._seq = itertools.count()
+        self.add(observation)
+
+    @property
+    def embedding(self):
+        """Mean face direction of the track (unit vector)."""
+        return _unit(self._sum)
+
+    def add(self, observation):
+        self.last_frame, self.last_pts = observation.frame, observation.pts
+        self.box = observation.box
+        self.hits += 1
+        self._sum += _unit(observation.embedding)
+        entry = (observation.quality, next(self._seq), observation)
+        if len(self._best) < self._keep:
+            heapq.heappush(self._best, entry)
+        elif entry[0] > self._best[0][0]:
+            heapq.heapreplace(self._best, entry)
+
+    def representatives(self):
+        """The kept observations, in frame order."""
+        return sorted((obs for _, _, obs in self._best), key=lambda obs: obs.frame)
+
+    def span(self):
+        return {
+            "track_id": self.track_id,
+            "track_first_frame": int(self.first_frame),
+            "track_last_frame": int(self.last_frame),
+            "track_start_pts": round(float(self.first_pts), 3),
+            "track_end_pts": round(float(self.last_pts), 3),
+            "track_hits": self.hits,
+        }
+
+
+class FaceTracker:
+    """
+    Greedy IoU + embedding association across sampled frames, fed in frame
+    order. update() returns the tracks that just closed; close_all() returns
+    the rest at the end of the video. `stats` counts observations and tracks.
+    """
+
+    def __init__(self, id_prefix="", keep=TRACK_KEEP, iou_threshold=TRACK_IOU,
+                 similarity_threshold=TRACK_SIMILARITY, min_similarity=TRACK_MIN_SIMILARITY,
+                 max_gap=TRACK_MAX_GAP):
+        self.id_prefix = id_prefix
+        self.keep = keep
+        self.iou_threshold = iou_threshold
+        self.similarity_threshold = similarity_threshold
+        self.min_similarity = min_similarity
+        self.max_gap = max_gap
+        self.active = []
+        self._ids = itertools.count(1)
+        self.stats = {"observations": 0, "tracks": 0, "stored": 0}
+
+    def _close(self, tracks):
+        self.stats["stored"] += sum(len(t._best) for t in tracks)
+        return tracks
+
+    def update(self, frame, observations):
+        """Assign one frame's observations to tracks; returns the tracks closed by it."""
+        self.stats["observations"] += len(observations)
+
+        # Tracks unseen for too long can no longer be continued
+        closed = [t for t in self.active if frame - t.last_frame > self.max_gap]
+        self.active = [t for t in self.active if frame - t.last_frame <= self.max_gap]
+
+        # Score every (track, observation) pair that could be the same person
+        pairs = []
+        if self.active and observations:
+            track_embs = np.stack([t.embedding for t in self.active])
+            obs_embs = np.stack([_unit(o.embedding) for o in observations])
+            similarity = track_embs @ obs_embs.T
+            for i, track in enumerate(self.active):
+                for j, obs in enumerate(observations):
+                    sim = float(similarity[i, j])
+                    if sim < self.min_similarity:
+                        continue
+                    iou = box_iou(track.box, obs.box)
+                    if iou >= self.iou_threshold or sim >= self.similarity_threshold:
+                        pairs.append((sim + iou, i, j))
+
+        # Greedy: best pairs first, each track and observation used once
+        used_tracks, used_obs = set(), set()
+        for _, i, j in sorted(pairs, reverse=True):
+            if i in used_tracks or j in used_obs:
+                continue
+            self.active[i].add(observations[j])
+            used_tracks.add(i)
+            used_obs.add(j)
+
+        for j, obs in enumerate(observations):
+            if j not in used_obs:
+                self.active.append(Track(f"{self.id_prefix}t{next(self._ids)}", obs, self.keep))
+                self.stats["tracks"] += 1
+
+        return self._close(closed)
+
+    def close_all(self):
+        closed, self.active = self.active, []
+        return self._close(closed)
@@ -1,14 +1,66 @@
 import cv2
 import os
-from app.ml.detector import PersonDetector
+import queue
+import threading
+from app.ml.frame_source import FrameSource
+from app.ml.model_registry import get_detector
+
+_STOP = object()  # writer queue sentinel
+
+
+class _AnnotatedVideoWriter(threading.Thread):
+    """
+    Draws boxes and encodes frames on its own thread, so detection does not
+    wait on the video encoder / disk. The bounded queue applies backpressure
+    if the writer falls behind.
+    """
+
+    def __init__(self, path, fps, size, max_pending=64):
+        super().__init__(daemon=True)
+        self.out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+        self.frames = queue.Queue(maxsize=max_pending)
+        self.error = None
+
+    def run(self):
+        try:
+            while True:
+                item = self.frames.get()
+                if item is _STOP:
+                    break
+                frame, detections = item
+                for det in detections:
+                    x1, y1, x2, y2 = det["box"]
+                    conf = det["confidence"]
+                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                    cv2.putText(frame, f"{conf:.2f}", (x1, y1-10),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+                self.out.write(frame)
+        except Exception as e:
+            self.error = e
+            # Keep draining so the producer never blocks on a dead writer
+            while self.frames.get() is not _STOP:
+                pass
+        finally:
+            self.out.release()
+
+    def write(self, frame, detections):
+        self.frames.put((frame, detections))
+
+    def close(self):
+        self.frames.put(_STOP)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
 
 class VideoDetector:
-    def __init__(self, model_path="yolov8n.pt", output_dir="app/data/outputs"):
+    def __init__(self, model_path="yolov8n.pt", output_dir="app/data/outputs", batch_size=None):
         """
         Initialize video detector with YOLOv8 model.
         """
-        self.detector = PersonDetector(model_path)
+        self.detector = get_detector(model_path)
         self.output_dir = output_dir
+        self.batch_size = batch_size or int(os.getenv("YOLO_BATCH_SIZE", 8))  # frames per YOLO call
         os.makedirs(self.output_dir, exist_ok=True)
 
     def detect_video(self, video_path, save_video=False):
@@ -16,57 +68,41 @@ class VideoDetector:
         Detect persons in each frame of the video.
         Returns list of detections per frame.
         If save_video=True, saves output video with bounding boxes.
+        Frames go straight from the decoder to YOLO in batches (no temp
+        files); the annotated video is written on a separate thread.
         """
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            raise Exception(f"Cannot open video {video_path}")
-
-        frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
-
-        if save_video:
-            output_video_path = os.path.join(self.output_dir, "output_video.mp4")
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out = cv2.VideoWriter(output_video_path, fourcc, fps, (frame_width, frame_height))
-        else:
-            output_video_path = None
-
-        frame_count = 0
         all_detections = []
+        writer = None
+        output_video_path = None
 
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            # Save current frame temporarily
-            temp_frame_path = os.path.join(self.output_dir, f"frame_{frame_count}.jpg")
-            cv2.imwrite(temp_frame_path, frame)
+        with FrameSource(video_path) as source:
+            if save_video:
+                output_video_path = os.path.join(self.output_dir, "output_video.mp4")
+                fps = int(source.fps) or 30
+                writer = _AnnotatedVideoWriter(output_video_path, fps, (source.width, source.height))
+                writer.start()
 
-            # Detect persons
-            detections = self.detector.detect_persons(temp_frame_path)
+            try:
+                batch = []
+                for sampled in source.sample(1):
+                    batch.append(sampled)
+                    if len(batch) >= self.batch_size:
+                        self._detect_batch(batch, all_detections, writer)
+                        batch = []
+                if batch:
+                    self._detect_batch(batch, all_detections, writer)
+            finally:
+                if writer is not None:
+                    writer.close()
 
-            # Draw boxes if saving video
-            if save_video:
-                for det in detections:
-                    x1, y1, x2, y2 = det["box"]
-                    conf = det["confidence"]
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                    cv2.putText(frame, f"{conf:.2f}", (x1, y1-10),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-                out.write(frame)
+        return all_detections, output_video_path
 
+    def _detect_batch(self, batch, all_detections, writer):
+        results = self.detector.detect_persons_batch([sampled.image for sampled in batch])
+        for sampled, detections in zip(batch, results):
+            if writer is not None:
+                writer.write(sampled.image, detections)
             all_detections.append({
-                "frame": frame_count,
+                "frame": sampled.index,
                 "detections": detections
             })
-
-            frame_count += 1
-            os.remove(temp_frame_path)  # remove temp frame
-
-        cap.release()
-        if save_video:
-            out.release()
-
-        return all_detections, output_video_path
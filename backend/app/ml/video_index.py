@@ -0,0 +1,282 @@
+import os
+import glob
+import heapq
+import pickle
+import threading
+from collections import OrderedDict
+import faiss
+import numpy as np
+from app.db.embedding_store import decode_embedding
+from app.ml.quantization import check_mode, new_sq8_hnsw, train_pq
+
+VIDEO_INDEX_DIR = os.getenv("VIDEO_INDEX_DIR", "backend/data/faiss/video")
+VIDEO_INDEX_QUANTIZATION = check_mode(os.getenv("VIDEO_INDEX_QUANTIZATION", "none"))  # none | sq8 | pq
+PQ_TEMPLATE_NAME = "_pq.template"
+VIDEO_INDEX_CACHE_SHARDS = int(os.getenv("VIDEO_INDEX_CACHE_SHARDS", 64))  # shards kept loaded per process
+
+# HNSW graph parameters
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(vectors / norms)
+
+
+def _atomic_pickle(obj, path):
+    """Write a pickle next to `path` and swap it in, so readers never see a partial file."""
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _new_index(dim, quantization, pq_template=None):
+    """Empty shard index for the configured code type."""
+    if quantization == "pq":
+        if pq_template is not None:
+            return faiss.clone_index(pq_template)
+        print("⚠️ No trained PQ codebook yet (python -m app.ml.video_index --train-pq), using sq8")
+        quantization = "sq8"
+    if quantization == "sq8":
+        return new_sq8_hnsw(dim, HNSW_M, HNSW_EF_CONSTRUCTION)
+    index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    return index
+
+
+class VideoIndexShard:
+    """
+    ANN index over the face embeddings of a single video job: HNSW over full
+    vectors or SQ8 codes, or a PQ code table (see app.ml.quantization).
+    """
+
+    def __init__(self, job_id, dim=512, index=None, doc_ids=None, quantization="none", pq_template=None):
+        self.job_id = job_id
+        self.dim = dim
+        if index is None:
+            index = _new_index(dim, quantization, pq_template)
+        self.index = index
+        self.doc_ids = doc_ids or []  # faiss position -> embeddings doc _id (str)
+        self.dirty = False
+        self.mtime = None
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    def add(self, vectors, doc_ids):
+        vectors = _normalize(vectors)
+        if len(vectors) != len(doc_ids):
+            raise ValueError("vectors and doc_ids must have the same length")
+        self.index.add(vectors)
+        self.doc_ids.extend(str(d) for d in doc_ids)
+        self.dirty = True
+
+    def search(self, query, k, ef_search=None):
+        if self.index.ntotal == 0:
+            return []
+        if hasattr(self.index, "hnsw"):
+            self.index.hnsw.efSearch = max(ef_search or HNSW_EF_SEARCH, k)
+        D, I = self.index.search(_normalize(query), min(k, self.index.ntotal))
+        return [(self.doc_ids[i], float(d)) for d, i in zip(D[0], I[0]) if i != -1]
+
+    def save(self, path):
+        _atomic_pickle({
+            "job_id": self.job_id,
+            "dim": self.dim,
+            "index": faiss.serialize_index(self.index),
+            "doc_ids": self.doc_ids,
+        }, path)
+        self.dirty = False
+        self.mtime = os.path.getmtime(path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        shard = cls(data["job_id"], dim=data["dim"],
+                    index=faiss.deserialize_index(data["index"]),
+                    doc_ids=data["doc_ids"])
+        shard.mtime = os.path.getmtime(path)
+        return shard
+
+
+class VideoEmbeddingIndex:
+    """
+    Approximate nearest-neighbour index over video face embeddings.
+
+    One shard per job_id is persisted under VIDEO_INDEX_DIR; the global
+    view searches every shard and merges the results. Shards written by the
+    worker processes are picked up by the API process when their file changes.
+    With quantization "sq8" or "pq" the shards hold compressed codes only;
+    scores are approximate and meant to be re-ranked against MongoDB.
+    """
+
+    def __init__(self, dim=512, index_dir=VIDEO_INDEX_DIR, quantization=VIDEO_INDEX_QUANTIZATION,
+                 max_cached=VIDEO_INDEX_CACHE_SHARDS):
+        self.dim = dim
+        self.index_dir = index_dir
+        self.quantization = check_mode(quantization)
+        self.max_cached = max_cached
+        os.makedirs(index_dir, exist_ok=True)
+        self._shards = OrderedDict()  # job_id -> shard, least recently used first
+        self._lock = threading.Lock()
+
+        self.pq_template = None
+        template_path = os.path.join(index_dir, PQ_TEMPLATE_NAME)
+        if self.quantization == "pq" and os.path.exists(template_path):
+            self.pq_template = faiss.read_index(template_path)
+
+    def _new_shard(self, job_id):
+        return VideoIndexShard(job_id, dim=self.dim, quantization=self.quantization, pq_template=self.pq_template)
+
+    def _shard_path(self, job_id):
+        return os.path.join(self.index_dir, f"{job_id}.index")
+
+    def _get_shard(self, job_id, create=False):
+        """
+        Return the shard for job_id, reloading it if another process rewrote
+        the file and forgetting it if another process deleted it.
+        """
+        path = self._shard_path(job_id)
+        with self._lock:
+            shard = self._shards.get(job_id)
+            if os.path.exists(path):
+                mtime = os.path.getmtime(path)
+                if shard is None or (not shard.dirty and shard.mtime != mtime):
+                    shard = VideoIndexShard.load(path)
+                    self._shards[job_id] = shard
+            elif shard is not None and not shard.dirty:
+                # Dropped elsewhere (e.g. a retried job): its doc_ids are gone too
+                del self._shards[job_id]
+                shard = None
+            if shard is None and create:
+                shard = self._new_shard(job_id)
+                self._shards[job_id] = shard
+            if shard is not None:
+                self._shards.move_to_end(job_id)
+                self._evict()
+            return shard
+
+    def _evict(self):
+        """Unload least recently used shards beyond max_cached; unsaved ones are kept."""
+        excess = len(self._shards) - self.max_cached
+        for job_id in [jid for jid, shard in self._shards.items() if not shard.dirty][:max(excess, 0)]:
+            del self._shards[job_id]
+
+    # -------------------------------------------------------------------------
+    # Writes
+    # -------------------------------------------------------------------------
+    def add(self, job_id, vectors, doc_ids):
+        """Append embeddings (and their Mongo _ids) to the job's shard."""
+        if len(doc_ids) == 0:
+            return
+        shard = self._get_shard(job_id, create=True)
+        with self._lock:
+            shard.add(vectors, doc_ids)
+
+    def save(self, job_id):
+        shard = self._shards.get(job_id)
+        if shard is not None and shard.dirty:
+            with self._lock:
+                shard.save(self._shard_path(job_id))
+
+    def drop_job(self, job_id):
+        """Forget a job's shard, in memory and on disk (e.g. before a retried job starts over)."""
+        with self._lock:
+            self._shards.pop(job_id, None)
+            try:
+                os.remove(self._shard_path(job_id))
+            except FileNotFoundError:
+                pass
+
+    def rebuild_job(self, job_id, collection):
+        """Rebuild one job's shard from the embeddings collection."""
+        shard = self._new_shard(job_id)
+        vectors, doc_ids = [], []
+        for doc in collection.find({"job_id": job_id}, {"embedding": 1, "embedding_dtype": 1}):
+            vectors.append(decode_embedding(doc))
+            doc_ids.append(doc["_id"])
+            if len(vectors) >= 4096:
+                shard.add(vectors, doc_ids)
+                vectors, doc_ids = [], []
+        if vectors:
+            shard.add(vectors, doc_ids)
+        shard.save(self._shard_path(job_id))
+        with self._lock:
+            self._shards[job_id] = shard
+            self._evict()
+        return shard.ntotal
+
+    def train_pq(self, collection, sample_size=65536):
+        """Train the shared PQ codebook on a random sample of stored embeddings."""
+        sample = [
+            decode_embedding(doc)
+            for doc in collection.aggregate([
+                {"$sample": {"size": sample_size}},
+                {"$project": {"embedding": 1, "embedding_dtype": 1}},
+            ])
+        ]
+        template = train_pq(_normalize(sample), self.dim)
+        faiss.write_index(template, os.path.join(self.index_dir, PQ_TEMPLATE_NAME))
+        self.pq_template = template
+        return len(sample)
+
+    # -------------------------------------------------------------------------
+    # Reads
+    # -------------------------------------------------------------------------
+    def has_job(self, job_id):
+        """Whether a saved shard covers the job (the file is what every process shares)."""
+        return os.path.exists(self._shard_path(job_id))
+
+    def job_ids(self):
+        on_disk = {
+            os.path.basename(p)[:-len(".index")]
+            for p in glob.glob(os.path.join(self.index_dir, "*.index"))
+        }
+        with self._lock:
+            unsaved = {jid for jid, shard in self._shards.items() if shard.dirty}
+        return sorted(on_disk | unsaved)
+
+    def search(self, query, k=200, job_id=None, ef_search=None):
+        """
+        Return up to k (doc_id, similarity) candidates, best first.
+        job_id=None searches the global view (every shard).
+        """
+        job_ids = [job_id] if job_id else self.job_ids()
+        candidates = []
+        for jid in job_ids:
+            shard = self._get_shard(jid)
+            if shard is None:
+                continue
+            candidates.extend(shard.search(query, k, ef_search=ef_search))
+        return heapq.nlargest(k, candidates, key=lambda c: c[1])
+
+
+if __name__ == "__main__":
+    # python -m app.ml.video_index [--train-pq] [--quantization sq8]
+    import argparse
+    from app.db.mongo import db
+
+    parser = argparse.ArgumentParser(description="Rebuild the video ANN shards from MongoDB")
+    parser.add_argument("--quantization", default=VIDEO_INDEX_QUANTIZATION, choices=["none", "sq8", "pq"])
+    parser.add_argument("--train-pq", action="store_true", help="(re)train the PQ codebook before rebuilding")
+    args = parser.parse_args()
+
+    video_index = VideoEmbeddingIndex(quantization=args.quantization)
+    if args.train_pq:
+        count = video_index.train_pq(db.embeddings)
+        print(f"✅ Trained PQ codebook on {count} embeddings")
+
+    for jid in db.embeddings.distinct("job_id"):
+        count = video_index.rebuild_job(jid, db.embeddings)
+        print(f"✅ Rebuilt shard {jid}: {count} embeddings")
@@ -0,0 +1,124 @@
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import cv2
+from app.db.mongo import db
+
+# Videos are stored in subdirectories: app/data/uploads/videos/{job_id}/video.mp4
+VIDEO_BASE_DIR = Path("app/data/uploads/videos")
+VIDEO_EXTENSIONS = {".mp4", ".avi", ".mov", ".mkv"}
+CACHE_SIZE = int(os.getenv("VIDEO_INFO_CACHE_SIZE", 1024))
+
+
+def find_video_file(job_id):
+    """First video file in the job's upload folder, or None."""
+    job_dir = VIDEO_BASE_DIR / job_id
+    if not job_dir.exists():
+        return None
+    for file in job_dir.iterdir():
+        if file.is_file() and file.suffix.lower() in VIDEO_EXTENSIONS:
+            return file
+    return None
+
+
+def _file_signature(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime
+
+
+def probe_video(video_path):
+    """Open the container once and read FPS, frame count and resolution."""
+    video_path = Path(video_path)
+    cap = cv2.VideoCapture(str(video_path))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+
+    # Handle bad FPS readings (some videos return 0 or NaN)
+    if not fps or fps <= 1:
+        print(f"⚠️ Invalid FPS ({fps}) for {video_path.name}, defaulting to 30.0")
+        fps = 30.0
+
+    duration = frame_count / fps if fps > 0 else 0
+    size, mtime = _file_signature(video_path)
+    print(f"🎞️ Probed {video_path.name}: {frame_count} frames, {fps:.2f} fps, {duration:.2f}s total")
+
+    return {
+        "filename": video_path.name,
+        "video_path": str(video_path),
+        "fps": round(float(fps), 2),
+        "frame_count": frame_count,
+        "width": width,
+        "height": height,
+        "resolution": f"{width}x{height}",
+        "duration_seconds": round(float(duration), 2),
+        "file_size": size,
+        "file_mtime": mtime,
+    }
+
+
+class VideoInfoCache:
+    """
+    Bounded LRU of probed video metadata, keyed by job_id and backed by
+    `video_jobs.video_info`. An entry is only trusted while the file's size
+    and mtime still match; the container itself is only opened when the
+    file is new or has changed.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, info):
+        try:
+            return _file_signature(info["video_path"]) == (info.get("file_size"), info.get("file_mtime"))
+        except (OSError, KeyError):
+            return False
+
+    def _put(self, job_id, info):
+        with self._lock:
+            self._entries[job_id] = info
+            self._entries.move_to_end(job_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, job_id):
+        with self._lock:
+            self._entries.pop(job_id, None)
+
+    def get(self, job_id):
+        with self._lock:
+            info = self._entries.get(job_id)
+            if info is not None:
+                self._entries.move_to_end(job_id)
+        if info is not None and self._is_fresh(info):
+            return info
+
+        # Persisted probe from ingest
+        job_doc = db.video_jobs.find_one({"job_id": job_id}, {"video_info": 1})
+        info = job_doc.get("video_info") if job_doc else None
+        if info is not None and self._is_fresh(info):
+            self._put(job_id, info)
+            return info
+
+        # Missing or stale: probe once and persist
+        video_path = find_video_file(job_id)
+        if video_path is None:
+            self.invalidate(job_id)
+            return None
+        info = probe_video(video_path)
+        db.video_jobs.update_one({"job_id": job_id}, {"$set": {"video_info": info}})
+        self._put(job_id, info)
+        return info
+
+
+video_info_cache = VideoInfoCache()
+
+
+def get_video_info(job_id):
+    """Cached video metadata for a job, or None if the video is missing."""
+    return video_info_cache.get(job_id)
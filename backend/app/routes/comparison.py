@@ -1,8 +1,11 @@
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from app.ml.comparison import VideoComparison
+from app.ml.job_queue import enqueue_refinement, get_refinement, STATUS_COMPLETED, STATUS_QUEUED
 import json
+import uuid
 
 router = APIRouter()
 
@@ -10,6 +13,27 @@ class CompareRequest(BaseModel):
     reference_id: str
     job_id: Optional[str] = None
     top_k: int = 20
+    use_index: bool = True              # ANN candidate retrieval before exact re-scoring
+    ann_candidates: Optional[int] = None  # shortlist size taken from the index
+    ef_search: Optional[int] = None       # HNSW search depth (recall vs latency)
+    rerank: bool = True                   # exact re-rank of the shortlist with full vectors
+    refine: bool = False                  # queue a dense re-scan around hits; poll /compare/refinements/{id}
+    # Bounded so one request cannot ask for a dense re-decode of a whole video
+    refine_window_seconds: Optional[float] = Field(None, gt=0, le=30)  # seconds either side of a hit (REFINE_WINDOW_SECONDS)
+    refine_interval: Optional[int] = Field(None, ge=1)                 # frames between refined samples (REFINE_INTERVAL)
+
+def _comparator(params):
+    return VideoComparison(
+        final_threshold=0.35,
+        emb_weight=0.8,
+        meta_weight=0.2,
+        top_k=params["top_k"],
+        use_index=params["use_index"],
+        ann_candidates=params["ann_candidates"],
+        ef_search=params["ef_search"],
+        rerank=params["rerank"]
+    )
+
 
 @router.post("/")
 async def compare_reference_to_videos(req: CompareRequest):
@@ -17,6 +41,8 @@ async def compare_reference_to_videos(req: CompareRequest):
     Compare a reference person against video embeddings.
     If job_id is provided, search only that video. Otherwise search all videos.
     Returns top K matches sorted by similarity.
+    With refine=True, a dense re-scan around the hits is queued for the video
+    workers; poll refinement.status_url for the re-scored matches.
     """
     try:
         print(f"🔍 Comparison Request:")
@@ -24,18 +50,26 @@ async def compare_reference_to_videos(req: CompareRequest):
         print(f"   Job ID: {req.job_id}")
         print(f"   Top K: {req.top_k}")
         
-        comparator = VideoComparison(
-            final_threshold=0.35,
-            emb_weight=0.8,
-            meta_weight=0.2,
-            top_k=req.top_k
-        )
+        comparator = _comparator(req.model_dump())
         
-        matches = comparator.compare_reference(
+        # Mongo re-rank and a possible exact scan: keep them off the event loop
+        matches = await run_in_threadpool(
+            comparator.compare_reference,
             reference_id=req.reference_id,
             job_id=req.job_id
         )
         
+        # Coarse-to-fine: the re-scan runs in a video worker, with its own models
+        refinement = None
+        if req.refine and matches:
+            refine_id = str(uuid.uuid4())
+            await run_in_threadpool(enqueue_refinement, refine_id, req.model_dump(), matches)
+            refinement = {
+                "refine_id": refine_id,
+                "status": STATUS_QUEUED,
+                "status_url": f"/compare/refinements/{refine_id}",
+            }
+
         print(f"✅ Found {len(matches)} matches")
         
         # Ensure all data is JSON serializable
@@ -44,6 +78,7 @@ async def compare_reference_to_videos(req: CompareRequest):
             "matches": matches,
             "matches_count": len(matches),
             "searched_all_videos": req.job_id is None,
+            "refinement": refinement,
             "message": f"Found {len(matches)} top matches"
         }
         
@@ -61,4 +96,31 @@ async def compare_reference_to_videos(req: CompareRequest):
         error_trace = traceback.format_exc()
         print(f"❌ Error in comparison: {str(e)}")
         print(error_trace)
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/refinements/{refine_id}")
+async def get_refinement_result(refine_id: str):
+    """
+    Status of a queued refinement. Once completed, the comparison is run
+    again with the original parameters and the re-scored matches returned.
+    """
+    job = await run_in_threadpool(get_refinement, refine_id, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Refinement not found: {refine_id}")
+
+    response = {
+        "refine_id": refine_id,
+        "status": job.get("status"),
+        "windows": job.get("windows"),
+        "error": job.get("error"),
+    }
+    if job.get("status") == STATUS_COMPLETED:
+        params = job["request"]
+        matches = await run_in_threadpool(
+            _comparator(params).compare_reference,
+            reference_id=params["reference_id"],
+            job_id=params["job_id"]
+        )
+        response.update(matches=matches, matches_count=len(matches))
+    return response
@@ -1,31 +1,56 @@
-from fastapi import APIRouter, UploadFile, File
+from fastapi import APIRouter, UploadFile, File, BackgroundTasks
 import os
-import shutil
-from app.ml.detector import PersonDetector
+import cv2
+import numpy as np
+from app.ml.model_registry import get_detector
+from app.db.file_index import register_file, KIND_UPLOADS
 
 router = APIRouter(prefix="/detect", tags=["Detection"])
 
-# Initialize YOLO detector once
-detector = PersonDetector()
-
 # Base directories
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 UPLOAD_DIR = os.path.join(BASE_DIR, "data", "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+
+async def read_upload_image(file: UploadFile):
+    """Read an uploaded image once: returns (raw bytes, decoded BGR array or None)."""
+    data = await file.read()
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR) if data else None
+    return data, img
+
+
+def save_upload_bytes(data: bytes, path: str):
+    """Persist the original upload (run as a background task, after the response)."""
+    with open(path, "wb") as buffer:
+        buffer.write(data)
+
+
+def _persist_detect_upload(data: bytes, path: str):
+    """Background part of /detect: save the original and make it servable by filename."""
+    save_upload_bytes(data, path)
+    register_file(KIND_UPLOADS, path)
+
+
 @router.post("/")
-async def detect_person(file: UploadFile = File(...)):
+async def detect_person(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     """
     Endpoint: /detect/
     Upload an image → Detect persons → Return list of cropped detections.
+    The image is decoded once from the request; the original is saved in the background.
     """
-    # Save uploaded file
+    data, img = await read_upload_image(file)
+
+    # Save uploaded file (off the critical path)
     file_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    background_tasks.add_task(_persist_detect_upload, data, file_path)
 
-    # Run person detection (creates its own session folder)
-    detections = detector.detect_persons(file_path)
+    if img is None:
+        print(f"⚠️ Could not decode uploaded image {file.filename}")
+        detections = []
+    else:
+        # Run person detection (shared YOLO model, loaded on first use)
+        detections = get_detector().detect_persons_from_frame(img)
 
     return {
         "message": "Detection completed successfully",
@@ -1,53 +1,74 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
+from email.utils import formatdate, parsedate_to_datetime
+from hashlib import md5
 import os
 from pathlib import Path
+from app.db import file_index
 
 router = APIRouter()
 
+
+def cached_file_response(request: Request, path, media_type="image/jpeg", max_age=3600):
+    """
+    FileResponse with ETag / Last-Modified validators; answers 304 when the
+    browser's If-None-Match / If-Modified-Since still matches the file.
+    """
+    st = os.stat(path)
+    # Same validators FileResponse itself would send
+    etag = f'"{md5(f"{st.st_mtime}-{st.st_size}".encode()).hexdigest()}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": f"public, max-age={max_age}",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        if etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                if int(st.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp():
+                    return Response(status_code=304, headers=headers)
+            except (TypeError, ValueError):
+                pass
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=st)
+
+
+def _resolve_output_file(filename: str):
+    # Person crops from video outputs first, then reference uploads
+    path = file_index.lookup(filename, [file_index.KIND_PERSONS, file_index.KIND_UPLOADS])
+    if path is None:
+        # Same upload with a different extension
+        path = file_index.lookup_stem(filename.rsplit('.', 1)[0], file_index.KIND_UPLOADS)
+    if path is None:
+        # Uploads written before they were indexed
+        candidate = file_index.UPLOADS_DIR / os.path.basename(filename)
+        if candidate.is_file():
+            file_index.register_file(file_index.KIND_UPLOADS, candidate)
+            path = str(candidate)
+    return path
+
+
 @router.get("/outputs/search/{filename}")
-async def get_output_file(filename: str):
+async def get_output_file(filename: str, request: Request):
     """
     Serve cropped person images from outputs OR uploads directory
+    (resolved through the filename index, app.db.file_index)
     """
-    # Try outputs directory first (for video frames)
-    output_dir = Path("app/data/outputs")
-    
-    # Search in all persons_ folders
-    for persons_folder in output_dir.glob("persons_*"):
-        potential_file = persons_folder / filename
-        if potential_file.exists():
-            return FileResponse(
-                potential_file, 
-                media_type="image/jpeg",
-                headers={"Cache-Control": "public, max-age=3600"}
-            )
-    
-    # Try uploads directory (for reference images)
-    uploads_dir = Path("app/data/uploads")
-    upload_file = uploads_dir / filename
-    if upload_file.exists():
-        return FileResponse(
-            upload_file,
-            media_type="image/jpeg",
-            headers={"Cache-Control": "public, max-age=3600"}
+    path = await run_in_threadpool(_resolve_output_file, filename)
+    if path is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"File not found: {filename}"
         )
-    
-    # Try with different extensions in uploads
-    for ext in ['.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG']:
-        name_without_ext = filename.rsplit('.', 1)[0]
-        potential_file = uploads_dir / f"{name_without_ext}{ext}"
-        if potential_file.exists():
-            return FileResponse(
-                potential_file,
-                media_type="image/jpeg",
-                headers={"Cache-Control": "public, max-age=3600"}
-            )
-    
-    raise HTTPException(
-        status_code=404, 
-        detail=f"File not found: {filename}"
-    )
+    return cached_file_response(request, path)
 
 @router.get("/outputs/debug")
 async def debug_outputs():
@@ -1,26 +1,18 @@
 # app/routes/reference.py
-from fastapi import APIRouter, UploadFile, File
+from fastapi import APIRouter, UploadFile, File, BackgroundTasks
 import os
-import shutil
 from datetime import datetime
-from app.ml.embeddings import EmbeddingModel
-from app.ml.faiss_store import FaissIndex
-from app.ml.detector import PersonDetector
+from app.ml.model_registry import get_detector, get_embedding_model, get_face_analyzer, get_faiss_index
+from app.ml.embeddings import FACE_MODE
+from app.ml.face_quality import new_face_gate
 from collections import Counter
 import cv2
 import numpy as np
-from dotenv import load_dotenv
-from pymongo import MongoClient
-
-# -------------------- Load environment variables --------------------
-load_dotenv()
-MONGO_URI = os.getenv("MONGO_URI")
-DB_NAME = os.getenv("DB_NAME")
-COLLECTION_NAME = os.getenv("COLLECTION_NAME")
-
-client = MongoClient(MONGO_URI)
-db = client[DB_NAME]
-collection = db[COLLECTION_NAME]
+from app.db.mongo import reference_embeddings as collection
+from app.db.reference_links import link_reference
+from app.db.file_index import register_file, register_files, KIND_UPLOADS, KIND_REFERENCE_CROPS
+from app.db.dashboard_summary import increment_counter, record_reference, REFERENCE_EXTENSIONS
+from app.routes.detection import read_upload_image, save_upload_bytes
 
 router = APIRouter(tags=["Reference"])
 
@@ -31,11 +23,6 @@ CROPS_DIR = os.path.join(BASE_DIR, "data", "reference_crops")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(CROPS_DIR, exist_ok=True)
 
-# -------------------- Load models --------------------
-embedding_model = EmbeddingModel()
-faiss_index = FaissIndex()
-detector = PersonDetector()
-
 def get_dominant_color(image, k=4):
     """Estimate dominant clothing color (simple heuristic)."""
     img = cv2.resize(image, (100, 100))
@@ -44,29 +31,57 @@ def get_dominant_color(image, k=4):
     most_common = Counter(pixels).most_common(1)[0][0]
     return tuple(map(int, most_common))
 
+def _persist_reference_upload(data, file_path, filename, crops, summary):
+    """
+    Background part of /reference/add: write the original and the crops,
+    then update the file index, dashboard link and counters.
+    """
+    save_upload_bytes(data, file_path)
+    register_file(KIND_UPLOADS, file_path)
+    for crop_path, crop in crops:
+        cv2.imwrite(crop_path, crop)
+    register_files(KIND_REFERENCE_CROPS, [crop_path for crop_path, _ in crops])
+
+    # Precompute the reference -> video job link used by the dashboard
+    link_reference(filename[:15], filename)
+    if os.path.splitext(filename)[1].lower() in REFERENCE_EXTENSIONS:
+        increment_counter("total_references")
+    record_reference(filename, gender=summary.get("gender"), age=summary.get("age"))
+
+
 @router.post("/add")
-async def add_reference(file: UploadFile = File(...)):
-    """Add a new reference image to FAISS index + MongoDB + save top-35% crops"""
+async def add_reference(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+    """
+    Add a new reference image to FAISS index + MongoDB + save top-35% crops.
+    The upload is decoded once in memory; the original and crops are written
+    to disk in a background task after the response.
+    """
     try:
+        # Shared models from the process-wide registry (loaded on first use)
+        detector = get_detector()
+        faiss_index = get_faiss_index()
+
         filename = datetime.now().strftime("%Y%m%d_%H%M%S_") + file.filename
         file_path = os.path.join(UPLOAD_DIR, filename)
 
-        # Save uploaded file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Read + decode the upload once; the array is shared by detection, embedding and crops
+        data, img = await read_upload_image(file)
+
+        # Saved after the response; `crops` and `summary` are filled in below
+        crops, summary = [], {}
+        background_tasks.add_task(_persist_reference_upload, data, file_path, filename, crops, summary)
 
-        # Read image
-        img = cv2.imread(file_path)
         if img is None:
             return {"error": "Invalid image file."}
 
         # Detect persons using YOLO
-        detections = detector.detect_persons(file_path)
+        detections = detector.detect_persons_from_frame(img)
         if len(detections) == 0:
             return {"error": "No person detected in the uploaded image."}
 
-        all_results = []
-
+        # Drop tiny / blurred / badly exposed faces before any face model runs
+        face_gate = new_face_gate()
+        candidates, rejected = [], []
         for i, det in enumerate(detections):
             x1, y1, x2, y2 = det["box"]
             h_crop = int((y2 - y1) * 0.35)  # crop top 35% of the person box
@@ -75,21 +90,47 @@ async def add_reference(file: UploadFile = File(...)):
             if face_crop.size == 0:
                 continue
 
-            # Save crop to disk
+            reason = face_gate.check(face_crop) if face_gate is not None else None
+            if reason is not None:
+                print(f"🚫 Person {i + 1} rejected by face-quality gate: {reason}")
+                rejected.append({"person": i, "reason": reason})
+                continue
+            candidates.append((i, det, face_crop))
+
+        # Faces for every person box: one frame-level pass (FACE_MODE=frame)
+        # or FaceAnalysis on each person's crop (FACE_MODE=crop)
+        if FACE_MODE == "frame":
+            person_faces = get_face_analyzer().analyze([img], [[det["box"] for _, det, _ in candidates]])[0]
+        else:
+            embedding_model = get_embedding_model()
+
+        all_results = []
+
+        for c, (i, det, face_crop) in enumerate(candidates):
+            # Crop is written to disk in the background task
             crop_filename = f"{filename}_person{i}.jpg"
             crop_path = os.path.join(CROPS_DIR, crop_filename)
-            cv2.imwrite(crop_path, face_crop)
+            crops.append((crop_path, face_crop))
 
             # Detect face and embedding from crop
-            faces = embedding_model.model.get(face_crop)
-            if len(faces) == 0:
-                print(f"🚫 No face found in person {i + 1}")
-                continue
-
-            face = faces[0]
-            age = int(face.age)
-            gender = "Male" if face.gender > 0.5 else "Female"
-            emb = face.embedding.astype("float32")
+            if FACE_MODE == "frame":
+                face = person_faces[c]
+                if face is None:
+                    print(f"🚫 No face found in person {i + 1}")
+                    continue
+                age = face["age"]
+                gender = face["gender"]
+                emb = face["embedding"]
+            else:
+                faces = embedding_model.model.get(face_crop)
+                if len(faces) == 0:
+                    print(f"🚫 No face found in person {i + 1}")
+                    continue
+
+                face = faces[0]
+                age = int(face.age)
+                gender = "Male" if face.gender > 0.5 else "Female"
+                emb = face.embedding.astype("float32")
             color = get_dominant_color(face_crop)
 
             # Print info on terminal
@@ -126,7 +167,32 @@ async def add_reference(file: UploadFile = File(...)):
                 "crop_path": crop_path
             })
 
-        return {"message": "Reference(s) added successfully.", "results": all_results}
+        if all_results:
+            summary.update(gender=all_results[0]["gender"], age=all_results[0]["age"])
+
+        return {
+            "message": "Reference(s) added successfully.",
+            "results": all_results,
+            "rejected": rejected,
+            "face_quality": face_gate.stats if face_gate is not None else None,
+        }
+
+    except Exception as e:
+        print("❌ ERROR:", e)
+        return {"error": str(e)}
+
+
+@router.delete("/{person_id}")
+async def delete_reference(person_id: str):
+    """Retire a reference: drop it from the FAISS index and MongoDB."""
+    try:
+        removed = get_faiss_index().remove(person_id)
+        deleted = collection.delete_many({"person_id": person_id}).deleted_count
+
+        if not removed and not deleted:
+            return {"error": f"Reference not found: {person_id}"}
+
+        return {"message": "Reference removed.", "person_id": person_id, "index_removed": removed, "documents_deleted": deleted}
 
     except Exception as e:
         print("❌ ERROR:", e)
@@ -1,6 +1,8 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from pathlib import Path
+from app.db import file_index
+from app.routes.files import cached_file_response
 
 router = APIRouter()
 
@@ -8,7 +10,7 @@ REFERENCE_CROPS_DIR = Path("app/data/reference_crops")
 OUTPUTS_DIR = Path("app/data/outputs")
 
 @router.get("/image/{filename}")
-async def serve_reference_or_frame_image(filename: str):
+async def serve_reference_or_frame_image(filename: str, request: Request):
     """
     Serve images from either reference_crops or outputs/frames_* directories.
     Example:
@@ -17,34 +19,18 @@ async def serve_reference_or_frame_image(filename: str):
     """
     print(f"🖼️ Image request: {filename}")
 
-    # 1️⃣ Search in reference_crops first
-    if REFERENCE_CROPS_DIR.exists():
-        for file in REFERENCE_CROPS_DIR.iterdir():
-            if file.name == filename:
-                print(f"✅ Found in reference_crops: {file}")
-                return FileResponse(
-                    file,
-                    media_type="image/jpeg",
-                    headers={"Cache-Control": "public, max-age=3600"}
-                )
-
-    # 2️⃣ Search in outputs/frames_* directories
-    if OUTPUTS_DIR.exists():
-        for folder in OUTPUTS_DIR.glob("frames_*"):
-            potential_file = folder / filename
-            if potential_file.exists():
-                print(f"✅ Found in outputs: {potential_file}")
-                return FileResponse(
-                    potential_file,
-                    media_type="image/jpeg",
-                    headers={"Cache-Control": "public, max-age=3600"}
-                )
-
-    print(f"❌ File not found in either location: {filename}")
-    raise HTTPException(
-        status_code=404,
-        detail=f"Image not found: {filename}"
+    # reference_crops first, then outputs/frames_* (one indexed lookup)
+    path = await run_in_threadpool(
+        file_index.lookup, filename, [file_index.KIND_REFERENCE_CROPS, file_index.KIND_FRAMES]
     )
+    if path is None:
+        print(f"❌ File not found in either location: {filename}")
+        raise HTTPException(
+            status_code=404,
+            detail=f"Image not found: {filename}"
+        )
+
+    return cached_file_response(request, path)
 
 
 @router.get("/list")
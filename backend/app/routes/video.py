@@ -1,75 +1,101 @@
 # app/routes/video.py
 import os
 import shutil
-from datetime import datetime
-from fastapi import APIRouter, UploadFile, File
-from app.ml.pipeline import VideoProcessingPipeline
-from pymongo import MongoClient
-from dotenv import load_dotenv
+from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from app.ml.job_queue import enqueue_video_job, get_job, STATUS_QUEUED
+from app.ml.video_probe import probe_video
+from app.db.dashboard_summary import increment_counter
 import uuid
 
-load_dotenv()
-
 router = APIRouter()
 
-# MongoDB setup
-MONGO_URI = os.getenv("MONGO_URI")
-DB_NAME = os.getenv("DB_NAME")
-client = MongoClient(MONGO_URI)
-db = client[DB_NAME]
-
 # Base folder to save uploaded videos
 BASE_VIDEO_DIR = "app/data/uploads/videos"
 os.makedirs(BASE_VIDEO_DIR, exist_ok=True)
 
-# Initialize pipeline
-pipeline = VideoProcessingPipeline()
+
+def _save_upload(upload: UploadFile, path: str):
+    with open(path, "wb") as buffer:
+        shutil.copyfileobj(upload.file, buffer)
+
 
 @router.post("/upload")
 async def upload_video(video: UploadFile = File(...), metadata: dict = {}):
     """
-    Uploads a video and runs the detection + embedding pipeline.
+    Uploads a video and queues it for the detection + embedding pipeline.
+    Returns immediately with a job_id; poll /video/jobs/{job_id} for status.
     metadata: optional dictionary with info like camera location, time, etc.
     """
     # Generate unique job ID
     job_id = str(uuid.uuid4())
 
-    # Save uploaded video
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    # Save uploaded video (off the event loop)
     video_folder = os.path.join(BASE_VIDEO_DIR, f"{job_id}")
     os.makedirs(video_folder, exist_ok=True)
 
     video_path = os.path.join(video_folder, video.filename)
-    with open(video_path, "wb") as buffer:
-        shutil.copyfileobj(video.file, buffer)
+    await run_in_threadpool(_save_upload, video, video_path)
+    if video_path.endswith(".mp4"):
+        await run_in_threadpool(increment_counter, "total_videos")
 
-    # Run pipeline safely
-    try:
-        result = pipeline.process_video(video_path, metadata=metadata, job_id=job_id)
-    except Exception as e:
-        return {"error": f"Pipeline failed: {str(e)}"}
+    # Probe once; metadata lookups are served from the job doc from now on
+    video_info = await run_in_threadpool(probe_video, video_path)
 
-    # Ensure detections key exists
-    if "detections" not in result:
-        result["detections"] = []
+    # Queue the job; a worker process will run the pipeline
+    await run_in_threadpool(enqueue_video_job, job_id, video.filename, video_path, metadata, video_info)
 
-    # Save job info in MongoDB
-    job_doc = {
+    return {
+        "message": "Video uploaded and queued for processing",
         "job_id": job_id,
-        "video_name": video.filename,
-        "video_path": video_path,
-        "frames_saved": result["frames_saved"],
-        "persons_saved": result["persons_saved"],
-        "detections": result["detections"],
-        "metadata": metadata,
-        "created_at": datetime.utcnow()
+        "status": STATUS_QUEUED,
+        "status_url": f"/video/jobs/{job_id}",
+        "progress_url": f"/video/jobs/{job_id}/progress"
     }
-    db.video_jobs.insert_one(job_doc)
 
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """
+    Returns the status and result summary of a video processing job.
+    """
+    job = await run_in_threadpool(get_job, job_id, {"_id": 0, "detections": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+    return {
+        "job_id": job_id,
+        "video_name": job.get("video_name"),
+        "status": job.get("status"),
+        "attempts": job.get("attempts", 0),
+        "progress": job.get("progress"),
+        "frames_saved": job.get("frames_saved", 0),
+        "persons_saved": job.get("persons_saved", 0),
+        "sampling": job.get("sampling"),
+        "tracking": job.get("tracking"),
+        "face_quality": job.get("face_quality"),
+        "error": job.get("error"),
+        "created_at": str(job.get("created_at")) if job.get("created_at") else None,
+        "started_at": str(job.get("started_at")) if job.get("started_at") else None,
+        "finished_at": str(job.get("finished_at")) if job.get("finished_at") else None,
+    }
+
+
+@router.get("/jobs/{job_id}/progress")
+async def get_job_progress(job_id: str):
+    """
+    Lightweight progress endpoint for polling.
+    """
+    job = await run_in_threadpool(get_job, job_id, {"_id": 0, "status": 1, "progress": 1, "error": 1})
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+    progress = job.get("progress") or {}
     return {
-        "message": "Video uploaded and processed successfully",
         "job_id": job_id,
-        "frames_saved": job_doc["frames_saved"],
-        "persons_saved": job_doc["persons_saved"],
-        "detections_count": len(result["detections"])
+        "status": job.get("status"),
+        "frames_processed": progress.get("frames_processed", 0),
+        "total_frames": progress.get("total_frames", 0),
+        "percent": progress.get("percent", 0.0),
+        "error": job.get("error"),
     }
@@ -4,13 +4,11 @@ import uuid
 import shutil
 from datetime import datetime
 from fastapi import APIRouter, UploadFile, File
-from ultralytics import YOLO
+from app.ml.frame_source import FrameSource
+from app.ml.model_registry import get_detector
 
 router = APIRouter()
 
-# Load YOLO model (make sure it's available)
-model = YOLO("yolov8n.pt")
-
 # Base directory for data
 BASE_DIR = "app/data/videos"
 os.makedirs(BASE_DIR, exist_ok=True)
@@ -42,19 +40,16 @@ async def detect_video(video: UploadFile = File(...)):
     with open(video_path, "wb") as buffer:
         shutil.copyfileobj(video.file, buffer)
 
-    # Process the video
-    cap = cv2.VideoCapture(video_path)
-    frame_count = 0
+    # Shared YOLO model from the registry
+    model = get_detector("yolov8n.pt").model
+
+    # Process the video (only every Nth frame is decoded)
     saved_frames = 0
     saved_crops = 0
 
-    while True:
-        success, frame = cap.read()
-        if not success:
-            break
-
-        # Process every Nth frame
-        if frame_count % FRAME_INTERVAL == 0:
+    with FrameSource(video_path) as source:
+        for sampled in source.sample(FRAME_INTERVAL):
+            frame = sampled.image
             results = model(frame)
             detections = results[0].boxes.data.cpu().numpy()
 
@@ -76,10 +71,6 @@ async def detect_video(video: UploadFile = File(...)):
                 cv2.imwrite(os.path.join(frames_folder, frame_filename), frame)
                 saved_frames += 1
 
-        frame_count += 1
-
-    cap.release()
-
     return {
         "message": "Video processed successfully",
         "video_folder": video_folder,
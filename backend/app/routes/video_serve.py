@@ -1,84 +1,170 @@
-from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 import os
+import json
+import mimetypes
+import uuid
 from pathlib import Path
-import cv2
+from typing import Optional
+from app.ml import video_probe, thumbnails, keyframes as keyframes_index
 
 router = APIRouter()
 
 # Videos are stored in subdirectories: app/data/uploads/videos/{job_id}/video.mp4
 VIDEO_BASE_DIR = Path("app/data/uploads/videos")
 
+STREAM_CHUNK_SIZE = 1024 * 1024
+CLIP_CACHE_MB = float(os.getenv("CLIP_CACHE_MB", 1024))
+STREAM_CLIP_SECONDS = float(os.getenv("STREAM_CLIP_SECONDS", 120))  # length of a start_time stream
+_clip_cache = None
+
+
+def _parse_range(range_header: str, file_size: int):
+    """
+    Parse a single "bytes=start-end" range. Returns (start, end) inclusive,
+    "unsatisfiable", or None when the header should be ignored (malformed,
+    multiple ranges) and the whole file sent.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            length = int(last)
+            if length <= 0:
+                return "unsatisfiable"
+            return max(0, file_size - length), file_size - 1
+        start = int(first)
+        end = int(last) if last else file_size - 1
+    except ValueError:
+        return None
+    if start >= file_size:
+        return "unsatisfiable"
+    if end < start:
+        return None
+    return start, min(end, file_size - 1)
+
+
+def _iter_file(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _video_media_type(path):
+    return mimetypes.guess_type(str(path))[0] or "video/mp4"
+
+
+async def _video_path_or_404(job_id: str):
+    info = await run_in_threadpool(video_probe.get_video_info, job_id)
+    if info is None:
+        print(f"❌ Video file not found for job_id: {job_id}")
+        raise HTTPException(status_code=404, detail=f"Video file not found for job_id: {job_id}")
+    return Path(info["video_path"])
+
+
 @router.get("/stream/{job_id}")
 async def stream_video(
+    request: Request,
     job_id: str,
-    start_time: int = Query(0, description="Start time in seconds")
+    start_time: float = Query(0, description="Start time in seconds")
 ):
     """
-    Stream video file by job_id with optional start time
+    Stream video file by job_id with HTTP Range support (206 partial content),
+    so players fetch only the bytes they need and can seek.
     Videos are stored in: app/data/uploads/videos/{job_id}/
+
+    With start_time > 0 the request (Range requests included, so every byte
+    a player fetches for this URL comes from the same file) is redirected to
+    a keyframe-aligned /clip copy starting there, STREAM_CLIP_SECONDS long,
+    whose #t= fragment skips to start_time. Without ffmpeg the whole file is
+    served and players seek through the #t= fragment on the dashboard URLs.
     """
     print(f"🎬 Video stream request for job_id: {job_id}")
-    
-    # The video is inside a folder named by job_id
-    job_dir = VIDEO_BASE_DIR / job_id
-    print(f"   Looking in directory: {job_dir.absolute()}")
-    
-    if not job_dir.exists():
-        print(f"❌ Job directory does not exist: {job_dir.absolute()}")
-        raise HTTPException(
-            status_code=404, 
-            detail=f"Video folder not found for job_id: {job_id}"
-        )
-    
-    # List files in job directory
-    files_in_dir = list(job_dir.glob("*"))
-    print(f"   Files in job directory: {[f.name for f in files_in_dir]}")
-    
-    # Try to find video file (usually named after original or just "video")
-    video_path = None
-    
-    # Try common video filenames
-    possible_names = [
-        "video",           # Generic name
-        job_id,            # Named after job_id
-        "output",          # Sometimes named output
-        "processed",       # Sometimes named processed
-    ]
-    
-    for base_name in possible_names:
-        for ext in ['.mp4', '.avi', '.mov', '.mkv', '.MP4', '.AVI', '.MOV']:
-            potential_path = job_dir / f"{base_name}{ext}"
-            if potential_path.exists():
-                video_path = potential_path
-                print(f"   ✅ Found video: {video_path}")
-                break
-        if video_path:
-            break
-    
-    # If still not found, just get the first video file in the directory
-    if not video_path:
-        video_extensions = ['.mp4', '.avi', '.mov', '.mkv', '.MP4', '.AVI', '.MOV']
-        for file in job_dir.iterdir():
-            if file.is_file() and file.suffix in video_extensions:
-                video_path = file
-                print(f"   ✅ Found video by extension: {video_path}")
-                break
-    
-    if not video_path or not video_path.exists():
-        print(f"❌ Video file not found in directory: {job_dir}")
-        raise HTTPException(
-            status_code=404, 
-            detail=f"Video file not found in {job_id} directory. Files present: {[f.name for f in files_in_dir]}"
+    video_path = await _video_path_or_404(job_id)
+    file_size = video_path.stat().st_size
+    media_type = _video_media_type(video_path)
+
+    if start_time > 0 and keyframes_index.ffmpeg_available():
+        keyframes = await run_in_threadpool(keyframes_index.get_keyframe_index, job_id, video_path)
+        keyframe = keyframes_index.keyframe_at(keyframes, start_time)
+        # The clip starts at the keyframe; its own #t= replaces the caller's
+        # fragment and skips the remaining lead-in
+        lead_in = max(0.0, start_time - keyframe[0]) if keyframe else 0.0
+        return RedirectResponse(
+            f"{request.url_for('get_video_clip', job_id=job_id).path}"
+            f"?start_time={start_time}&duration={STREAM_CLIP_SECONDS}#t={lead_in:.3f}",
+            status_code=307,
         )
-    
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"inline; filename={video_path.name}"
+    }
+
+    range_header = request.headers.get("range")
+    byte_range = _parse_range(range_header, file_size) if range_header else None
+    if byte_range is None:
+        return FileResponse(video_path, media_type=media_type, headers=headers)
+    if byte_range == "unsatisfiable":
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{file_size}"})
+
+    start, end = byte_range
+    headers.update({
+        "Content-Range": f"bytes {start}-{end}/{file_size}",
+        "Content-Length": str(end - start + 1),
+    })
+    return StreamingResponse(_iter_file(video_path, start, end), status_code=206, media_type=media_type, headers=headers)
+
+
+@router.get("/clip/{job_id}")
+async def get_video_clip(
+    job_id: str,
+    start_time: float = Query(0, ge=0, description="Clip start in seconds (snapped to the previous keyframe)"),
+    duration: float = Query(10, gt=0, le=max(120, STREAM_CLIP_SECONDS), description="Clip length in seconds")
+):
+    """
+    Short MP4 clip around a match, cut by stream copy (no re-encode) and
+    cached on disk. Requires ffmpeg on PATH.
+    """
+    global _clip_cache
+    if not keyframes_index.ffmpeg_available():
+        raise HTTPException(status_code=501, detail="Clip extraction needs ffmpeg installed on the server")
+
+    video_path = await _video_path_or_404(job_id)
+    keyframes = await run_in_threadpool(keyframes_index.get_keyframe_index, job_id, video_path)
+    keyframe = keyframes_index.keyframe_at(keyframes, start_time)
+    start = keyframe[0] if keyframe else start_time
+
+    if _clip_cache is None:
+        _clip_cache = thumbnails.DiskLRUCache("app/data/clips", int(CLIP_CACHE_MB * 1024 * 1024))
+    key = os.path.join(job_id, f"clip_{start:.3f}_{duration:.3f}.mp4")
+    path = _clip_cache.get(key)
+    if path is None:
+        # Unique per request: concurrent requests for one clip each write their
+        # own file, and the last complete one replaces the other in the cache
+        tmp_path = os.path.join(_clip_cache.cache_dir, f"{key}.tmp.{uuid.uuid4().hex}.mp4")
+        try:
+            await run_in_threadpool(keyframes_index.extract_clip, video_path, start, duration, tmp_path)
+        except Exception as e:
+            print(f"❌ Clip extraction failed for {job_id}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise HTTPException(status_code=500, detail="Clip extraction failed")
+        path = _clip_cache.put_file(key, tmp_path)
+
     return FileResponse(
-        video_path,
+        path,
         media_type="video/mp4",
-        headers={
-            "Accept-Ranges": "bytes",
-            "Content-Disposition": f"inline; filename={video_path.name}"
-        }
+        headers={"Cache-Control": "public, max-age=86400", "X-Clip-Start": str(start)}
     )
 
 @router.get("/thumbnail/{job_id}")
@@ -87,89 +173,98 @@ async def get_video_thumbnail(
     frame_number: int = Query(0, description="Frame number to capture")
 ):
     """
-    Generate thumbnail from video at specific frame
+    Thumbnail of a video frame: precomputed for detection frames,
+    otherwise decoded once and kept in the on-disk LRU cache.
     """
     print(f"🖼️ Thumbnail request for job_id: {job_id}, frame: {frame_number}")
-    
-    job_dir = VIDEO_BASE_DIR / job_id
-    
-    if not job_dir.exists():
-        raise HTTPException(status_code=404, detail=f"Video folder not found: {job_id}")
-    
-    # Find video file
-    video_path = None
-    video_extensions = ['.mp4', '.avi', '.mov', '.mkv', '.MP4', '.AVI', '.MOV']
-    for file in job_dir.iterdir():
-        if file.is_file() and file.suffix in video_extensions:
-            video_path = file
-            break
-    
-    if not video_path:
+
+    info = await run_in_threadpool(video_probe.get_video_info, job_id)
+    if info is None:
         raise HTTPException(status_code=404, detail=f"Video file not found in {job_id}")
-    
-    # Extract frame
-    cap = cv2.VideoCapture(str(video_path))
-    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-    ret, frame = cap.read()
-    cap.release()
-    
-    if not ret:
+
+    path = await run_in_threadpool(thumbnails.frame_thumbnail, job_id, info["video_path"], frame_number)
+    if path is None:
         raise HTTPException(status_code=404, detail="Could not extract frame")
-    
-    # Encode as JPEG
-    _, buffer = cv2.imencode('.jpg', frame)
-    
-    return StreamingResponse(
-        iter([buffer.tobytes()]),
-        media_type="image/jpeg"
+
+    return FileResponse(
+        path,
+        media_type="image/jpeg",
+        headers={"Cache-Control": "public, max-age=86400"}
     )
 
-@router.get("/info/{job_id}")
-async def get_video_info(job_id: str):
+@router.get("/sprite/{job_id}")
+async def get_video_sprite(
+    job_id: str,
+    count: int = Query(20, ge=1, le=200, description="Number of frames in the sheet"),
+    columns: int = Query(5, ge=1, le=50, description="Tiles per row"),
+    tile_width: int = Query(160, ge=16, le=640, description="Width of one tile in pixels"),
+    start_time: float = Query(0, ge=0, description="Timeline start in seconds"),
+    end_time: Optional[float] = Query(None, ge=0, description="Timeline end in seconds (default: end of video)")
+):
     """
-    Get video metadata (duration, fps, resolution)
-    ✅ Returns real FPS, frame count, and duration.
+    Timeline sprite sheet: `count` evenly spaced frames tiled row by row,
+    decoded in a single sequential pass. Tile order/positions are described
+    by the X-Sprite-* headers (frame numbers and timestamps per tile).
     """
-    job_dir = VIDEO_BASE_DIR / job_id
-    
-    if not job_dir.exists():
-        raise HTTPException(status_code=404, detail=f"Video folder not found: {job_id}")
-    
-    # Find first valid video file
-    video_path = None
-    video_extensions = ['.mp4', '.avi', '.mov', '.mkv', '.MP4', '.AVI', '.MOV']
-    for file in job_dir.iterdir():
-        if file.is_file() and file.suffix in video_extensions:
-            video_path = file
-            break
-    
-    if not video_path:
+    info = await run_in_threadpool(video_probe.get_video_info, job_id)
+    if info is None:
         raise HTTPException(status_code=404, detail=f"Video file not found in {job_id}")
 
-    # ✅ Extract info using OpenCV
-    cap = cv2.VideoCapture(str(video_path))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    cap.release()
+    fps = info["fps"]
+    start = int(start_time * fps)
+    end = int(end_time * fps) if end_time is not None else info["frame_count"]
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end_time must be after start_time")
 
-    # Handle bad FPS readings (some videos return 0 or NaN)
-    if not fps or fps <= 1:
-        print(f"⚠️ Invalid FPS ({fps}) for {video_path.name}, defaulting to 30.0")
-        fps = 30.0
+    cache = thumbnails.get_thumbnail_cache()
+    key = os.path.join(job_id, f"sprite_{start}_{end}_{count}_{columns}_{tile_width}")
+    image_path, meta_path = cache.get(key + ".jpg"), cache.get(key + ".json")
+    if image_path and meta_path:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    else:
+        data, frames, tile = await run_in_threadpool(
+            thumbnails.build_sprite, info["video_path"], count, columns, tile_width, start, end
+        )
+        if data is None:
+            raise HTTPException(status_code=404, detail="Could not extract frames")
+        meta = {"frames": frames, "tile": tile, "columns": columns}
+        image_path = cache.put(key + ".jpg", data)
+        cache.put(key + ".json", json.dumps(meta).encode())
 
-    duration = frame_count / fps if fps > 0 else 0
-    print(f"🎞️ Video Info → {video_path.name}: {frame_count} frames, {fps:.2f} fps, {duration:.2f}s total")
+    return FileResponse(
+        image_path,
+        media_type="image/jpeg",
+        headers={
+            "Cache-Control": "public, max-age=86400",
+            "X-Sprite-Columns": str(meta["columns"]),
+            "X-Sprite-Tile": f"{meta['tile'][0]}x{meta['tile'][1]}",
+            "X-Sprite-Frames": ",".join(str(f[0]) for f in meta["frames"]),
+            "X-Sprite-Timestamps": ",".join(str(f[1]) for f in meta["frames"]),
+        }
+    )
+
+@router.get("/info/{job_id}")
+async def get_video_info(job_id: str):
+    """
+    Get video metadata (duration, fps, resolution)
+    ✅ Returns real FPS, frame count, and duration.
+    Served from the probe stored at upload (cached in-process), not by
+    reopening the container.
+    """
+    info = await run_in_threadpool(video_probe.get_video_info, job_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail=f"Video file not found for job_id: {job_id}")
 
+    duration = info["duration_seconds"]
     return {
         "job_id": job_id,
-        "filename": video_path.name,
-        "fps": round(float(fps), 2),
-        "frame_count": frame_count,
-        "duration_seconds": round(float(duration), 2),
+        "filename": info["filename"],
+        "fps": info["fps"],
+        "frame_count": info["frame_count"],
+        "duration_seconds": duration,
         "duration_formatted": f"{int(duration // 60):02d}:{int(duration % 60):02d}",
-        "resolution": f"{width}x{height}"
+        "resolution": info["resolution"]
     }
 
 
@@ -242,34 +337,11 @@ async def debug_specific_job(job_id: str):
 def get_video_info_sync(job_id: str):
     """
     Synchronous helper for ML/comparison pipelines.
-    Reads FPS, frame count, and duration directly from disk (not through FastAPI).
+    Reads FPS, frame count, and duration from the cached probe (not through FastAPI).
     """
-    job_dir = VIDEO_BASE_DIR / job_id
-    if not job_dir.exists():
-        print(f"⚠️ Video directory not found: {job_dir}")
+    info = video_probe.get_video_info(job_id)
+    if info is None:
+        print(f"⚠️ No video file found for job_id: {job_id}")
         return {"fps": 30.0, "duration": 0, "frames": 0}
 
-    video_path = None
-    for file in job_dir.iterdir():
-        if file.suffix.lower() in [".mp4", ".avi", ".mov", ".mkv"]:
-            video_path = file
-            break
-
-    if not video_path or not video_path.exists():
-        print(f"⚠️ No video file found in {job_dir}")
-        return {"fps": 30.0, "duration": 0, "frames": 0}
-
-    cap = cv2.VideoCapture(str(video_path))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    cap.release()
-
-    # Handle invalid FPS
-    if not fps or fps <= 1:
-        print(f"⚠️ Invalid FPS ({fps}) for {video_path.name}, defaulting to 30.0")
-        fps = 30.0
-
-    duration = frame_count / fps if fps > 0 else 0
-    print(f"🎞️ [SYNC INFO] {video_path.name}: {frame_count} frames, {fps:.2f} fps, {duration:.2f}s total")
-
-    return {"fps": round(float(fps), 2), "duration": round(float(duration), 2), "frames": frame_count}
+    return {"fps": info["fps"], "duration": info["duration_seconds"], "frames": info["frame_count"]}
@@ -5,6 +5,11 @@ import os
 
 # Routers
 from app.routes import detection, video_detection, reference, video, comparison, files, video_serve, dashboard, reference_images
+from app.ml.job_queue import VideoJobWorkers
+from app.ml.model_registry import registry
+from app.db.mongo import ensure_indexes
+from app.db.file_index import ensure_file_index
+from app.db.dashboard_summary import ensure_recent_searches
 
 app = FastAPI(title="Missing Person Detection API", version="1.0")
 
@@ -17,10 +22,63 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Background worker processes for queued video jobs
+video_workers = VideoJobWorkers()
+
+@app.on_event("startup")
+def create_mongo_indexes():
+    try:
+        ensure_indexes()
+    except Exception as e:
+        print(f"⚠️ Could not create MongoDB indexes: {e}")
+
+@app.on_event("startup")
+def build_file_index():
+    # One-off scan of app/data when the filename index is empty
+    try:
+        ensure_file_index()
+    except Exception as e:
+        print(f"⚠️ Could not build the image file index: {e}")
+
+@app.on_event("startup")
+def backfill_recent_searches():
+    # One-off: record (and link) references uploaded before recent_searches existed
+    try:
+        ensure_recent_searches()
+    except Exception as e:
+        print(f"⚠️ Could not backfill recent searches: {e}")
+
+@app.on_event("startup")
+def start_video_workers():
+    video_workers.start()
+
+@app.on_event("startup")
+def preload_models():
+    # Models are loaded lazily on first request unless PRELOAD_MODELS=1
+    if os.getenv("PRELOAD_MODELS", "0") == "1":
+        registry.get_detector()
+        registry.get_embedding_model()
+        registry.get_faiss_index()
+
+@app.on_event("shutdown")
+def stop_video_workers():
+    video_workers.stop()
+
+@app.on_event("shutdown")
+def snapshot_reference_index():
+    # Fold the FAISS write-ahead log into a snapshot on clean shutdown
+    if "faiss:reference" in registry.loaded_models():
+        registry.get_faiss_index().snapshot()
+
 @app.get("/")
 def root():
     return {"message": "Backend is running successfully 🚀"}
 
+@app.get("/models/stats")
+def model_stats():
+    """Models loaded in this API process, with load timings and memory use."""
+    return registry.stats()
+
 # Include routers
 app.include_router(reference.router, prefix="/reference", tags=["Reference"])
 app.include_router(video.router, prefix="/video", tags=["Video"])
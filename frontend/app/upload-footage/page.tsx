@@ -28,12 +28,18 @@ export default function UploadFootagePage() {
     }
 
     setUploading(true);
-    setStatus("Uploading and processing video...");
+    setStatus("Uploading video...");
     setError("");
 
     try {
       const data = await api.uploadVideo(videoFile);
       setJobId(data.job_id || "");
+      setStatus(`Video queued for processing (Job ID: ${data.job_id})...`);
+      await api.waitForVideoJob(data.job_id, (progress) => {
+        if (progress.status === "processing") {
+          setStatus(`Processing video... ${Math.round(progress.percent || 0)}% (Job ID: ${data.job_id})`);
+        }
+      });
       setStatus(`✅ Video processed successfully! Job ID: ${data.job_id}`);
     } catch (err: any) {
       setError(err.message || "Failed to upload video");
@@ -59,6 +59,12 @@ export function useMissingPersonSearch() {
     try {
       const data = await api.uploadVideo(videoFile);
       setVideoJobId(data.job_id || "");
+      setStatusMsg(`Video queued for processing (Job ID: ${data.job_id})...`);
+      await api.waitForVideoJob(data.job_id, (progress) => {
+        if (progress.status === "processing") {
+          setStatusMsg(`Extracting frames... ${Math.round(progress.percent || 0)}% (Job ID: ${data.job_id})`);
+        }
+      });
       setStatusMsg(
         `✅ Video processed. Frames stored in database (Job ID: ${data.job_id})`
       );
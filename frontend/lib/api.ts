@@ -35,6 +35,33 @@ export const api = {
     return res.json();
   },
 
+  async getVideoJobProgress(jobId: string) {
+    const res = await fetch(`${API_BASE}/video/jobs/${jobId}/progress`);
+    if (!res.ok) {
+      const error = await res.text();
+      throw new Error(`Failed to get job progress: ${error}`);
+    }
+    return res.json();
+  },
+
+  // Uploads are processed in the background: poll until the job completes
+  // (resolves with its last progress) or fails (throws with its error).
+  async waitForVideoJob(
+    jobId: string,
+    onProgress?: (progress: any) => void,
+    intervalMs: number = 2000
+  ) {
+    while (true) {
+      const progress = await this.getVideoJobProgress(jobId);
+      onProgress?.(progress);
+      if (progress.status === "completed") return progress;
+      if (progress.status === "failed") {
+        throw new Error(`Video processing failed: ${progress.error || "unknown error"}`);
+      }
+      await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    }
+  },
+
   async compareReference(referenceId: string, jobId: string | null = null, topK: number = 20) {
     console.log('Comparing with:', { referenceId, jobId, topK });
     